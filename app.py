@@ -5,11 +5,19 @@ from routes.dashboard import dashboard_bp
 from routes.tunnels import tunnels_bp
 from routes.settings import settings_bp
 from routes.domains import domains_bp
-from core.tasks import task_queue, task_status
-from core.config_loader import load_config, save_config
+from core.tasks import task_status
+from core.executor import start_executor, DEFAULT_WORKERS
+from core.ssh_manager import DEFAULT_STEP_TIMEOUT
+from core.artifacts import SOURCE_PUSH
+from core.scan_jobs import resume_interrupted_scans
+from core.clean_ips import start_revalidation_scheduler, DEFAULT_TTL, DEFAULT_REVALIDATE_INTERVAL, DEFAULT_WARM_MIN
+from core.config_loader import save_config, ensure_defaults
+from core.collector import start_traffic_collector, DEFAULT_SAMPLE_INTERVAL, DEFAULT_FLUSH_INTERVAL
+from core.prober import start_tunnel_prober, DEFAULT_PROBE_INTERVAL, DEFAULT_PROBE_FLUSH
+from core.speedtest import DEFAULT_STREAMS, DEFAULT_DURATION, DEFAULT_WARMUP
+from core.reload import DEFAULT_DRAIN_TIMEOUT, DEFAULT_REFUSE_WINDOW
 from datetime import timedelta
 import os
-import threading
 import secrets
 import logging
 import sys
@@ -25,7 +33,23 @@ logging.basicConfig(
 logger = logging.getLogger("AlamorApp")
 
 # Load Config
-sys_config = load_config()
+sys_config = ensure_defaults({
+    'traffic_sample_interval': DEFAULT_SAMPLE_INTERVAL,
+    'traffic_flush_interval': DEFAULT_FLUSH_INTERVAL,
+    'task_workers': DEFAULT_WORKERS,
+    'ssh_step_timeout': DEFAULT_STEP_TIMEOUT,
+    'artifact_source': SOURCE_PUSH,
+    'clean_ip_ttl': DEFAULT_TTL,
+    'clean_ip_revalidate_interval': DEFAULT_REVALIDATE_INTERVAL,
+    'clean_ip_warm_min': DEFAULT_WARM_MIN,
+    'probe_interval': DEFAULT_PROBE_INTERVAL,
+    'probe_flush_interval': DEFAULT_PROBE_FLUSH,
+    'speedtest_streams': DEFAULT_STREAMS,
+    'speedtest_duration': DEFAULT_DURATION,
+    'speedtest_warmup': DEFAULT_WARMUP,
+    'reload_drain_timeout': DEFAULT_DRAIN_TIMEOUT,
+    'reload_refuse_window': DEFAULT_REFUSE_WINDOW,
+})
 PANEL_PATH = sys_config.get('panel_path', '') 
 URL_PREFIX = f"/{PANEL_PATH}" if PANEL_PATH else ""
 
@@ -43,35 +67,8 @@ if not secret_key:
 app.secret_key = secret_key
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 
-# Worker
-def worker():
-    logger.info("Task Worker Started")
-    while True:
-        try:
-            task_id, func, args = task_queue.get()
-            logger.info(f"Processing Task: {task_id}")
-            task_status[task_id] = {'progress': 5, 'status': 'running', 'log': 'Starting...'}
-            
-            for progress, log_msg in func(*args):
-                task_status[task_id]['progress'] = progress
-                task_status[task_id]['log'] = log_msg
-                logger.debug(f"Task {task_id}: {log_msg}")
-            
-            task_status[task_id]['progress'] = 100
-            task_status[task_id]['status'] = 'completed'
-            task_status[task_id]['log'] = 'Done!'
-            logger.info(f"Task {task_id} Completed")
-            
-        except Exception as e:
-            logger.error(f"Task Failed: {e}", exc_info=True)
-            if 'task_id' in locals():
-                task_status[task_id]['progress'] = 100
-                task_status[task_id]['status'] = 'error'
-                task_status[task_id]['log'] = f'Error: {str(e)}'
-        finally:
-            if 'task_id' in locals(): task_queue.task_done()
-
-threading.Thread(target=worker, daemon=True).start()
+# Task Executor (bounded workers, one job per remote host at a time)
+start_executor(sys_config.get('task_workers', DEFAULT_WORKERS))
 
 @app.route('/task-status/<task_id>')
 def get_task_status(task_id):
@@ -84,6 +81,17 @@ try:
 except Exception as e:
     logger.error(f"DB Init Failed: {e}")
 
+# Traffic Sampler (per-tunnel counters -> DB)
+start_traffic_collector()
+
+# End-to-end probes through every tunnel (latency histograms -> DB)
+start_tunnel_prober()
+
+# Clean-IP sweeps interrupted by a restart continue from their checkpoint
+resume_interrupted_scans()
+# Cached clean IPs are re-probed in the background (low priority)
+start_revalidation_scheduler()
+
 # Register Blueprints
 app.register_blueprint(auth_bp, url_prefix=f"{URL_PREFIX}/auth")
 app.register_blueprint(dashboard_bp, url_prefix=f"{URL_PREFIX}/dashboard")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: requests/sec for get_all_tunnels()
+  legacy -> old behaviour (full init_db + new connection on every call)
+  pooled -> core.database with the connection pool / one-time schema init
+
+Usage: python3 benchmarks/bench_database.py [iterations] [tunnels]
+"""
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core import database
+
+
+def legacy_get_all_tunnels(path):
+    # Same work the old Database() wrapper did for every request
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS servers (ip TEXT PRIMARY KEY, user TEXT, password TEXT, ssh_key TEXT, port INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS tunnels (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, transport TEXT, port TEXT,
+                 token TEXT, config TEXT, status TEXT DEFAULT 'active', total_rx INTEGER DEFAULT 0, total_tx INTEGER DEFAULT 0,
+                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS traffic_history (id INTEGER PRIMARY KEY AUTOINCREMENT, tunnel_id INTEGER, date DATE,
+                 rx INTEGER DEFAULT 0, tx INTEGER DEFAULT 0, UNIQUE(tunnel_id, date))''')
+    c.execute("SELECT * FROM users WHERE username='admin'")
+    if not c.fetchone():
+        c.execute("INSERT INTO users VALUES ('admin', 'admin')")
+    conn.commit()
+    conn.close()
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    res = conn.execute("SELECT * FROM tunnels ORDER BY id DESC").fetchall()
+    conn.close()
+    return res
+
+
+def bench(label, func, iterations):
+    func()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    rps = iterations / elapsed
+    print(f"{label:<8} {iterations} calls in {elapsed:.3f}s -> {rps:,.0f} req/s")
+    return rps
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tunnels = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        for i in range(tunnels):
+            database.add_tunnel(f"T{i}", "rathole", 2000 + i, "tok", {"ports": [str(3000 + i)]})
+
+        legacy = bench("legacy", lambda: legacy_get_all_tunnels(database.DB_PATH), iterations)
+        pooled = bench("pooled", database.get_all_tunnels, iterations)
+        print(f"speedup  x{pooled / legacy:.1f}")
+
+
+if __name__ == "__main__":
+    main()
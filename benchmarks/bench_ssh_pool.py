@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pooled SSH transports vs a fresh connection per command.
+
+Starts a tiny paramiko-based sshd stand-in on 127.0.0.1 (optionally behind a
+proxy that adds latency to every packet, to mimic an Iran -> foreign link)
+and runs the same install-like sequence of commands both ways.
+
+Usage: python3 benchmarks/bench_ssh_pool.py [commands] [latency_ms]
+"""
+import os
+import sys
+import socket
+import threading
+import time
+
+import paramiko
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.ssh_manager import SSHManager, SSHConnectionPool
+
+USER, PASSWORD = "root", "bench"
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+
+class StandInServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        ok = username == USER and password == PASSWORD
+        return paramiko.AUTH_SUCCESSFUL if ok else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == "session" else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        def reply():
+            time.sleep(0.005)  # let the transport acknowledge the exec request first
+            channel.sendall(b"ok: " + command + b"\n")
+            channel.send_exit_status(0)
+            channel.close()
+        threading.Thread(target=reply, daemon=True).start()
+        return True
+
+
+def serve(listener):
+    while True:
+        conn, _ = listener.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        t = paramiko.Transport(conn)
+        t.add_server_key(HOST_KEY)
+        t.start_server(server=StandInServer())
+
+
+def latency_proxy(listener, target_port, delay):
+    def pipe(src, dst):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                time.sleep(delay)
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for s in (src, dst):
+                try:
+                    s.close()
+                except OSError:
+                    pass
+
+    while True:
+        client, _ = listener.accept()
+        upstream = socket.create_connection(("127.0.0.1", target_port))
+        for s in (client, upstream):
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=pipe, args=(client, upstream), daemon=True).start()
+        threading.Thread(target=pipe, args=(upstream, client), daemon=True).start()
+
+
+def listen():
+    s = socket.socket()
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(("127.0.0.1", 0))
+    s.listen(64)
+    return s, s.getsockname()[1]
+
+
+def run(label, manager, port, commands, fresh):
+    start = time.perf_counter()
+    for i in range(commands):
+        ok, out = manager.run_remote_command("127.0.0.1", USER, PASSWORD, f"step-{i}", port, fresh=fresh)
+        assert ok, out
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {commands} commands in {elapsed:.3f}s ({elapsed / commands * 1000:.1f} ms/command)")
+    return elapsed
+
+
+def main():
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    sshd, sshd_port = listen()
+    threading.Thread(target=serve, args=(sshd,), daemon=True).start()
+    port = sshd_port
+    if latency_ms:
+        proxy, port = listen()
+        threading.Thread(target=latency_proxy, args=(proxy, sshd_port, latency_ms / 2000), daemon=True).start()
+
+    print(f"stand-in sshd on 127.0.0.1:{port} (one-way delay {latency_ms / 2:.0f} ms)")
+    fresh = run("fresh", SSHManager(SSHConnectionPool()), port, commands, fresh=True)
+    pool = SSHConnectionPool()
+    pooled = run("pooled", SSHManager(pool), port, commands, fresh=False)
+    print(f"speedup    x{fresh / pooled:.1f}  (pool stats: {pool.stats})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import shutil
+import subprocess
+import threading
+import time
+import logging
+import re
+from core.database import get_all_tunnels
+from core.utils import get_tunnel_ports
+
+logger = logging.getLogger("TrafficAccounting")
+
+# Per-tunnel byte counters using plain iptables accounting rules (no target).
+# INPUT  + dport = bytes users send into the tunnel (rx)
+# OUTPUT + sport = bytes the tunnel sends back to users (tx)
+CHAINS = {
+    'rx': ('ALAMOR_IN', 'INPUT', '--dport'),
+    'tx': ('ALAMOR_OUT', 'OUTPUT', '--sport'),
+}
+PROTOCOLS = ('tcp', 'udp')
+COMMENT_PREFIX = "alamor"
+SNAPSHOT_MAX_AGE = 5  # seconds
+
+_COUNTER_RE = re.compile(r'^\[(\d+):(\d+)\]\s+-A\s+(\S+)\s.*--comment\s+"?(' + COMMENT_PREFIX + r':[^"\s]+)"?')
+_HOOK_RE = re.compile(r'^(?:\[\d+:\d+\]\s+)?-A\s+(INPUT|OUTPUT)\s+-j\s+(ALAMOR_\w+)\s*$')
+
+
+def _rule_comment(tunnel_id, direction, proto, port):
+    return f"{COMMENT_PREFIX}:{tunnel_id}:{direction}:{proto}:{port}"
+
+
+def _rule_spec(comment):
+    """Rebuild the exact rule spec from its comment (used for both -A and -D)."""
+    _, tunnel_id, direction, proto, port = comment.split(':')
+    chain, _, match = CHAINS[direction]
+    return chain, f'-p {proto} -m {proto} {match} {port} -m comment --comment "{comment}"'
+
+
+def _parse_comment(comment):
+    try:
+        _, tunnel_id, direction, proto, port = comment.split(':')
+        return int(tunnel_id), direction
+    except ValueError:
+        return None, None
+
+
+class TrafficAccountant:
+    """
+    One accounting rule per (tunnel, port, proto, direction).
+    All counters are read with a single `iptables-save -c` per address family
+    and kept in memory, so stats lookups never touch iptables or SQLite.
+    """
+
+    def __init__(self, binaries=('iptables', 'ip6tables')):
+        self.binaries = [b for b in binaries if shutil.which(f"{b}-save") and shutil.which(f"{b}-restore")]
+        self.available = bool(self.binaries)
+        if not self.available:
+            logger.warning("iptables-save/iptables-restore not found, per-tunnel accounting disabled")
+
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self.version = 0
+        self._refresh_lock = threading.Lock()
+        self._rules = {}     # comment -> bytes
+        self._tunnels = {}   # tunnel_id -> snapshot dict
+        self.created = set() # rules added by this process (their counters start at 0)
+        self.updated_at = 0
+        self.max_age = SNAPSHOT_MAX_AGE
+
+    # --- iptables I/O ---
+    def _dump(self, binary):
+        out = subprocess.run([f"{binary}-save", "-c", "-t", "filter"], capture_output=True, text=True, timeout=10)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip() or f"{binary}-save failed")
+        return out.stdout
+
+    def _parse_dump(self, dump):
+        counters = {}
+        chains = set()
+        hooks = set()
+        for line in dump.splitlines():
+            if line.startswith(':ALAMOR_'):
+                chains.add(line[1:].split()[0])
+                continue
+            m = _HOOK_RE.match(line)
+            if m:
+                hooks.add((m.group(1), m.group(2)))
+                continue
+            m = _COUNTER_RE.match(line)
+            if m:
+                counters[m.group(4)] = int(m.group(2))
+        return counters, chains, hooks
+
+    def _sync(self, binary, desired, installed, chains, hooks):
+        """Apply the rule diff for one family in a single iptables-restore call."""
+        lines = []
+        for chain, hook, _ in CHAINS.values():
+            if chain not in chains:
+                lines.append(f":{chain} - [0:0]")
+        for chain, hook, _ in CHAINS.values():
+            if (hook, chain) not in hooks:
+                lines.append(f"-I {hook} -j {chain}")
+        added = desired - installed
+        for comment in sorted(added):
+            chain, spec = _rule_spec(comment)
+            lines.append(f"-A {chain} {spec}")
+        for comment in sorted(installed - desired):
+            chain, spec = _rule_spec(comment)
+            lines.append(f"-D {chain} {spec}")
+
+        if not lines:
+            return
+        payload = "*filter\n" + "\n".join(lines) + "\nCOMMIT\n"
+        res = subprocess.run([f"{binary}-restore", "--noflush"], input=payload, capture_output=True, text=True, timeout=10)
+        if res.returncode != 0:
+            logger.error(f"{binary}-restore failed: {res.stderr.strip()}")
+        else:
+            self.created.update(added)
+
+    # --- Snapshot ---
+    def _desired_rules(self, tunnels):
+        desired = set()
+        ports_by_tunnel = {}
+        for t in tunnels:
+            ports = get_tunnel_ports(t)
+            ports_by_tunnel[t['id']] = ports
+            for port in ports:
+                for proto in PROTOCOLS:
+                    for direction in CHAINS:
+                        desired.add(_rule_comment(t['id'], direction, proto, port))
+        return desired, ports_by_tunnel
+
+    def refresh(self, force=False):
+        """Re-read every counter in one dump per family. Cheap to call often."""
+        if not force and time.time() - self.updated_at < self.max_age:
+            return False
+        # Single-flight: concurrent callers just keep using the current snapshot
+        if not self._refresh_lock.acquire(blocking=force):
+            return False
+        try:
+            desired, ports_by_tunnel = self._desired_rules(get_all_tunnels())
+            rules = {}
+            for binary in self.binaries:
+                try:
+                    counters, chains, hooks = self._parse_dump(self._dump(binary))
+                except Exception as e:
+                    logger.error(f"Counter dump failed ({binary}): {e}")
+                    continue
+                self._sync(binary, desired, set(counters), chains, hooks)
+                for comment, value in counters.items():
+                    if comment in desired:
+                        rules[comment] = rules.get(comment, 0) + value
+
+            now = time.time()
+            tunnels = {tid: {'rx_bytes': 0, 'tx_bytes': 0, 'ports': ports, 'updated_at': now}
+                       for tid, ports in ports_by_tunnel.items()}
+            for comment, value in rules.items():
+                tid, direction = _parse_comment(comment)
+                if tid in tunnels:
+                    tunnels[tid][f"{direction}_bytes"] += value
+
+            with self._lock:
+                self._rules = rules
+                self._tunnels = tunnels
+                self.updated_at = now
+                self.version += 1
+                self._updated.notify_all()
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def get_rule_counters(self):
+        with self._lock:
+            return dict(self._rules)
+
+    def get(self, tunnel_id):
+        with self._lock:
+            snap = self._tunnels.get(tunnel_id)
+            return dict(snap) if snap else {'rx_bytes': 0, 'tx_bytes': 0, 'ports': [], 'updated_at': self.updated_at}
+
+    def get_all(self):
+        with self._lock:
+            return {tid: dict(snap) for tid, snap in self._tunnels.items()}
+
+    def wait_for_update(self, version, timeout=None):
+        """Block until the snapshot is newer than `version`; returns the current version."""
+        with self._updated:
+            self._updated.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+
+accountant = TrafficAccountant()
+
+# Wrappers
+def refresh_counters(force=False): return accountant.refresh(force)
+def get_tunnel_counters(tunnel_id):
+    accountant.refresh()
+    return accountant.get(tunnel_id)
+def get_all_counters():
+    accountant.refresh()
+    return accountant.get_all()
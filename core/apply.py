@@ -0,0 +1,184 @@
+import os
+import hashlib
+import logging
+from core.artifacts import store, sha256_file
+from core.systemd import SYSTEMD_DIR, UnitTransaction
+
+logger = logging.getLogger("ConfigApply")
+
+CREATE, UPDATE, NOOP = 'create', 'update', 'noop'
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _file_digest(path):
+    return sha256_file(path) if os.path.isfile(path) else None
+
+
+class ApplyPlan:
+    """
+    Desired state for one host: rendered files (configs, unit files) and
+    binaries, each tied to the units that use them.
+
+    plan()  -> what would happen, per file: create / update / noop
+    apply() -> write only changed files (atomic), daemon-reload once if a unit
+               file changed, restart only units whose inputs changed and start
+               units that should run but do not.
+
+    apply(tx=...) queues the unit jobs on a shared UnitTransaction instead,
+    so several plans on one host share a single reload and job batch.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.files = []      # {'path', 'content', 'mode', 'units'}
+        self.binaries = []   # {'name', 'path', 'units'}
+        self.units = []      # units that must be enabled and running
+
+    def add_file(self, path, content, units=(), mode=0o644):
+        self.files.append({'path': path, 'content': content, 'mode': mode, 'units': list(units)})
+        return self
+
+    def add_unit(self, unit, content):
+        """A systemd service; its own unit file is one of its inputs."""
+        if unit not in self.units:
+            self.units.append(unit)
+        return self.add_file(f"{SYSTEMD_DIR}/{unit}.service", content, units=[unit])
+
+    def add_binary(self, name, path, units=()):
+        self.binaries.append({'name': name, 'path': path, 'units': list(units)})
+        return self
+
+    # --- Plan ---
+    def plan(self):
+        changes = []
+        for f in self.files:
+            current = _file_digest(f['path'])
+            wanted = sha256_text(f['content'])
+            action = CREATE if current is None else (NOOP if current == wanted else UPDATE)
+            changes.append({'path': f['path'], 'kind': 'file', 'action': action, 'units': f['units']})
+        for b in self.binaries:
+            current = _file_digest(b['path'])
+            wanted = store.ensure(b['name'])
+            action = CREATE if current is None else (NOOP if current == wanted else UPDATE)
+            changes.append({'path': b['path'], 'kind': 'binary', 'action': action, 'units': b['units']})
+
+        restart = []
+        for c in changes:
+            if c['action'] != NOOP:
+                restart.extend(u for u in c['units'] if u not in restart)
+        reload = any(c['action'] != NOOP and c['path'].startswith(SYSTEMD_DIR + "/") for c in changes)
+        return {'name': self.name, 'changes': changes, 'restart': restart, 'daemon_reload': reload}
+
+    def describe(self, plan=None):
+        plan = plan or self.plan()
+        lines = [f"{c['action']:>6}  {c['path']}" for c in plan['changes']]
+        lines.append(f"restart: {', '.join(plan['restart']) or '-'}")
+        return "\n".join(lines)
+
+    # --- Apply ---
+    def _write(self, f):
+        os.makedirs(os.path.dirname(f['path']), exist_ok=True)
+        tmp = f"{f['path']}.alamor-new"
+        with open(tmp, "w") as fh:
+            fh.write(f['content'])
+        os.chmod(tmp, f['mode'])
+        os.replace(tmp, f['path'])
+
+    def apply(self, dry_run=False, tx=None):
+        plan = self.plan()
+        plan['started'] = []
+        logger.info(f"Plan {self.name or ''}:\n{self.describe(plan)}")
+        if dry_run:
+            return plan
+
+        changed = {c['path'] for c in plan['changes'] if c['action'] != NOOP}
+        for f in self.files:
+            if f['path'] in changed:
+                self._write(f)
+        for b in self.binaries:
+            if b['path'] in changed:
+                store.install_local(b['name'], b['path'])
+
+        own = tx is None
+        tx = tx or UnitTransaction()
+        if plan['daemon_reload']:
+            tx.reload_needed = True
+        tx.enable(*self.units)
+        tx.restart(*plan['restart'])
+        # Unchanged but not running (crashed / stopped by hand): start, no restart
+        tx.start(*[u for u in self.units if u not in plan['restart']])
+        if own:
+            plan['started'] = [u[:-len('.service')] for u in tx.commit()['started']]
+
+        logger.info(f"Applied {self.name or 'plan'}: {len(changed)} changed, "
+                    f"restart {plan['restart'] or 'nothing'}")
+        return plan
+
+
+# ==========================================
+# Same idea on a remote host (one shell script over SSH)
+# ==========================================
+_REMOTE_PRELUDE = r'''
+__alamor_changed=" "
+__alamor_reload=0
+__alamor_put() {
+    __tmp="$1.alamor-new"
+    cat > "$__tmp"
+    chmod "$3" "$__tmp"
+    if [ -f "$1" ] && cmp -s "$__tmp" "$1"; then
+        rm -f "$__tmp"; echo "PLAN noop $1"
+    else
+        if [ -f "$1" ]; then echo "PLAN update $1"; else echo "PLAN create $1"; fi
+        mkdir -p "$(dirname "$1")"
+        mv -f "$__tmp" "$1"
+        __alamor_changed="$__alamor_changed$2 "
+        case "$1" in /etc/systemd/system/*) __alamor_reload=1 ;; esac
+    fi
+}
+'''
+
+
+def remote_apply_script(files, units, restart=()):
+    """
+    Shell script that writes `files` ([(path, content, units[, mode])]) only
+    when their content differs, reloads systemd once if a unit file changed
+    and restarts just the affected `units`. `restart` forces units (e.g. the
+    binary was replaced). Prints one `PLAN <action> <path>` line per file.
+    """
+    parts = [_REMOTE_PRELUDE]
+    for spec in files:
+        path, content, file_units = spec[0], spec[1], spec[2]
+        mode = oct(spec[3])[2:] if len(spec) > 3 else "644"
+        delimiter = f"ALAMOR_EOF_{sha256_text(path)[:8]}"
+        body = content if content.endswith("\n") else content + "\n"
+        parts.append(f"mkdir -p \"$(dirname '{path}')\"\n"
+                     f"__alamor_put '{path}' '{' '.join(file_units)}' {mode} <<'{delimiter}'\n{body}{delimiter}\n")
+    forced = " ".join(restart)
+    unit_list = " ".join(units)
+    parts.append(f'''
+[ "$__alamor_reload" = 1 ] && systemctl daemon-reload
+for __u in {unit_list}; do
+    systemctl is-enabled --quiet "$__u" || systemctl enable --quiet "$__u"
+    case "$__alamor_changed {forced} " in
+        *" $__u "*) systemctl restart "$__u"; echo "PLAN restart $__u" ;;
+        *) systemctl is-active --quiet "$__u" || {{ systemctl start "$__u"; echo "PLAN start $__u"; }} ;;
+    esac
+done
+''')
+    return "".join(parts)
+
+
+def remote_remove_script(units):
+    """Shell counterpart of UnitTransaction.remove() for several units."""
+    if not units:
+        return ""
+    return "".join(f"systemctl disable --now --quiet {u} 2>/dev/null; rm -f {SYSTEMD_DIR}/{u}.service; "
+                   f"echo \"PLAN remove {u}\"\n" for u in units) + "systemctl daemon-reload\n"
+
+
+def binary_changed(message):
+    """provide_remote_binary() message -> did the remote binary change?"""
+    return "already up to date" not in message
@@ -0,0 +1,335 @@
+import os
+import io
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import tarfile
+import zipfile
+import tempfile
+import threading
+import urllib.request
+from core.config_loader import BASE_DIR, load_config
+from core.ssh_manager import SSHManager
+
+logger = logging.getLogger("ArtifactStore")
+
+# ==========================================
+# Content-addressed store for tunnel cores
+# ==========================================
+# هر باینری یک بار از اینترنت گرفته می‌شود، با sha256 ذخیره می‌شود
+# و برای سرورهای خارج از طریق همان SSH (SFTP) آپلود می‌شود.
+
+ARTIFACT_DIR = os.path.join(BASE_DIR, "artifacts")
+BLOB_DIR = os.path.join(ARTIFACT_DIR, "sha256")
+MANIFEST_FILE = os.path.join(ARTIFACT_DIR, "manifest.json")
+LOCAL_BIN_DIR = os.path.join(BASE_DIR, "bin")
+DOWNLOAD_TIMEOUT = 120
+CHUNK = 1024 * 1024
+
+SOURCE_PUSH = "push"          # upload the cached binary over SFTP (default)
+SOURCE_DOWNLOAD = "download"  # remote host curls the release URL itself (old behaviour)
+
+# name -> where it comes from and how to get the executable out of it
+ARTIFACTS = {
+    'hysteria': {
+        'url': "https://github.com/apernet/hysteria/releases/latest/download/hysteria-linux-amd64",
+        'format': 'raw',
+    },
+    'backhaul': {
+        'url': "https://github.com/Musixal/Backhaul/releases/download/v0.6.0/backhaul_linux_amd64.tar.gz",
+        'format': 'tar.gz',
+        'member': 'backhaul_linux_amd64',
+    },
+    'gost': {
+        'url': "https://github.com/ginuerzh/gost/releases/download/v2.11.5/gost-linux-amd64-2.11.5.gz",
+        'format': 'gz',
+    },
+    'rathole': {
+        'url': "https://github.com/rapiz1/rathole/releases/latest/download/rathole-x86_64-unknown-linux-gnu.zip",
+        'format': 'zip',
+        'member': 'rathole',
+    },
+    'slipstream-server': {
+        'url': "https://files.irplatforme.ir/files/slipstream.tar.gz",
+        'format': 'tar.gz',
+        'member': 'slipstream-server',
+    },
+    'slipstream-client': {
+        'url': "https://files.irplatforme.ir/files/slipstream.tar.gz",
+        'format': 'tar.gz',
+        'member': 'slipstream-client',
+    },
+}
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _extract(data, fmt, member=None):
+    """Archive bytes -> executable bytes"""
+    if fmt == 'raw':
+        return data
+    if fmt == 'gz':
+        return gzip.decompress(data)
+    if fmt == 'tar.gz':
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+            for info in tar.getmembers():
+                if info.isfile() and os.path.basename(info.name) == member:
+                    return tar.extractfile(info).read()
+    elif fmt == 'zip':
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            for name in zf.namelist():
+                if os.path.basename(name) == member:
+                    return zf.read(name)
+    else:
+        raise ArtifactError(f"Unknown artifact format: {fmt}")
+    raise ArtifactError(f"'{member}' not found in archive")
+
+
+class ArtifactStore:
+    """
+    Blobs live under artifacts/sha256/<digest>; manifest.json maps a name to
+    the digest currently in use. A digest pinned in panel_config
+    (`artifact_pins`: {name: sha256}) must match or the binary is rejected.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, specs=None):
+        self.root = root
+        self.blob_dir = os.path.join(root, "sha256")
+        self.manifest_file = os.path.join(root, "manifest.json")
+        self.specs = specs or ARTIFACTS
+        self._lock = threading.Lock()
+        self._name_locks = {}
+        self._verified = set()   # digests already re-hashed in this process
+
+    # --- Manifest ---
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp, self.manifest_file)
+
+    def manifest(self):
+        with self._lock:
+            return self._load_manifest()
+
+    def _name_lock(self, name):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def pin_for(self, name):
+        return (load_config().get('artifact_pins') or {}).get(name)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    # --- Store ---
+    def _verify(self, digest):
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            return False
+        if digest in self._verified:
+            return True
+        if sha256_file(path) != digest:
+            logger.warning(f"Corrupt blob {digest[:12]}, removing")
+            os.remove(path)
+            return False
+        self._verified.add(digest)
+        return True
+
+    def _put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self.blob_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.blob_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp, 0o755)
+            os.replace(tmp, path)
+        self._verified.add(digest)
+        return digest
+
+    def _record(self, name, digest, source):
+        with self._lock:
+            manifest = self._load_manifest()
+            manifest[name] = {
+                'sha256': digest,
+                'url': self.specs[name]['url'],
+                'source': source,
+                'size': os.path.getsize(self.blob_path(digest)),
+            }
+            self._save_manifest(manifest)
+
+    def _download(self, url):
+        logger.info(f"Downloading {url}")
+        req = urllib.request.Request(url, headers={'User-Agent': 'AlamorTunnel'})
+        with urllib.request.urlopen(req, timeout=DOWNLOAD_TIMEOUT) as resp:
+            return resp.read()
+
+    def ensure(self, name, refresh=False):
+        """
+        Digest of a verified local blob for `name`.
+        Order: manifest entry -> binary already in bin/ (install.sh) -> internet.
+        """
+        spec = self.specs.get(name)
+        if not spec:
+            raise ArtifactError(f"Unknown artifact: {name}")
+        pin = self.pin_for(name)
+
+        with self._name_lock(name):
+            entry = self.manifest().get(name)
+            if entry and not refresh and entry.get('url') == spec['url']:
+                if (not pin or entry['sha256'] == pin) and self._verify(entry['sha256']):
+                    return entry['sha256']
+
+            if pin and self._verify(pin):
+                self._record(name, pin, 'pinned')
+                return pin
+
+            seed = os.path.join(LOCAL_BIN_DIR, name)
+            if not refresh and os.path.isfile(seed):
+                with open(seed, 'rb') as f:
+                    data = f.read()
+                if not pin or hashlib.sha256(data).hexdigest() == pin:
+                    digest = self._put(data)
+                    self._record(name, digest, 'seed')
+                    return digest
+
+            data = self._download(spec['url'])
+            binary = _extract(data, spec['format'], spec.get('member'))
+            digest = hashlib.sha256(binary).hexdigest()
+            if pin and digest != pin:
+                raise ArtifactError(f"{name}: sha256 {digest[:12]} does not match pin {pin[:12]}")
+            self._put(binary)
+            self._record(name, digest, 'download')
+
+            # Same archive may carry sibling binaries (slipstream client/server)
+            for other, other_spec in self.specs.items():
+                if other != name and other_spec['url'] == spec['url'] and other not in self.manifest():
+                    try:
+                        other_digest = self._put(_extract(data, other_spec['format'], other_spec.get('member')))
+                        self._record(other, other_digest, 'download')
+                    except ArtifactError:
+                        pass
+            return digest
+
+    def path(self, name):
+        return self.blob_path(self.ensure(name))
+
+    # --- Install ---
+    def install_local(self, name, dest):
+        """Copy the cached binary to `dest` if it differs (atomic replace)."""
+        digest = self.ensure(name)
+        if os.path.isfile(dest) and sha256_file(dest) == digest:
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.tmp"
+        shutil.copyfile(self.blob_path(digest), tmp)
+        os.chmod(tmp, 0o755)
+        os.replace(tmp, dest)
+        logger.info(f"Installed {name} ({digest[:12]}) -> {dest}")
+        return True
+
+    def push_remote(self, name, ip, user, password, port=22, ssh_key=None, remote_path=None, ssh=None):
+        """
+        Upload the cached binary over SFTP on the pooled SSH transport.
+        Skips the upload when the remote file already has the same sha256.
+        """
+        digest = self.ensure(name)
+        ssh = ssh or SSHManager()
+        remote_path = remote_path or f"/root/alamor/bin/{name}"
+
+        ok, out = ssh.run_remote_command(ip, user, password, f"sha256sum {remote_path} 2>/dev/null || true",
+                                         port, ssh_key, on_line=lambda line: None)
+        if ok and out.split()[:1] == [digest]:
+            return True, f"{name} already up to date on {ip}"
+
+        tmp = f"{remote_path}.{digest[:12]}.tmp"
+        sftp = ssh.open_sftp(ip, user, password, port, ssh_key)
+        try:
+            _sftp_makedirs(sftp, os.path.dirname(remote_path))
+            sftp.put(self.blob_path(digest), tmp)
+            sftp.chmod(tmp, 0o755)
+            # rename over a running binary is safe, writing into it is not
+            sftp.posix_rename(tmp, remote_path)
+        finally:
+            sftp.close()
+        logger.info(f"Pushed {name} ({digest[:12]}) to {ip}:{remote_path}")
+        return True, f"{name} uploaded to {ip}"
+
+
+def _sftp_makedirs(sftp, path):
+    parts = []
+    while path not in ("", "/"):
+        try:
+            sftp.stat(path)
+            break
+        except IOError:
+            parts.append(path)
+            path = os.path.dirname(path)
+    for p in reversed(parts):
+        sftp.mkdir(p)
+
+
+def remote_fetch_script(name, remote_path):
+    """Shell snippet for `download` mode: the remote host fetches the release itself."""
+    spec = ARTIFACTS[name]
+    url, fmt, member = spec['url'], spec['format'], spec.get('member', name)
+    if fmt == 'raw':
+        fetch = f"curl -L -k -o {remote_path} {url}"
+    elif fmt == 'gz':
+        fetch = f"curl -L -k -o /tmp/{name}.gz {url} && gzip -d -c /tmp/{name}.gz > {remote_path}"
+    elif fmt == 'tar.gz':
+        fetch = (f"mkdir -p /tmp/{name}.x && curl -L -k -o /tmp/{name}.tgz {url} && tar -xzf /tmp/{name}.tgz -C /tmp/{name}.x "
+                 f"&& find /tmp/{name}.x -type f -name {member} -exec cp {{}} {remote_path} \\;")
+    else:
+        fetch = (f"(command -v unzip >/dev/null || apt-get install -y unzip) && curl -L -k -o /tmp/{name}.zip {url} && unzip -o -j /tmp/{name}.zip {member} -d /tmp/{name}.x "
+                 f"&& cp /tmp/{name}.x/{member} {remote_path}")
+    return f"mkdir -p {os.path.dirname(remote_path)} && {fetch} && chmod +x {remote_path}"
+
+
+store = ArtifactStore()
+
+def artifact_source():
+    return load_config().get('artifact_source', SOURCE_PUSH)
+
+def install_local_binary(name, dest):
+    return store.install_local(name, dest)
+
+def provide_remote_binary(name, ip, user, password, port=22, ssh_key=None, remote_path=None, ssh=None):
+    """
+    Make sure `remote_path` on the host holds this core.
+    push mode: one download on the panel, SFTP to every host.
+    download mode: the host curls the release URL (skipped if the file exists).
+    """
+    remote_path = remote_path or f"/root/alamor/bin/{name}"
+    if artifact_source() == SOURCE_PUSH:
+        try:
+            return store.push_remote(name, ip, user, password, port, ssh_key, remote_path, ssh)
+        except Exception as e:
+            logger.error(f"Push of {name} to {ip} failed: {e}")
+            return False, f"Binary push failed: {e}"
+    ssh = ssh or SSHManager()
+    script = (f"if [ -f {remote_path} ]; then echo '{name} already up to date on {ip}'; "
+              f"else ({remote_fetch_script(name, remote_path)}); fi")
+    return ssh.run_remote_command(ip, user, password, script, port, ssh_key)
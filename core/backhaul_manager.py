@@ -1,7 +1,10 @@
-import os
 import secrets
 import logging
 from core.ssh_manager import SSHManager
+from core.artifacts import provide_remote_binary
+from core.apply import ApplyPlan, remote_apply_script, binary_changed
+from core.systemd import UnitTransaction
+from core.utils import speedtest_ports
 
 logger = logging.getLogger("BackhaulManager")
 
@@ -10,7 +13,6 @@ REMOTE_BIN_DIR = "/root/alamor/bin"
 REMOTE_BIN = f"{REMOTE_BIN_DIR}/backhaul"
 LOCAL_BIN_DIR = "/root/AlamorTunnel/bin"
 LOCAL_BIN = f"{LOCAL_BIN_DIR}/backhaul"
-DL_URL = "https://github.com/Musixal/Backhaul/releases/download/v0.6.0/backhaul_linux_amd64.tar.gz"
 
 class BackhaulManager:
     def _gen_token(self):
@@ -40,6 +42,8 @@ class BackhaulManager:
                 if p:
                     # مثال: "9096=127.0.0.1:9096"
                     ports_list.append(f'"{p}=127.0.0.1:{p}"')
+        for p in speedtest_ports(config):
+            ports_list.append(f'"{p}=127.0.0.1:{p}"')
         
         ports_str = ",".join(ports_list)
         
@@ -85,43 +89,11 @@ log_level = "info"
 """
         return toml
 
-    # =========================================================
-    # نصب روی سرور خارج (Remote - Client)
-    # =========================================================
-    def install_remote(self, remote_ip, iran_ip, config):
-        ssh = SSHManager()
-        user = config.get('ssh_user', 'root')
-        passw = config.get('ssh_pass')
-        port = int(config.get('ssh_port', 22))
-        key = config.get('ssh_key')
-
-        toml_content = self._client_config_toml(iran_ip, config)
-        
-        # اسکریپت هوشمند: اول تمیزکاری، بعد نصب
-        install_script = f"""
-        # 1. CLEANUP (پاکسازی سرویس‌های قدیمی برای جلوگیری از تداخل)
-        systemctl stop backhaul-server 2>/dev/null
-        systemctl stop backhaul-client 2>/dev/null
-        rm -f /etc/systemd/system/backhaul*.service
-        killall -9 backhaul 2>/dev/null
-
-        # 2. SETUP
-        mkdir -p {REMOTE_BIN_DIR}
-        if [ ! -f {REMOTE_BIN} ]; then
-            curl -L -k -o /tmp/backhaul.tar.gz {DL_URL}
-            tar -xzf /tmp/backhaul.tar.gz -C /tmp/
-            mv /tmp/backhaul_linux_amd64 {REMOTE_BIN}
-            chmod +x {REMOTE_BIN}
-        fi
-
-        # 3. CONFIG
-        cat > {REMOTE_BIN_DIR}/backhaul_client.toml <<EOF
-{toml_content}
-EOF
-
-        # 4. SERVICE (Client Mode)
-        cat > /etc/systemd/system/backhaul-client.service <<EOF
-[Unit]
+    # ---------------------------------------------------------
+    # فایل‌های رندرشده هر سمت: (unit, unit file, [(path, content)])
+    # ---------------------------------------------------------
+    def render_remote(self, iran_ip, config):
+        svc_content = f"""[Unit]
 Description=Backhaul Client (Foreign -> Iran)
 After=network.target
 
@@ -133,44 +105,13 @@ LimitNOFILE=1048576
 
 [Install]
 WantedBy=multi-user.target
-EOF
-
-        systemctl daemon-reload
-        systemctl enable backhaul-client
-        systemctl restart backhaul-client
-        """
-        
-        return ssh.run_remote_command(remote_ip, user, passw, install_script, port, key)
+"""
+        toml_path = f"{REMOTE_BIN_DIR}/backhaul_client.toml"
+        return 'backhaul-client', svc_content, [(toml_path, self._client_config_toml(iran_ip, config))]
 
-    # =========================================================
-    # نصب روی سرور ایران (Local - Server)
-    # =========================================================
-    def install_local(self, config):
+    def render_local(self, config):
         tunnel_port = config.get('tunnel_port', 8080)
-
-        # 1. CLEANUP LOCAL (پاکسازی سرویس قدیمی روی ایران)
-        os.system(f"systemctl stop backhaul-client-{tunnel_port} 2>/dev/null")
-        os.system(f"systemctl disable backhaul-client-{tunnel_port} 2>/dev/null")
-        os.system(f"rm -f /etc/systemd/system/backhaul-client-{tunnel_port}.service")
-
-        # 2. SETUP
-        if not os.path.exists(LOCAL_BIN):
-            os.makedirs(LOCAL_BIN_DIR, exist_ok=True)
-            os.system(f"curl -L -k -o /tmp/backhaul.tar.gz {DL_URL}")
-            os.system(f"tar -xzf /tmp/backhaul.tar.gz -C /tmp/")
-            os.system(f"mv /tmp/backhaul_linux_amd64 {LOCAL_BIN}")
-            os.system(f"chmod +x {LOCAL_BIN}")
-
-        if not config.get('token'):
-            config['token'] = self._gen_token()
-
-        # 3. CONFIG (Server Mode)
-        toml_content = self._server_config_toml(config)
         config_path = f"{LOCAL_BIN_DIR}/backhaul_server_{tunnel_port}.toml"
-        with open(config_path, "w") as f:
-            f.write(toml_content)
-
-        # 4. SERVICE
         svc_name = f"backhaul-server-{tunnel_port}"
         svc_content = f"""[Unit]
 Description=Backhaul Server (Iran) {tunnel_port}
@@ -185,12 +126,84 @@ LimitNOFILE=1048576
 [Install]
 WantedBy=multi-user.target
 """
-        with open(f"/etc/systemd/system/{svc_name}.service", "w") as f:
-            f.write(svc_content)
+        return svc_name, svc_content, [(config_path, self._server_config_toml(config))]
 
-        os.system(f"systemctl daemon-reload && systemctl enable {svc_name} && systemctl restart {svc_name}")
+    # =========================================================
+    # نصب روی سرور خارج (Remote - Client)
+    # =========================================================
+    def install_remote(self, remote_ip, iran_ip, config):
+        ssh = SSHManager()
+        user = config.get('ssh_user', 'root')
+        passw = config.get('ssh_pass')
+        port = int(config.get('ssh_port', 22))
+        key = config.get('ssh_key')
+        svc_name, svc_content, files = self.render_remote(iran_ip, config)
+
+        # binary is pushed from the panel's artifact cache beforehand
+        ok, msg = provide_remote_binary('backhaul', remote_ip, user, passw, port, key, REMOTE_BIN, ssh)
+        if not ok:
+            return False, msg
+
+        # فقط سرویس قدیمی server-mode حذف می‌شود؛ کلاینت فعلی فقط در صورت تغییر ری‌استارت می‌شود
+        cleanup = """
+        if [ -f /etc/systemd/system/backhaul-server.service ]; then
+            systemctl disable --now backhaul-server 2>/dev/null
+            rm -f /etc/systemd/system/backhaul-server.service
+        fi
+        """
+        script = cleanup + remote_apply_script(
+            [(path, content, [svc_name]) for path, content in files]
+            + [(f"/etc/systemd/system/{svc_name}.service", svc_content, [svc_name])],
+            [svc_name],
+            restart=[svc_name] if binary_changed(msg) else (),
+        )
+        return ssh.run_remote_command(remote_ip, user, passw, script, port, key)
+
+    # =========================================================
+    # نصب روی سرور ایران (Local - Server)
+    # =========================================================
+    def install_local(self, config):
+        tunnel_port = config.get('tunnel_port', 8080)
+
+        if not config.get('token'):
+            config['token'] = self._gen_token()
+
+        # 2. CONFIG (Server Mode) + SERVICE
+        svc_name, svc_content, files = self.render_local(config)
+
+        # 3. APPLY: فقط فایل‌های تغییرکرده نوشته و فقط در صورت تغییر ری‌استارت می‌شود
+        plan = ApplyPlan(svc_name)
+        plan.add_binary('backhaul', LOCAL_BIN, [svc_name])
+        for path, content in files:
+            plan.add_file(path, content, [svc_name])
+        plan.add_unit(svc_name, svc_content)
+        with UnitTransaction() as tx:
+            # 1. CLEANUP LOCAL (سرویس قدیمی client-mode روی ایران، در همان reload)
+            tx.remove(f"backhaul-client-{tunnel_port}")
+            plan.apply(tx=tx)
         return True, config['token']
 
+# =========================================================
+# GLOBAL HELPERS
+# =========================================================
+
+def generate_token():
+    return secrets.token_hex(16)
+
+def stop_and_delete_backhaul(port, tx=None):
+    """سرویس سرور ایران و کانفیگ آن حذف می‌شود؛ با tx مشترک، reload یک‌بار انجام می‌شود."""
+    try:
+        own = tx is None
+        tx = tx or UnitTransaction()
+        # کانفیگ همراه یونیت و فقط بعد از stop در commit پاک می‌شود
+        tx.remove(f"backhaul-server-{port}", files=[f"{LOCAL_BIN_DIR}/backhaul_server_{port}.toml"])
+        if own:
+            tx.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Delete Error: {e}")
+        return False
+
 # تابع اصلی که پنل صدا می‌زند
 def install_backhaul_bridge(remote_ip, iran_ip, config):
     mgr = BackhaulManager()
@@ -0,0 +1,305 @@
+import secrets
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from core.apply import ApplyPlan, remote_apply_script, remote_remove_script, binary_changed
+from core.artifacts import provide_remote_binary
+from core.database import get_all_tunnels, get_tunnel_by_id, add_tunnels, delete_tunnels
+from core.ports import build_port_map, local_ports, release
+from core.reload import render_tunnel, queue_teardown
+from core.speedtest import SPEEDTEST_TRANSPORTS
+from core.ssh_manager import SSHManager
+from core.systemd import UnitTransaction
+from core.tasks import task_status, current_task_id
+from core.utils import parse_tunnel_config, get_forwarded_ports, _parse_port_token, _as_list
+
+logger = logging.getLogger("BulkTunnels")
+
+MAX_SPECS = 500
+# Port-forward cores whose units are per tunnel; hysteria (and backhaul's remote
+# client) use one fixed unit per host, so at most one of those per host.
+SUPPORTED = ('rathole', 'backhaul', 'gost')
+SINGLE_PER_HOST = ('backhaul',)
+BINARIES = {'rathole': 'rathole', 'backhaul': 'backhaul', 'gost': 'gost'}
+LOCAL_BIN_DIR = "/root/AlamorTunnel/bin"
+REMOTE_BIN_DIR = "/root/alamor/bin"
+NAMES = {'rathole': 'Rathole', 'backhaul': 'Backhaul', 'gost': 'GOST'}
+
+
+class ManifestError(ValueError):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def parse_manifest(manifest):
+    """
+    list of specs | {'defaults': {...}, 'tunnels': [...]} | the same as YAML/JSON text
+    -> list of spec dicts (defaults merged in).
+    """
+    if isinstance(manifest, (str, bytes)):
+        try:
+            manifest = yaml.safe_load(manifest)
+        except yaml.YAMLError as e:
+            raise ManifestError([f"manifest is not valid YAML/JSON: {e}"])
+    defaults = {}
+    if isinstance(manifest, dict):
+        defaults = manifest.get('defaults') or {}
+        manifest = manifest.get('tunnels')
+    if not isinstance(manifest, list) or not manifest:
+        raise ManifestError(["manifest must contain a non-empty list of tunnels"])
+    if len(manifest) > MAX_SPECS:
+        raise ManifestError([f"at most {MAX_SPECS} tunnels per manifest"])
+    if not isinstance(defaults, dict) or not all(isinstance(s, dict) for s in manifest):
+        raise ManifestError(["defaults and every tunnel must be mappings"])
+    return [{**defaults, **spec} for spec in manifest]
+
+
+def _port(value):
+    found = _parse_port_token(value) if value is not None else []
+    return found[0] if len(found) == 1 else None
+
+
+def _normalize(protocol, spec, server):
+    """Form-style spec -> install config (same shape start_install produces)."""
+    config = dict(spec)
+    config['ssh_ip'], config['ssh_user'], config['ssh_pass'], config['ssh_key'], config['ssh_port'] = server
+    config['tunnel_port'] = _port(config.get('tunnel_port'))
+    if protocol == 'rathole':
+        config['ports'] = [str(p) for token in _as_list(config.get('ports')) for p in _parse_port_token(token)]
+        config['token'] = config.get('token') or secrets.token_hex(16)
+        config['nodelay'] = bool(config.get('nodelay', True))
+        config.setdefault('transport', 'tcp')
+    elif protocol == 'backhaul':
+        config['port_rules'] = [str(r).strip() for r in _as_list(config.get('port_rules')) if str(r).strip()]
+        config['token'] = config.get('token') or secrets.token_hex(16)
+        config.setdefault('transport', 'tcp')
+    elif protocol == 'gost':
+        config['client_port'] = _port(config.get('client_port'))
+    return config
+
+
+def validate_specs(specs, server, iran_ip):
+    """
+    Check every spec before anything is touched: supported core, valid ports,
+    no port used twice in the manifest or already taken on this host (tunnels,
+    config files, listeners). `tunnel_port: auto` gets a free port.
+    Returns [(protocol, install config)] or raises ManifestError with all problems.
+    """
+    errors, configs, auto, forwards = [], [], [], []
+    existing = get_all_tunnels()
+    ports_map = build_port_map(existing)
+    # backhaul's remote client unit is one per server
+    single = {t['transport'] for t in existing if t['transport'] in SINGLE_PER_HOST
+              and parse_tunnel_config(t['config']).get('ssh_ip') == server[0]}
+
+    for i, spec in enumerate(specs):
+        where = f"tunnels[{i}]"
+        spec = dict(spec)
+        protocol = str(spec.pop('protocol', '')).lower()
+        if protocol not in SUPPORTED:
+            errors.append(f"{where}: protocol must be one of {', '.join(SUPPORTED)}")
+            continue
+        if protocol in SINGLE_PER_HOST:
+            if protocol in single:
+                errors.append(f"{where}: only one {protocol} tunnel per host")
+                continue
+            single.add(protocol)
+        wants_auto = str(spec.get('tunnel_port', '')).lower() == 'auto'
+        config = _normalize(protocol, spec, server)
+        config['iran_ip'] = iran_ip
+
+        if not config['tunnel_port'] and not wants_auto:
+            errors.append(f"{where}: tunnel_port must be a single port (1-65535) or auto")
+            continue
+        if protocol == 'rathole' and not config['ports']:
+            errors.append(f"{where}: ports must list at least one valid port")
+            continue
+        if protocol == 'backhaul' and not get_forwarded_ports({'port_rules': config['port_rules']}):
+            errors.append(f"{where}: port_rules must contain at least one valid rule")
+            continue
+        if protocol == 'gost' and not config['client_port']:
+            errors.append(f"{where}: client_port must be a single port (1-65535)")
+            continue
+
+        ports = local_ports(protocol, config)
+        clash = ports_map.conflicts(ports)
+        if clash:
+            errors += [f"{where}: port {port} already used by {owner}" for port, owner in clash]
+            continue
+        ports_map.claim(ports, where)
+        if wants_auto:
+            auto.append((where, config))
+        if protocol in SPEEDTEST_TRANSPORTS:
+            forwards.append((where, config))
+        configs.append((protocol, config))
+
+    # explicit ports are all claimed first, so auto never takes a port a later spec asked for
+    for where, config in auto:
+        try:
+            config['tunnel_port'] = ports_map.allocate(1, owner=where)[0]
+        except ValueError as e:
+            errors.append(f"{where}: {e}")
+    if not errors:
+        for where, config in forwards:
+            try:
+                config['speedtest_port'] = ports_map.allocate(1, owner=f"{where} speedtest forward")[0]
+            except ValueError as e:
+                errors.append(f"{where}: speedtest forward: {e}")
+
+    if errors:
+        raise ManifestError(errors)
+    return configs
+
+
+def _tunnel_row(protocol, config):
+    port = config['client_port'] if protocol == 'gost' else config['tunnel_port']
+    name = config.get('name') or f"{NAMES[protocol]}-{config['tunnel_port']}"
+    return name, protocol, port, config.get('token', 'N/A'), config
+
+
+def _remove_script(renders):
+    """Remote units of `renders` and their config files, removed in one script."""
+    script = remote_remove_script([unit for unit, _, _ in renders])
+    return script + "".join(f"rm -f '{path}'\n" for _, _, files in renders for path, _ in files)
+
+
+def _rollback(ssh, server, rendered):
+    ip, user, password, port, key = server
+    logger.warning(f"Bulk create on {ip} failed; removing its {len(rendered)} unit(s)")
+    try:
+        ok, out = ssh.run_remote_command(ip, user, password, _remove_script([r[2] for r in rendered]), port, key)
+        if not ok:
+            logger.error(f"Rollback on {ip} failed: {out}")
+    except Exception as e:
+        logger.error(f"Rollback on {ip} failed: {e}")
+    try:
+        with UnitTransaction() as tx:
+            for _, (unit, _, files), _ in rendered:
+                tx.remove(unit, files=[path for path, _ in files])
+    except Exception as e:
+        logger.error(f"Local rollback failed: {e}")
+
+
+def _remote_script(renders, forced):
+    files, units = [], []
+    for unit, unit_content, unit_files in renders:
+        files += [(path, content, [unit]) for path, content in unit_files]
+        files.append((f"/etc/systemd/system/{unit}.service", unit_content, [unit]))
+        units.append(unit)
+    return remote_apply_script(files, units, restart=[u for u in units if u in forced])
+
+
+def process_bulk_create(configs):
+    """
+    Task: install many validated tunnels on the connected server as one
+    pipeline: render all, one remote script over the pooled SSH session,
+    one local unit transaction (one daemon-reload), one DB transaction.
+    """
+    server = configs[0][1]
+    ip, user, password, key, port = (server['ssh_ip'], server.get('ssh_user', 'root'), server.get('ssh_pass'),
+                                     server.get('ssh_key'), int(server.get('ssh_port', 22)))
+    yield 5, f"Rendering {len(configs)} tunnel(s)..."
+    rendered = [(protocol, *render_tunnel(protocol, config, config['iran_ip'])) for protocol, config in configs]
+
+    ssh = SSHManager()
+    forced = set()
+    cores = sorted({BINARIES[protocol] for protocol, _ in configs})
+    for i, core in enumerate(cores):
+        yield 10 + 20 * i // len(cores), f"Providing {core} on {ip}..."
+        ok, msg = provide_remote_binary(core, ip, user, password, port, key, f"{REMOTE_BIN_DIR}/{core}", ssh)
+        if not ok:
+            raise RuntimeError(msg)
+        if binary_changed(msg):
+            forced.update(remote[0] for protocol, _, remote in rendered if BINARIES[protocol] == core)
+
+    # From here on a failure (or cancel) must not leave units behind without DB rows
+    try:
+        yield 35, f"Applying {len(rendered)} remote unit(s) in one session..."
+        ok, out = ssh.run_remote_command(ip, user, password, _remote_script([r[2] for r in rendered], forced),
+                                         port, key)
+        if not ok:
+            raise RuntimeError(f"Remote apply failed: {out}")
+
+        yield 65, "Applying local units (single reload)..."
+        with UnitTransaction() as tx:
+            for protocol, (unit, unit_content, files), _ in rendered:
+                core = BINARIES[protocol]
+                plan = ApplyPlan(unit)
+                plan.add_binary(core, f"{LOCAL_BIN_DIR}/{core}", [unit])
+                for path, content in files:
+                    plan.add_file(path, content, [unit])
+                plan.add_unit(unit, unit_content)
+                plan.apply(tx=tx)
+
+        yield 90, "Saving tunnels..."
+        ids = add_tunnels([_tunnel_row(protocol, config) for protocol, config in configs])
+    except BaseException:
+        _rollback(ssh, (ip, user, password, port, key), rendered)
+        raise
+    finally:
+        release([p for protocol, config in configs for p in local_ports(protocol, config)])
+
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result={'created': ids})
+    logger.info(f"Bulk created {len(ids)} tunnel(s) on {ip}")
+    yield 100, f"Created {len(ids)} tunnel(s)"
+
+
+def _remote_teardown(host, tunnels):
+    config = parse_tunnel_config(tunnels[0]['config'])
+    renders = []
+    for t in tunnels:
+        tunnel_config = parse_tunnel_config(t['config'])
+        try:
+            renders.append(render_tunnel(t['transport'], tunnel_config, tunnel_config.get('iran_ip'))[1])
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning(f"Cannot render remote side of tunnel {t['id']}: {e}")
+    if not renders:
+        return True, "nothing to remove"
+    script = _remove_script(renders)
+    return SSHManager().run_remote_command(host, config.get('ssh_user', 'root'), config.get('ssh_pass'), script,
+                                           int(config.get('ssh_port', 22)), config.get('ssh_key'))
+
+
+def process_bulk_delete(tunnel_ids):
+    """
+    Task: remove many tunnels. Local units go in one transaction while each
+    remote host is cleaned up in parallel over its own session; DB rows are
+    deleted together at the end.
+    """
+    tunnels = [t for t in (get_tunnel_by_id(tid) for tid in tunnel_ids) if t]
+    if not tunnels:
+        raise ValueError("No matching tunnels")
+    hosts = {}
+    for t in tunnels:
+        host = parse_tunnel_config(t['config']).get('ssh_ip')
+        if host:
+            hosts.setdefault(host, []).append(t)
+
+    yield 10, f"Removing {len(tunnels)} tunnel(s) on this host and {len(hosts)} remote host(s)..."
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(hosts)))) as pool:
+        futures = {host: pool.submit(_remote_teardown, host, group) for host, group in hosts.items()}
+        with UnitTransaction() as tx:
+            for t in tunnels:
+                queue_teardown(t, tx)
+        yield 50, "Local units removed; waiting for remote hosts..."
+        remote = {}
+        for host, future in futures.items():
+            try:
+                ok, out = future.result()
+            except Exception as e:
+                ok, out = False, str(e)
+            remote[host] = ok
+            if not ok:
+                logger.error(f"Remote teardown on {host} failed: {out}")
+
+    yield 90, "Deleting tunnel rows..."
+    delete_tunnels([t['id'] for t in tunnels])
+
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result={'deleted': [t['id'] for t in tunnels], 'remote': remote})
+    failed = [h for h, ok in remote.items() if not ok]
+    yield 100, f"Deleted {len(tunnels)} tunnel(s)" + (f"; remote cleanup failed on {', '.join(failed)}" if failed else "")
@@ -0,0 +1,107 @@
+import threading
+import time
+import logging
+from core.config_loader import load_config
+from core.database import (record_clean_ip_checks, get_clean_ips, get_clean_ip_domains,
+                           get_clean_ips_for_check, evict_clean_ips)
+from core.scanner import run_scan
+from core.executor import executor, PRIORITY_LOW
+
+logger = logging.getLogger("CleanIPCache")
+
+DEFAULT_TTL = 6 * 3600                 # an IP stays "known good" this long after its last success
+DEFAULT_REVALIDATE_INTERVAL = 900      # seconds between background re-probes
+DEFAULT_WARM_MIN = 5                   # fewer fresh IPs than this -> full sweep
+MAX_FAIL_STREAK = 3
+MIN_SUCCESS_RATE = 0.5
+MIN_CHECKS = 4
+REVALIDATE_CONCURRENCY = 100
+REVALIDATE_SAMPLES = 3
+REVALIDATE_KEY = "clean-ip-revalidate"
+
+
+def _cfg(key, default):
+    return load_config().get(key, default)
+
+
+def record(domain, results):
+    """Store probe results (hits and misses) for `domain`."""
+    if not results:
+        return 0, 0
+    return record_clean_ip_checks(domain, results, _cfg('clean_ip_ttl', DEFAULT_TTL), time.time())
+
+
+def warm(domain, limit=None):
+    """Cached good IPs for `domain`, best first (empty if none / all expired)."""
+    rows = get_clean_ips(domain, time.time(), limit)
+    return [{
+        'ip': r['ip'],
+        'latency': round(r['latency'], 1),
+        'jitter': r['jitter'],
+        'loss': round(1 - r['success_rate'], 3),
+        'success_rate': round(r['success_rate'], 3),
+        'last_seen': r['last_seen'],
+        'cached': True,
+    } for r in rows]
+
+
+def is_warm(domain):
+    need = _cfg('clean_ip_warm_min', DEFAULT_WARM_MIN)
+    return len(get_clean_ips(domain, time.time(), need)) >= need
+
+
+def revalidate_clean_ips(domains=None):
+    """
+    Executor task (low priority): re-probe every cached IP, update its stats
+    and drop entries that expired, keep failing or are mostly failing.
+    """
+    domains = domains or get_clean_ip_domains()
+    total = len(domains) or 1
+    for n, domain in enumerate(domains, 1):
+        ips = get_clean_ips_for_check(domain)
+        results = []
+        run_scan(ips, domain, concurrency=REVALIDATE_CONCURRENCY, samples=REVALIDATE_SAMPLES,
+                 on_result=results.append)
+        good, bad = record(domain, results)
+        yield int(95 * n / total), f"{domain}: {good} still clean, {bad} failed"
+
+    evicted = evict_clean_ips(time.time(), MAX_FAIL_STREAK, MIN_SUCCESS_RATE, MIN_CHECKS)
+    yield 100, f"Re-validated {len(domains)} domains, evicted {evicted} dead IPs"
+
+
+class RevalidationScheduler(threading.Thread):
+    """Queues a low-priority re-validation task every `interval` seconds."""
+
+    def __init__(self, interval=DEFAULT_REVALIDATE_INTERVAL):
+        super().__init__(name="clean-ip-revalidator", daemon=True)
+        self.interval = max(60, int(interval))
+        self._stop_event = threading.Event()
+
+    def trigger(self):
+        # Never stack a second run behind a slow one
+        if executor.find(REVALIDATE_KEY) or not get_clean_ip_domains():
+            return None
+        return executor.submit(revalidate_clean_ips, (), key=REVALIDATE_KEY, priority=PRIORITY_LOW)
+
+    def run(self):
+        logger.info(f"Clean IP re-validation every {self.interval}s")
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.trigger()
+            except Exception as e:
+                logger.error(f"Clean IP re-validation failed to start: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+scheduler = None
+
+
+def start_revalidation_scheduler():
+    global scheduler
+    if scheduler and scheduler.is_alive():
+        return scheduler
+    scheduler = RevalidationScheduler(_cfg('clean_ip_revalidate_interval', DEFAULT_REVALIDATE_INTERVAL))
+    scheduler.start()
+    return scheduler
@@ -0,0 +1,131 @@
+import threading
+import time
+import logging
+from core.accounting import accountant
+from core.config_loader import load_config
+from core.database import add_traffic_batch
+from core.timeseries import rollup, bucket_of, RAW_RES
+
+logger = logging.getLogger("TrafficCollector")
+
+DEFAULT_SAMPLE_INTERVAL = 10
+DEFAULT_FLUSH_INTERVAL = 60
+
+
+class TrafficCollector(threading.Thread):
+    """
+    Samples the accounting counters every `sample_interval` seconds, turns
+    them into per-tunnel deltas and writes the accumulated deltas to SQLite
+    every `flush_interval` seconds in one batched transaction, together with
+    the raw 10s time-series points. Rollups run incrementally after a flush.
+    """
+
+    def __init__(self, sample_interval=DEFAULT_SAMPLE_INTERVAL, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        super().__init__(name="traffic-collector", daemon=True)
+        self.sample_interval = max(1, int(sample_interval))
+        self.flush_interval = max(self.sample_interval, int(flush_interval))
+        self._stop_event = threading.Event()
+        self._last = {}      # rule comment -> last seen counter
+        self._pending = {}   # tunnel_id -> [rx, tx] not yet written
+        self._samples = {}   # (tunnel_id, bucket) -> [rx, tx] not yet written
+        self._lock = threading.Lock()
+
+    def sample(self):
+        accountant.refresh(force=True)
+        counters = accountant.get_rule_counters()
+        deltas = {}
+        for comment, value in counters.items():
+            prev = self._last.get(comment)
+            if prev is None:
+                # Rules we created start from zero; pre-existing ones were
+                # already accounted for before the panel restarted.
+                prev = 0 if comment in accountant.created else value
+            delta = value - prev if value >= prev else value  # counter reset
+            self._last[comment] = value
+            if delta:
+                tid, direction = comment.split(':')[1:3]
+                entry = deltas.setdefault(int(tid), [0, 0])
+                entry[0 if direction == 'rx' else 1] += delta
+
+        # Forget rules that no longer exist (deleted tunnels)
+        for comment in set(self._last) - set(counters):
+            del self._last[comment]
+
+        bucket = bucket_of(time.time())
+        with self._lock:
+            for tid, (rx, tx) in deltas.items():
+                entry = self._pending.setdefault(tid, [0, 0])
+                entry[0] += rx
+                entry[1] += tx
+                point = self._samples.setdefault((tid, bucket), [0, 0])
+                point[0] += rx
+                point[1] += tx
+        return deltas
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            samples, self._samples = self._samples, {}
+        if not pending:
+            return 0
+        try:
+            return add_traffic_batch([(tid, rx, tx) for tid, (rx, tx) in pending.items()],
+                                     samples=[(tid, bucket, rx, tx) for (tid, bucket), (rx, tx) in samples.items()],
+                                     res=RAW_RES)
+        except Exception as e:
+            logger.error(f"Traffic flush failed: {e}")
+            # Put the deltas back so the next flush retries them
+            with self._lock:
+                for tid, (rx, tx) in pending.items():
+                    entry = self._pending.setdefault(tid, [0, 0])
+                    entry[0] += rx
+                    entry[1] += tx
+                for key, (rx, tx) in samples.items():
+                    point = self._samples.setdefault(key, [0, 0])
+                    point[0] += rx
+                    point[1] += tx
+            return 0
+
+    def rollup(self):
+        # Buckets stay open for samples that are still waiting for a flush
+        try:
+            return rollup(grace=self.flush_interval + 2 * self.sample_interval)
+        except Exception as e:
+            logger.error(f"Traffic rollup failed: {e}")
+            return 0
+
+    def run(self):
+        logger.info(f"Traffic Collector Started (sample={self.sample_interval}s, flush={self.flush_interval}s)")
+        last_flush = time.time()
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+                if time.time() - last_flush >= self.flush_interval:
+                    self.flush()
+                    self.rollup()
+                    last_flush = time.time()
+            except Exception as e:
+                logger.error(f"Traffic sample failed: {e}", exc_info=True)
+            self._stop_event.wait(self.sample_interval)
+        self.flush()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+collector = None
+
+
+def start_traffic_collector():
+    global collector
+    if collector and collector.is_alive():
+        return collector
+    cfg = load_config()
+    collector = TrafficCollector(
+        cfg.get('traffic_sample_interval', DEFAULT_SAMPLE_INTERVAL),
+        cfg.get('traffic_flush_interval', DEFAULT_FLUSH_INTERVAL),
+    )
+    # Stats requests should never refresh synchronously while we are sampling
+    accountant.max_age = collector.sample_interval * 3
+    collector.start()
+    return collector
@@ -25,4 +25,14 @@ def save_config(key, value):
     config[key] = value
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f, indent=4)
-    return config
\ No newline at end of file
+    return config
+
+def ensure_defaults(defaults):
+    """کلیدهای پیش‌فرض را فقط اگر در فایل نباشند اضافه می‌کند"""
+    config = load_config()
+    missing = {k: v for k, v in defaults.items() if k not in config}
+    if missing:
+        config.update(missing)
+        with open(CONFIG_FILE, 'w') as f:
+            json.dump(config, f, indent=4)
+    return config
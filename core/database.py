@@ -2,179 +2,584 @@ import sqlite3
 import json
 import os
 import datetime
+import queue
+import threading
+import contextlib
 
 DB_PATH = "alamor.db"
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
 
-class Database:
-    def __init__(self):
-        self.init_db()
+# ==========================================
+# Schema Migrations (PRAGMA user_version)
+# ==========================================
+# هر مایگریشن فقط یک بار اجرا می‌شود؛ ورژن = ایندکس + 1
+
+def _migration_1_base_schema(c):
+    # 1. Users Table
+    c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)''')
+
+    # 2. Servers Table (Added ssh_key)
+    c.execute('''CREATE TABLE IF NOT EXISTS servers (
+        ip TEXT PRIMARY KEY,
+        user TEXT,
+        password TEXT,
+        ssh_key TEXT,
+        port INTEGER
+    )''')
+
+    # 3. Tunnels Table (Added traffic stats)
+    c.execute('''CREATE TABLE IF NOT EXISTS tunnels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        transport TEXT,
+        port TEXT,
+        token TEXT,
+        config TEXT,
+        status TEXT DEFAULT 'active',
+        total_rx INTEGER DEFAULT 0,
+        total_tx INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # 4. Traffic History Table (For Charts)
+    c.execute('''CREATE TABLE IF NOT EXISTS traffic_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tunnel_id INTEGER,
+        date DATE,
+        rx INTEGER DEFAULT 0,
+        tx INTEGER DEFAULT 0,
+        UNIQUE(tunnel_id, date)
+    )''')
+
+    # Default Admin
+    c.execute("SELECT * FROM users WHERE username='admin'")
+    if not c.fetchone():
+        c.execute("INSERT INTO users VALUES ('admin', 'admin')")
+
+
+def _migration_2_multi_server(c):
+    # چند سرور خارج؛ سرور پیش‌فرض همان «سرور متصل» قبلی است
+    c.execute("ALTER TABLE servers ADD COLUMN label TEXT")
+    c.execute("ALTER TABLE servers ADD COLUMN is_default INTEGER DEFAULT 0")
+    c.execute("ALTER TABLE servers ADD COLUMN created_at TIMESTAMP")
+    c.execute("UPDATE servers SET is_default = 1 WHERE rowid = (SELECT MIN(rowid) FROM servers)")
+
+
+def _migration_3_scan_jobs(c):
+    # اسکن‌های IP تمیز: وضعیت + چک‌پوینت برای ادامه بعد از ریستارت
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_jobs (
+        id TEXT PRIMARY KEY,
+        domain TEXT,
+        params TEXT,
+        status TEXT DEFAULT 'queued',
+        cursor INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        probed INTEGER DEFAULT 0,
+        hits INTEGER DEFAULT 0,
+        top TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_hits (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id TEXT,
+        ip TEXT,
+        latency REAL,
+        jitter REAL,
+        loss REAL,
+        status INTEGER,
+        found_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(job_id, ip)
+    )''')
+
+
+def _migration_4_clean_ip_cache(c):
+    # IPهای تمیز قبلی هر دامنه (زمان‌ها به صورت epoch)
+    c.execute('''CREATE TABLE IF NOT EXISTS clean_ips (
+        domain TEXT,
+        ip TEXT,
+        latency REAL,
+        jitter REAL,
+        checks INTEGER DEFAULT 0,
+        successes INTEGER DEFAULT 0,
+        fail_streak INTEGER DEFAULT 0,
+        last_seen REAL,
+        last_checked REAL,
+        expires_at REAL,
+        PRIMARY KEY (domain, ip)
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clean_ips_expiry ON clean_ips (domain, expires_at)")
+
+
+def _migration_5_scan_sampler_state(c):
+    # وضعیت نمونه‌گیر تطبیقی برای ادامه اسکن
+    c.execute("ALTER TABLE scan_jobs ADD COLUMN state TEXT")
+
+
+def _migration_6_probe_stats(c):
+    # هیستوگرام تاخیر پراب‌های تانل، یک ردیف برای هر پنجره
+    c.execute('''CREATE TABLE IF NOT EXISTS probe_stats (
+        tunnel_id INTEGER,
+        ts REAL,
+        samples INTEGER,
+        failures INTEGER,
+        connect_p50 REAL,
+        p50 REAL,
+        p95 REAL,
+        p99 REAL,
+        max REAL,
+        histogram TEXT
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_probe_stats_tunnel ON probe_stats (tunnel_id, ts)")
 
-    def get_db(self):
-        conn = sqlite3.connect(DB_PATH)
+
+def _migration_7_speedtest_history(c):
+    # نتیجه هر تست سرعت (tunnel_id خالی = تست از خود سرور)
+    c.execute('''CREATE TABLE IF NOT EXISTS speedtest_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tunnel_id INTEGER,
+        transport TEXT,
+        ts REAL,
+        ping REAL,
+        download REAL,
+        upload REAL,
+        streams INTEGER,
+        duration INTEGER,
+        detail TEXT,
+        error TEXT
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_speedtest_history ON speedtest_history (tunnel_id, ts)")
+
+
+def _migration_8_traffic_series(c):
+    # سری زمانی ترافیک با چند رزولوشن (res = طول باکت به ثانیه، bucket = شروع باکت epoch)
+    c.execute('''CREATE TABLE IF NOT EXISTS traffic_series (
+        tunnel_id INTEGER,
+        res INTEGER,
+        bucket INTEGER,
+        rx INTEGER DEFAULT 0,
+        tx INTEGER DEFAULT 0,
+        PRIMARY KEY (res, tunnel_id, bucket)
+    ) WITHOUT ROWID''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_traffic_series_bucket ON traffic_series (res, bucket)")
+    # تا کجا هر رزولوشن از رزولوشن ریزتر ساخته شده
+    c.execute('''CREATE TABLE IF NOT EXISTS traffic_rollups (
+        res INTEGER PRIMARY KEY,
+        done_until INTEGER
+    )''')
+
+
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_multi_server,
+    _migration_3_scan_jobs,
+    _migration_4_clean_ip_cache,
+    _migration_5_scan_sampler_state,
+    _migration_6_probe_stats,
+    _migration_7_speedtest_history,
+    _migration_8_traffic_series,
+]
+
+
+def migrate(conn):
+    """Run every migration newer than the file's user_version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {number}")
+    return len(MIGRATIONS)
+
+
+# ==========================================
+# Connection Pool
+# ==========================================
+
+class ConnectionPool:
+    """
+    A small pool of long-lived SQLite connections.
+    A thread re-uses the connection it already holds (nested calls), and
+    connections go back to the pool instead of being closed.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
         return conn
 
+    @contextlib.contextmanager
+    def connection(self):
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            # Nested use inside the same thread: share the outer transaction
+            yield held
+            return
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        self._local.conn = conn
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            self._local.conn = None
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool():
+    # Keyed by path so tools/benchmarks that swap DB_PATH get their own pool
+    pool = _pools.get(DB_PATH)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(DB_PATH)
+            if pool is None:
+                pool = ConnectionPool(DB_PATH)
+                with pool.connection() as conn:
+                    migrate(conn)
+                _pools[DB_PATH] = pool
+    return pool
+
+
+class Database:
+    def __init__(self):
+        # Schema is created once per process (see get_pool)
+        self.pool = get_pool()
+
+    def connection(self):
+        return self.pool.connection()
+
     def init_db(self):
-        conn = self.get_db()
-        c = conn.cursor()
-        
-        # 1. Users Table
-        c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)''')
-        
-        # 2. Servers Table (Added ssh_key)
-        c.execute('''CREATE TABLE IF NOT EXISTS servers (
-            ip TEXT PRIMARY KEY, 
-            user TEXT, 
-            password TEXT, 
-            ssh_key TEXT, 
-            port INTEGER
-        )''')
-        
-        # 3. Tunnels Table (Added traffic stats)
-        c.execute('''CREATE TABLE IF NOT EXISTS tunnels (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            name TEXT, 
-            transport TEXT, 
-            port TEXT, 
-            token TEXT, 
-            config TEXT, 
-            status TEXT DEFAULT 'active',
-            total_rx INTEGER DEFAULT 0,
-            total_tx INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-
-        # 4. Traffic History Table (For Charts)
-        c.execute('''CREATE TABLE IF NOT EXISTS traffic_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tunnel_id INTEGER,
-            date DATE,
-            rx INTEGER DEFAULT 0,
-            tx INTEGER DEFAULT 0,
-            UNIQUE(tunnel_id, date)
-        )''')
-        
-        # Default Admin
-        c.execute("SELECT * FROM users WHERE username='admin'")
-        if not c.fetchone():
-            c.execute("INSERT INTO users VALUES ('admin', 'admin')")
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            return migrate(conn)
 
     # --- Server Management ---
-    def add_server(self, ip, user, password, ssh_key, port):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("DELETE FROM servers") # Single server mode for now
-        c.execute("INSERT INTO servers VALUES (?, ?, ?, ?, ?)", (ip, user, password, ssh_key, port))
-        conn.commit()
-        conn.close()
+    SERVER_COLUMNS = "ip, user, password, ssh_key, port"
+
+    def add_server(self, ip, user, password, ssh_key, port, label=None, make_default=True):
+        with self.connection() as conn:
+            conn.execute("""INSERT INTO servers (ip, user, password, ssh_key, port, label, created_at)
+                            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                            ON CONFLICT(ip) DO UPDATE SET user=excluded.user, password=excluded.password,
+                                ssh_key=excluded.ssh_key, port=excluded.port, label=COALESCE(excluded.label, label)""",
+                         (ip, user, password, ssh_key, port, label))
+            if make_default:
+                conn.execute("UPDATE servers SET is_default = (ip = ?)", (ip,))
 
     def get_connected_server(self):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM servers LIMIT 1")
-        res = c.fetchone()
-        conn.close()
+        """Default server as (ip, user, password, ssh_key, port)"""
+        with self.connection() as conn:
+            res = conn.execute(f"SELECT {self.SERVER_COLUMNS} FROM servers ORDER BY is_default DESC, rowid LIMIT 1").fetchone()
         return tuple(res) if res else None
 
-    def remove_server(self):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("DELETE FROM servers")
-        conn.commit()
-        conn.close()
+    def get_servers(self, ips=None):
+        with self.connection() as conn:
+            if ips:
+                marks = ",".join("?" * len(ips))
+                return conn.execute(f"SELECT * FROM servers WHERE ip IN ({marks}) ORDER BY rowid", list(ips)).fetchall()
+            return conn.execute("SELECT * FROM servers ORDER BY is_default DESC, rowid").fetchall()
+
+    def remove_server(self, ip=None):
+        with self.connection() as conn:
+            if ip is None:
+                conn.execute("DELETE FROM servers WHERE rowid = (SELECT rowid FROM servers ORDER BY is_default DESC, rowid LIMIT 1)")
+            else:
+                conn.execute("DELETE FROM servers WHERE ip=?", (ip,))
+            # Keep exactly one default while servers remain
+            if not conn.execute("SELECT 1 FROM servers WHERE is_default = 1").fetchone():
+                conn.execute("UPDATE servers SET is_default = 1 WHERE rowid = (SELECT MIN(rowid) FROM servers)")
 
     # --- User Management ---
     def check_user(self, username, password):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-        res = c.fetchone()
-        conn.close()
-        return res
+        with self.connection() as conn:
+            return conn.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password)).fetchone()
 
     def update_password(self, new_pass):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("UPDATE users SET password=? WHERE username='admin'", (new_pass,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute("UPDATE users SET password=? WHERE username='admin'", (new_pass,))
 
     # --- Tunnel Management ---
     def get_tunnels(self):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM tunnels ORDER BY id DESC")
-        res = c.fetchall()
-        conn.close()
-        return res
+        with self.connection() as conn:
+            return conn.execute("SELECT * FROM tunnels ORDER BY id DESC").fetchall()
 
     def get_tunnel(self, tunnel_id):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM tunnels WHERE id=?", (tunnel_id,))
-        res = c.fetchone()
-        conn.close()
-        return res
+        with self.connection() as conn:
+            return conn.execute("SELECT * FROM tunnels WHERE id=?", (tunnel_id,)).fetchone()
 
     def add_tunnel(self, name, transport, port, token, config_dict):
-        conn = self.get_db()
-        c = conn.cursor()
         config_json = json.dumps(config_dict)
-        c.execute("INSERT INTO tunnels (name, transport, port, token, config, status) VALUES (?, ?, ?, ?, ?, ?)", 
-                  (name, transport, str(port), token, config_json, 'active'))
-        tunnel_id = c.lastrowid
-        conn.commit()
-        conn.close()
-        return tunnel_id
+        with self.connection() as conn:
+            c = conn.execute("INSERT INTO tunnels (name, transport, port, token, config, status) VALUES (?, ?, ?, ?, ?, ?)",
+                             (name, transport, str(port), token, config_json, 'active'))
+            return c.lastrowid
+
+    def add_tunnels(self, rows):
+        """rows: [(name, transport, port, token, config_dict), ...] -> ids, one transaction"""
+        ids = []
+        with self.connection() as conn:
+            for name, transport, port, token, config_dict in rows:
+                c = conn.execute("INSERT INTO tunnels (name, transport, port, token, config, status) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (name, transport, str(port), token, json.dumps(config_dict), 'active'))
+                ids.append(c.lastrowid)
+        return ids
+
+    def delete_tunnels(self, tunnel_ids):
+        with self.connection() as conn:
+            conn.executemany("DELETE FROM tunnels WHERE id=?", [(tid,) for tid in tunnel_ids])
+        return True
 
     def delete_tunnel(self, tunnel_id):
-        conn = self.get_db()
-        c = conn.cursor()
-        c.execute("DELETE FROM tunnels WHERE id=?", (tunnel_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute("DELETE FROM tunnels WHERE id=?", (tunnel_id,))
         return True
 
     def update_tunnel(self, tunnel_id, name, transport, port, config_dict):
-        conn = self.get_db()
-        c = conn.cursor()
         config_json = json.dumps(config_dict)
-        c.execute("UPDATE tunnels SET name=?, transport=?, port=?, config=? WHERE id=?", 
-                  (name, transport, str(port), config_json, tunnel_id))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            conn.execute("UPDATE tunnels SET name=?, transport=?, port=?, config=? WHERE id=?",
+                         (name, transport, str(port), config_json, tunnel_id))
 
     # --- Traffic Logging ---
     def update_traffic_usage(self, tunnel_id, rx_increment, tx_increment):
-        conn = self.get_db()
-        c = conn.cursor()
-        today = datetime.date.today()
-        
-        # Update Total
-        c.execute("UPDATE tunnels SET total_rx = total_rx + ?, total_tx = total_tx + ? WHERE id=?", 
-                  (rx_increment, tx_increment, tunnel_id))
-        
-        # Update Daily History
-        c.execute("INSERT OR IGNORE INTO traffic_history (tunnel_id, date, rx, tx) VALUES (?, ?, 0, 0)", 
-                  (tunnel_id, today))
-        c.execute("UPDATE traffic_history SET rx = rx + ?, tx = tx + ? WHERE tunnel_id=? AND date=?", 
-                  (rx_increment, tx_increment, tunnel_id, today))
-        
-        conn.commit()
-        conn.close()
+        self.add_traffic_batch([(tunnel_id, rx_increment, tx_increment)])
+
+    def add_traffic_batch(self, rows, day=None, samples=None, res=None):
+        """
+        rows: [(tunnel_id, rx_increment, tx_increment), ...] -> one transaction
+        samples: [(tunnel_id, bucket, rx, tx), ...] raw time-series points at resolution `res`
+        """
+        rows = [(tid, int(rx), int(tx)) for tid, rx, tx in rows if rx or tx]
+        if not rows:
+            return 0
+        day = day or datetime.date.today()
+        with self.connection() as conn:
+            # Update Total
+            conn.executemany("UPDATE tunnels SET total_rx = total_rx + ?, total_tx = total_tx + ? WHERE id=?",
+                             [(rx, tx, tid) for tid, rx, tx in rows])
+            # Update Daily History (UPSERT)
+            conn.executemany("""INSERT INTO traffic_history (tunnel_id, date, rx, tx) VALUES (?, ?, ?, ?)
+                                ON CONFLICT(tunnel_id, date) DO UPDATE SET rx = rx + excluded.rx, tx = tx + excluded.tx""",
+                             [(tid, day, rx, tx) for tid, rx, tx in rows])
+            if samples:
+                conn.executemany("""INSERT INTO traffic_series (tunnel_id, res, bucket, rx, tx) VALUES (?, ?, ?, ?, ?)
+                                    ON CONFLICT(res, tunnel_id, bucket) DO UPDATE SET rx = rx + excluded.rx, tx = tx + excluded.tx""",
+                                 [(tid, res, bucket, int(rx), int(tx)) for tid, bucket, rx, tx in samples])
+        return len(rows)
+
+    # --- Traffic Time Series ---
+    def get_rollup_marks(self):
+        with self.connection() as conn:
+            return {r['res']: r['done_until'] for r in conn.execute("SELECT res, done_until FROM traffic_rollups")}
+
+    def rollup_traffic(self, src, dst, start, end, prune_before=None):
+        """
+        Aggregate `src` buckets in [start, end) into `dst` buckets, move the
+        `dst` mark to `end` and drop `src` rows older than `prune_before`,
+        all in one transaction.
+        """
+        with self.connection() as conn:
+            c = conn.execute("""INSERT INTO traffic_series (tunnel_id, res, bucket, rx, tx)
+                                SELECT tunnel_id, ?, (bucket / ?) * ?, SUM(rx), SUM(tx) FROM traffic_series
+                                WHERE res = ? AND bucket >= ? AND bucket < ?
+                                GROUP BY tunnel_id, bucket / ?
+                                ON CONFLICT(res, tunnel_id, bucket) DO UPDATE SET rx = rx + excluded.rx, tx = tx + excluded.tx""",
+                             (dst, dst, dst, src, start, end, dst))
+            conn.execute("""INSERT INTO traffic_rollups (res, done_until) VALUES (?, ?)
+                            ON CONFLICT(res) DO UPDATE SET done_until = excluded.done_until""", (dst, end))
+            if prune_before:
+                conn.execute("DELETE FROM traffic_series WHERE res = ? AND bucket < ?", (src, prune_before))
+            return c.rowcount
+
+    def get_traffic_series(self, res, start, end, group, tunnel_id=None):
+        """Points of resolution `res` in [start, end), regrouped into `group`-second buckets."""
+        where = "res = ? AND bucket >= ? AND bucket < ?"
+        params = [group, group, res, start, end]
+        if tunnel_id is not None:
+            where += " AND tunnel_id = ?"
+            params.append(tunnel_id)
+        with self.connection() as conn:
+            return conn.execute(f"""SELECT (bucket / ?) * ? AS ts, SUM(rx) AS rx, SUM(tx) AS tx FROM traffic_series
+                                    WHERE {where} GROUP BY ts ORDER BY ts""", params).fetchall()
+
+    # --- Clean IP Scan Jobs ---
+    SCAN_JOB_FIELDS = ('status', 'cursor', 'total', 'probed', 'hits', 'top', 'error', 'state')
+
+    def create_scan_job(self, job_id, domain, params, total):
+        with self.connection() as conn:
+            conn.execute("INSERT INTO scan_jobs (id, domain, params, total) VALUES (?, ?, ?, ?)",
+                         (job_id, domain, json.dumps(params), total))
+
+    def update_scan_job(self, job_id, **fields):
+        fields = {k: v for k, v in fields.items() if k in self.SCAN_JOB_FIELDS}
+        for key in ('top', 'state'):
+            if key in fields and fields[key] is not None and not isinstance(fields[key], str):
+                fields[key] = json.dumps(fields[key])
+        if not fields:
+            return
+        sets = ", ".join(f"{k}=?" for k in fields)
+        with self.connection() as conn:
+            conn.execute(f"UPDATE scan_jobs SET {sets}, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                         (*fields.values(), job_id))
+
+    def get_scan_job(self, job_id):
+        with self.connection() as conn:
+            return conn.execute("SELECT * FROM scan_jobs WHERE id=?", (job_id,)).fetchone()
+
+    def get_scan_jobs(self, statuses=None, limit=50):
+        with self.connection() as conn:
+            if statuses:
+                marks = ",".join("?" * len(statuses))
+                return conn.execute(f"SELECT * FROM scan_jobs WHERE status IN ({marks}) ORDER BY created_at",
+                                    list(statuses)).fetchall()
+            return conn.execute("SELECT * FROM scan_jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+
+    def add_scan_hits(self, job_id, hits):
+        """A chunk re-scanned after a restart just refreshes the same rows."""
+        with self.connection() as conn:
+            conn.executemany("""INSERT INTO scan_hits (job_id, ip, latency, jitter, loss, status) VALUES (?, ?, ?, ?, ?, ?)
+                                ON CONFLICT(job_id, ip) DO UPDATE SET latency=excluded.latency, jitter=excluded.jitter,
+                                    loss=excluded.loss, status=excluded.status""",
+                             [(job_id, h['ip'], h['latency'], h.get('jitter', 0), h.get('loss', 0), h.get('status'))
+                              for h in hits])
+
+    def get_scan_hits(self, job_id, after_id=0):
+        with self.connection() as conn:
+            return conn.execute("SELECT * FROM scan_hits WHERE job_id=? AND id>? ORDER BY id",
+                                (job_id, after_id)).fetchall()
+
+    # --- Clean IP Cache ---
+    def record_clean_ip_checks(self, domain, results, ttl, now):
+        """results: probe dicts (ip, ok, latency, jitter). Latency is smoothed (EWMA)."""
+        good = [(domain, r['ip'], r['latency'], r.get('jitter') or 0, now, now, now + ttl) for r in results if r['ok']]
+        bad = [(now, domain, r['ip']) for r in results if not r['ok']]
+        with self.connection() as conn:
+            conn.executemany("""INSERT INTO clean_ips (domain, ip, latency, jitter, checks, successes, fail_streak,
+                                                       last_seen, last_checked, expires_at)
+                                VALUES (?, ?, ?, ?, 1, 1, 0, ?, ?, ?)
+                                ON CONFLICT(domain, ip) DO UPDATE SET
+                                    latency = COALESCE(0.7 * latency + 0.3 * excluded.latency, excluded.latency),
+                                    jitter = excluded.jitter, checks = checks + 1, successes = successes + 1,
+                                    fail_streak = 0, last_seen = excluded.last_seen,
+                                    last_checked = excluded.last_checked, expires_at = excluded.expires_at""", good)
+            conn.executemany("""UPDATE clean_ips SET checks = checks + 1, fail_streak = fail_streak + 1, last_checked = ?
+                                WHERE domain = ? AND ip = ?""", bad)
+        return len(good), len(bad)
+
+    def get_clean_ips(self, domain, now, limit=None):
+        """Unexpired entries, best first."""
+        with self.connection() as conn:
+            return conn.execute("""SELECT *, CAST(successes AS REAL) / checks AS success_rate FROM clean_ips
+                                   WHERE domain = ? AND expires_at > ? AND fail_streak = 0
+                                   ORDER BY latency + 2 * jitter LIMIT ?""",
+                                (domain, now, limit or -1)).fetchall()
+
+    def get_clean_ip_domains(self):
+        with self.connection() as conn:
+            return [r[0] for r in conn.execute("SELECT DISTINCT domain FROM clean_ips")]
+
+    def get_clean_ips_for_check(self, domain):
+        with self.connection() as conn:
+            return [r[0] for r in conn.execute("SELECT ip FROM clean_ips WHERE domain = ? ORDER BY last_checked",
+                                               (domain,))]
+
+    def evict_clean_ips(self, now, max_fail_streak, min_success_rate, min_checks):
+        with self.connection() as conn:
+            c = conn.execute("""DELETE FROM clean_ips WHERE expires_at <= ? OR fail_streak >= ?
+                                OR (checks >= ? AND CAST(successes AS REAL) / checks < ?)""",
+                             (now, max_fail_streak, min_checks, min_success_rate))
+            return c.rowcount
+
+    # --- Tunnel Probes ---
+    def add_probe_stats(self, rows, keep_since=None):
+        """rows: [(tunnel_id, ts, samples, failures, connect_p50, p50, p95, p99, max, histogram), ...]"""
+        with self.connection() as conn:
+            conn.executemany("""INSERT INTO probe_stats (tunnel_id, ts, samples, failures, connect_p50,
+                                p50, p95, p99, max, histogram) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            if keep_since:
+                conn.execute("DELETE FROM probe_stats WHERE ts < ?", (keep_since,))
+        return len(rows)
+
+    def get_probe_stats(self, tunnel_id, since=0):
+        with self.connection() as conn:
+            return conn.execute("""SELECT ts, samples, failures, connect_p50, p50, p95, p99, max FROM probe_stats
+                                   WHERE tunnel_id = ? AND ts >= ? ORDER BY ts""", (tunnel_id, since)).fetchall()
+
+    # --- Speedtest History ---
+    def add_speedtest_result(self, tunnel_id, transport, ts, ping, download, upload, streams=None,
+                             duration=None, detail=None, error=None):
+        with self.connection() as conn:
+            conn.execute("""INSERT INTO speedtest_history (tunnel_id, transport, ts, ping, download, upload,
+                            streams, duration, detail, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                         (tunnel_id, transport, ts, ping, download, upload, streams, duration,
+                          json.dumps(detail) if detail is not None else None, error))
+
+    def get_speedtest_history(self, tunnel_id=None, since=0, limit=500):
+        """Oldest first; tunnel_id=None -> tests run from the host itself."""
+        with self.connection() as conn:
+            rows = conn.execute("""SELECT id, tunnel_id, transport, ts, ping, download, upload, streams, duration, error
+                                   FROM speedtest_history WHERE tunnel_id IS ? AND ts >= ?
+                                   ORDER BY ts DESC LIMIT ?""", (tunnel_id, since, limit)).fetchall()
+            return rows[::-1]
 
 # Wrappers
 def init_db(): Database()
 def get_connected_server(): return Database().get_connected_server()
-def add_server(ip, user, password, ssh_key, port): Database().add_server(ip, user, password, ssh_key, port)
-def remove_server(): Database().remove_server()
+def add_server(ip, user, password, ssh_key, port, label=None, make_default=True): Database().add_server(ip, user, password, ssh_key, port, label, make_default)
+def remove_server(ip=None): Database().remove_server(ip)
+def get_servers(ips=None): return Database().get_servers(ips)
 def check_user(u, p): return Database().check_user(u, p)
 def update_password(p): Database().update_password(p)
 def get_all_tunnels(): return Database().get_tunnels()
 def get_tunnel_by_id(tid): return Database().get_tunnel(tid)
 def add_tunnel(name, transport, port, token, config): return Database().add_tunnel(name, transport, port, token, config)
 def delete_tunnel_by_id(tid): return Database().delete_tunnel(tid)
-def update_tunnel_config(tid, name, transport, port, config): return Database().update_tunnel(tid, name, transport, port, config)
\ No newline at end of file
+def add_tunnels(rows): return Database().add_tunnels(rows)
+def delete_tunnels(tids): return Database().delete_tunnels(tids)
+def update_tunnel_config(tid, name, transport, port, config): return Database().update_tunnel(tid, name, transport, port, config)
+def add_traffic_batch(rows, samples=None, res=None): return Database().add_traffic_batch(rows, samples=samples, res=res)
+def create_scan_job(job_id, domain, params, total): Database().create_scan_job(job_id, domain, params, total)
+def update_scan_job(job_id, **fields): Database().update_scan_job(job_id, **fields)
+def get_scan_job(job_id): return Database().get_scan_job(job_id)
+def get_scan_jobs(statuses=None, limit=50): return Database().get_scan_jobs(statuses, limit)
+def add_scan_hits(job_id, hits): Database().add_scan_hits(job_id, hits)
+def get_scan_hits(job_id, after_id=0): return Database().get_scan_hits(job_id, after_id)
+def record_clean_ip_checks(domain, results, ttl, now): return Database().record_clean_ip_checks(domain, results, ttl, now)
+def get_clean_ips(domain, now, limit=None): return Database().get_clean_ips(domain, now, limit)
+def get_clean_ip_domains(): return Database().get_clean_ip_domains()
+def get_clean_ips_for_check(domain): return Database().get_clean_ips_for_check(domain)
+def evict_clean_ips(now, max_fail_streak, min_success_rate, min_checks): return Database().evict_clean_ips(now, max_fail_streak, min_success_rate, min_checks)
+def add_probe_stats(rows, keep_since=None): return Database().add_probe_stats(rows, keep_since)
+def get_probe_stats(tunnel_id, since=0): return Database().get_probe_stats(tunnel_id, since)
+def add_speedtest_result(tunnel_id, transport, ts, ping, download, upload, streams=None, duration=None, detail=None, error=None): Database().add_speedtest_result(tunnel_id, transport, ts, ping, download, upload, streams, duration, detail, error)
+def get_speedtest_history(tunnel_id=None, since=0, limit=500): return Database().get_speedtest_history(tunnel_id, since, limit)
+def get_rollup_marks(): return Database().get_rollup_marks()
+def rollup_traffic(src, dst, start, end, prune_before=None): return Database().rollup_traffic(src, dst, start, end, prune_before)
+def get_traffic_series(res, start, end, group, tunnel_id=None): return Database().get_traffic_series(res, start, end, group, tunnel_id)
@@ -0,0 +1,238 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+from contextlib import contextmanager
+from core.tasks import task_status, init_task, set_current_task
+
+logger = logging.getLogger("TaskExecutor")
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+DEFAULT_WORKERS = 2
+METRIC_WINDOW = 200  # last N jobs used for wait/run time stats
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, task_id, func, args, key, priority):
+        self.task_id = task_id
+        self.func = func
+        self.args = args
+        self.key = key              # e.g. remote host ip; jobs with the same key never overlap
+        self.priority = priority
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.cancelled = threading.Event()
+
+
+class TaskExecutor:
+    """
+    Bounded worker pool for install/maintenance generators.
+    - `workers` jobs run at the same time
+    - jobs sharing a `key` (remote host) run one after another
+    - lower priority number runs first, FIFO within the same priority
+    - queued jobs can be cancelled; running ones stop at their next yield
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, int(workers))
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}          # task_id -> Job (queued or running)
+        self._busy_keys = set()
+        self._running = 0
+        self._threads = []
+        self._local = threading.local()
+
+        self._wait_times = deque(maxlen=METRIC_WINDOW)
+        self._run_times = deque(maxlen=METRIC_WINDOW)
+        self._counters = {'completed': 0, 'error': 0, 'cancelled': 0}
+
+    def start(self):
+        with self._cond:
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._worker, name=f"task-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(t)
+                t.start()
+        logger.info(f"Task Executor Started ({self.workers} workers)")
+
+    # --- Public API ---
+    def submit(self, func, args=(), key=None, priority=PRIORITY_NORMAL, task_id=None):
+        task_id = task_id or str(uuid.uuid4())
+        init_task(task_id)
+        job = Job(task_id, func, args, key, priority)
+        with self._cond:
+            self._jobs[task_id] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify_all()
+        if not self._threads:
+            self.start()
+        return task_id
+
+    def cancel(self, task_id):
+        with self._cond:
+            job = self._jobs.get(task_id)
+            if not job:
+                return False
+            job.cancelled.set()
+            queued = job.started_at is None
+            if queued:
+                # Still queued: drop it right away
+                self._heap = [entry for entry in self._heap if entry[2] is not job]
+                heapq.heapify(self._heap)
+                del self._jobs[task_id]
+                self._counters['cancelled'] += 1
+        if queued:
+            task_status.update(task_id, progress=100, status='cancelled', log='Cancelled before start')
+        return True
+
+    def find(self, key):
+        """task_id of a queued/running job with this key (used to de-duplicate)"""
+        with self._cond:
+            for job in self._jobs.values():
+                if job.key == key:
+                    return job.task_id
+        return None
+
+    @contextmanager
+    def hold_key(self, key, cancelled=None):
+        """
+        Run a step under `key` from inside another task (e.g. one host of a
+        fleet rollout): waits while a job with that key is running and keeps
+        new ones queued until the step is done.
+        """
+        with self._cond:
+            while key in self._busy_keys:
+                if cancelled is not None and cancelled.is_set():
+                    raise TaskCancelled()
+                self._cond.wait(timeout=1)
+            self._busy_keys.add(key)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._busy_keys.discard(key)
+                self._cond.notify_all()
+
+    def is_active(self, task_id):
+        with self._cond:
+            return task_id in self._jobs
+
+    def current_job(self):
+        return getattr(self._local, 'job', None)
+
+    def check_cancelled(self):
+        """Long-running steps can call this to bail out early."""
+        job = self.current_job()
+        if job and job.cancelled.is_set():
+            raise TaskCancelled()
+
+    def metrics(self):
+        with self._cond:
+            now = time.time()
+            queued = [j for j in self._jobs.values() if j.started_at is None]
+            waits = list(self._wait_times)
+            runs = list(self._run_times)
+            return {
+                'workers': self.workers,
+                'queue_depth': len(queued),
+                'running': self._running,
+                'busy_hosts': sorted(k for k in self._busy_keys if k),
+                'oldest_wait': round(max((now - j.submitted_at for j in queued), default=0), 2),
+                'wait_time': _summary(waits),
+                'run_time': _summary(runs),
+                **self._counters,
+            }
+
+    # --- Workers ---
+    def _next_job_locked(self):
+        skipped = []
+        job = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[2].key is not None and entry[2].key in self._busy_keys:
+                skipped.append(entry)
+                continue
+            job = entry[2]
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return job
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job_locked()
+                job.started_at = time.time()
+                self._busy_keys.add(job.key)
+                self._running += 1
+                self._wait_times.append(job.started_at - job.submitted_at)
+
+            self._local.job = job
+            set_current_task(job.task_id, job.cancelled)
+            status = self._run(job)
+            set_current_task(None)
+            self._local.job = None
+
+            with self._cond:
+                self._busy_keys.discard(job.key)
+                self._running -= 1
+                self._jobs.pop(job.task_id, None)
+                self._run_times.append(time.time() - job.started_at)
+                self._counters[status] += 1
+                self._cond.notify_all()
+
+    def _run(self, job):
+        task_id = job.task_id
+        logger.info(f"Processing Task: {task_id} (key={job.key})")
+        gen = None
+        try:
+            task_status.update(task_id, progress=5, status='running', log='Starting process...')
+            gen = job.func(*job.args)
+            for percent, log_msg in gen:
+                task_status.update(task_id, progress=percent, status='running', log=log_msg)
+                if job.cancelled.is_set():
+                    raise TaskCancelled()
+            task_status.update(task_id, progress=100, status='completed', log='Completed Successfully!')
+            logger.info(f"Task {task_id} Completed")
+            return 'completed'
+        except Exception as e:
+            if not isinstance(e, TaskCancelled) and not job.cancelled.is_set():
+                logger.error(f"Task Failed: {e}", exc_info=True)
+                task_status.update(task_id, progress=100, status='error', log=f"Error: {str(e)}")
+                return 'error'
+            # A remote step aborted by the cancel flag surfaces as a normal failure
+            if gen is not None:
+                gen.close()
+            task_status.update(task_id, progress=100, status='cancelled', log='Cancelled by user')
+            logger.info(f"Task {task_id} Cancelled")
+            return 'cancelled'
+
+
+def _summary(values):
+    if not values:
+        return {'avg': 0, 'max': 0, 'last': 0}
+    return {'avg': round(sum(values) / len(values), 2), 'max': round(max(values), 2), 'last': round(values[-1], 2)}
+
+
+executor = TaskExecutor()
+
+def start_executor(workers=DEFAULT_WORKERS):
+    executor.workers = max(1, int(workers))
+    executor.start()
+    return executor
+
+def submit_task(func, args=(), key=None, priority=PRIORITY_NORMAL):
+    return executor.submit(func, args, key, priority)
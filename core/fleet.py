@@ -0,0 +1,101 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.executor import executor, TaskCancelled
+from core.ssh_manager import SSHManager
+from core.tasks import task_status, current_task_id, current_cancel_event
+
+logger = logging.getLogger("FleetManager")
+
+DEFAULT_CONCURRENCY = 8
+
+
+def _server_dict(server):
+    """servers row / dict / (ip, user, password, ssh_key, port) tuple -> dict"""
+    if isinstance(server, (tuple, list)):
+        ip, user, password, ssh_key, port = server[:5]
+        return {'ip': ip, 'user': user, 'password': password, 'ssh_key': ssh_key, 'port': port}
+    return {k: server[k] for k in ('ip', 'user', 'password', 'ssh_key', 'port')}
+
+
+def _run_one(server, script, ssh, on_line=None, cancelled=None):
+    ip = server['ip']
+    line_cb = (lambda line: on_line(ip, line)) if on_line else (lambda line: None)
+    if cancelled is not None and cancelled.is_set():
+        return {'ip': ip, 'ok': False, 'output': 'Cancelled', 'duration': 0}
+    # Same key as installs on this host: never run systemctl next to a running install
+    try:
+        with executor.hold_key(ip, cancelled):
+            started = time.time()
+            ok, output = ssh.run_remote_command(ip, server['user'] or 'root', server['password'],
+                                                script, server['port'] or 22, server['ssh_key'],
+                                                on_line=line_cb, timeout=ssh.step_timeout, cancelled=cancelled)
+    except TaskCancelled:
+        return {'ip': ip, 'ok': False, 'output': 'Cancelled', 'duration': 0}
+    return {
+        'ip': server['ip'],
+        'ok': ok,
+        'output': output,
+        'duration': round(time.time() - started, 2),
+    }
+
+
+def iter_fleet(servers, script, concurrency=DEFAULT_CONCURRENCY, on_line=None, cancelled=None):
+    """
+    Run `script` on every server at once (at most `concurrency` in flight)
+    and yield each host's result as soon as it finishes.
+    `on_line(ip, line)` receives remote output live while hosts are running.
+    A host that is busy with another task (install, edit) waits for it.
+    `cancelled` (Event) stops hosts that are running or not started yet; it
+    defaults to the calling task's cancel flag, which pool threads cannot see.
+    Total time is roughly the slowest host, not the sum of all of them.
+    """
+    servers = [_server_dict(s) for s in servers]
+    if not servers:
+        return
+    if cancelled is None:
+        cancelled = current_cancel_event()
+    ssh = SSHManager()
+    with ThreadPoolExecutor(max_workers=max(1, min(int(concurrency), len(servers)))) as pool:
+        futures = {pool.submit(_run_one, s, script, ssh, on_line, cancelled): s for s in servers}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'ip': futures[future]['ip'], 'ok': False, 'output': str(e), 'duration': 0}
+
+
+def run_on_servers(servers, script, concurrency=DEFAULT_CONCURRENCY, on_result=None, on_line=None):
+    """Blocking helper: aggregated result table sorted by ip."""
+    results = []
+    for res in iter_fleet(servers, script, concurrency, on_line):
+        if on_result:
+            on_result(res)
+        results.append(res)
+    return sorted(results, key=lambda r: r['ip'])
+
+
+def process_fleet_rollout(servers, script, concurrency=DEFAULT_CONCURRENCY):
+    """Task generator for the executor: progress per finished host + final table."""
+    total = len(servers)
+    yield 5, f"Running on {total} servers (concurrency {concurrency})..."
+    task_id = current_task_id()
+    # Pool threads have no current task, so forward their lines explicitly
+    def on_line(ip, line):
+        if task_id:
+            task_status.append_line(task_id, f"[{ip}] {line}")
+
+    results = []
+    for res in iter_fleet(servers, script, concurrency, on_line):
+        results.append(res)
+        state = "OK" if res['ok'] else "FAILED"
+        yield 5 + int(90 * len(results) / total), f"[{res['ip']}] {state} ({res['duration']}s)"
+
+    results.sort(key=lambda r: r['ip'])
+    failed = [r['ip'] for r in results if not r['ok']]
+    table = [{k: r[k] for k in ('ip', 'ok', 'duration')} | {'tail': r['output'][-500:]} for r in results]
+    if task_id:
+        task_status.update(task_id, result=table)
+    if failed:
+        raise Exception(f"{len(failed)}/{total} servers failed: {', '.join(failed)}")
+    yield 100, f"All {total} servers done."
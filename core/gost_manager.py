@@ -1,14 +1,14 @@
 import os
-import subprocess
 import logging
 from core.ssh_manager import SSHManager
+from core.artifacts import provide_remote_binary, install_local_binary
+from core.apply import ApplyPlan, remote_apply_script, binary_changed
 
 logger = logging.getLogger("GostManager")
 logger.setLevel(logging.INFO)
 
 REMOTE_BIN_PATH = "/root/alamor/bin/gost"
 LOCAL_BIN_PATH = "/root/AlamorTunnel/bin/gost"
-DOWNLOAD_URL = "https://github.com/ginuerzh/gost/releases/download/v2.11.5/gost-linux-amd64-2.11.5.gz"
 
 class GostManager:
     def __init__(self):
@@ -37,28 +37,19 @@ class GostManager:
         return " ".join(args)
 
     def check_local_binary(self):
-        if not os.path.exists(LOCAL_BIN_PATH):
-            logger.info("Downloading Gost locally...")
-            os.makedirs(os.path.dirname(LOCAL_BIN_PATH), exist_ok=True)
-            subprocess.run(f"curl -L -k -o /tmp/gost.gz {DOWNLOAD_URL}", shell=True, check=True)
-            subprocess.run("gzip -d -f /tmp/gost.gz", shell=True, check=True)
-            subprocess.run(f"mv /tmp/gost {LOCAL_BIN_PATH}", shell=True, check=True)
-            subprocess.run(f"chmod +x {LOCAL_BIN_PATH}", shell=True, check=True)
+        install_local_binary('gost', LOCAL_BIN_PATH)
 
-    def install_client(self, server_ip, config):
-        logger.info("Installing Gost Client Locally")
-        try:
-            self.check_local_binary()
-
-            config['server_ip'] = server_ip
-            # اگر آرگومان دستی نبود، بساز
-            gost_cmd = config.get('gost_args') or self._build_args('client', config)
+    def render_client(self, server_ip, config):
+        """(unit, unit file, [(path, content)]); gost keeps everything on its command line."""
+        config['server_ip'] = server_ip
+        # اگر آرگومان دستی نبود، بساز
+        gost_cmd = config.get('gost_args') or self._build_args('client', config)
 
-            # استفاده از پورت کلاینت برای نام سرویس جهت جلوگیری از تداخل
-            client_port = config.get('bind_port', 1080)
-            svc_name = f"gost-client-{client_port}"
+        # استفاده از پورت کلاینت برای نام سرویس جهت جلوگیری از تداخل
+        client_port = config.get('bind_port', 1080)
+        svc_name = f"gost-client-{client_port}"
 
-            svc_content = f"""[Unit]
+        svc_content = f"""[Unit]
 Description=Gost Client {client_port}
 After=network.target
 [Service]
@@ -70,10 +61,18 @@ LimitNOFILE=1048576
 [Install]
 WantedBy=multi-user.target
 """
-            with open(f"/etc/systemd/system/{svc_name}.service", "w") as f:
-                f.write(svc_content)
+        return svc_name, svc_content, []
 
-            os.system(f"systemctl daemon-reload && systemctl restart {svc_name} && systemctl enable {svc_name}")
+    def install_client(self, server_ip, config):
+        logger.info("Installing Gost Client Locally")
+        try:
+            svc_name, svc_content, _ = self.render_client(server_ip, config)
+            plan = ApplyPlan(svc_name)
+            plan.add_binary('gost', LOCAL_BIN_PATH, [svc_name])
+            plan.add_unit(svc_name, svc_content)
+            result = plan.apply()
+            if not result['restart'] and not result['started']:
+                return True, "Gost Client already up to date"
             return True, "Gost Client Installed"
 
         except Exception as e:
@@ -82,9 +81,7 @@ WantedBy=multi-user.target
 
 # --- GLOBAL FUNCTIONS (مورد نیاز routes/tunnels.py) ---
 
-def install_gost_client_local(server_ip, config):
-    # این تابع کلاس بالا را صدا می‌زند
-    manager = GostManager()
+def _map_form_fields(config):
     # نگاشت فیلدهای فرم به کانفیگ منیجر
     # در فرم معمولا 'client_port' داریم اما کلاس 'bind_port' میخواهد
     if 'client_port' in config:
@@ -94,27 +91,21 @@ def install_gost_client_local(server_ip, config):
     if 'tunnel_port' in config:
         config['server_port'] = config['tunnel_port']
 
+def render_gost_client_local(server_ip, config):
+    _map_form_fields(config)
+    return GostManager().render_client(server_ip, config)
+
+def install_gost_client_local(server_ip, config):
+    # این تابع کلاس بالا را صدا می‌زند
+    manager = GostManager()
+    _map_form_fields(config)
     return manager.install_client(server_ip, config)
 
-def install_gost_server_remote(ip, config):
+def render_server_remote(config):
+    """(unit, unit file, [(path, content)]) of the remote gost server."""
     port = config.get('tunnel_port', 443)
-    ssh_user = config.get('ssh_user', 'root')
-    ssh_pass = config.get('ssh_pass')
-    ssh_key = config.get('ssh_key')
-    ssh_port = int(config.get('ssh_port', 22))
-    
-    # اسکریپت نصب در سرور خارج
-    script = f"""
-    mkdir -p /root/alamor/bin
-    if [ ! -f /root/alamor/bin/gost ]; then
-        curl -L -k -o /root/alamor/bin/gost.gz {DOWNLOAD_URL}
-        gzip -d -f /root/alamor/bin/gost.gz
-        chmod +x /root/alamor/bin/gost
-    fi
-    
-    # ساخت سرویس
-    cat > /etc/systemd/system/gost-server-{port}.service <<EOL
-[Unit]
+    svc_name = f"gost-server-{port}"
+    svc_content = f"""[Unit]
 Description=Gost Server {port}
 After=network.target
 [Service]
@@ -122,10 +113,25 @@ ExecStart=/root/alamor/bin/gost -L=:{port}
 Restart=always
 [Install]
 WantedBy=multi-user.target
-EOL
-    
-    systemctl daemon-reload && systemctl enable gost-server-{port} && systemctl restart gost-server-{port}
-    """
+"""
+    return svc_name, svc_content, []
+
+def install_gost_server_remote(ip, config):
+    ssh_user = config.get('ssh_user', 'root')
+    ssh_pass = config.get('ssh_pass')
+    ssh_key = config.get('ssh_key')
+    ssh_port = int(config.get('ssh_port', 22))
     
+    svc_name, svc_content, _ = render_server_remote(config)
+
     ssh = SSHManager()
-    return ssh.run_remote_command(ip, ssh_user, ssh_pass, script, ssh_port, ssh_key)
\ No newline at end of file
+    ok, msg = provide_remote_binary('gost', ip, ssh_user, ssh_pass, ssh_port, ssh_key, REMOTE_BIN_PATH, ssh)
+    if not ok:
+        return False, msg
+    # اسکریپت نصب در سرور خارج (فقط در صورت تغییر ری‌استارت)
+    script = remote_apply_script(
+        [(f"/etc/systemd/system/{svc_name}.service", svc_content, [svc_name])],
+        [svc_name],
+        restart=[svc_name] if binary_changed(msg) else (),
+    )
+    return ssh.run_remote_command(ip, ssh_user, ssh_pass, script, ssh_port, ssh_key)
@@ -0,0 +1,214 @@
+import os
+import socket
+import threading
+import time
+import logging
+import psutil
+from core.database import get_all_tunnels
+from core.utils import get_tunnel_ports
+
+logger = logging.getLogger("PortHealth")
+
+# Listening sockets straight from the kernel tables: one read of
+# /proc/net/{tcp,tcp6,udp,udp6} per tick instead of one `ss | grep` per port.
+PROC_NET = "/proc/net"
+TABLES = {'tcp': ('tcp', 'tcp6'), 'udp': ('udp', 'udp6')}
+LISTEN_STATE = {'tcp': '0A', 'udp': '07'}   # TCP_LISTEN / unconnected UDP socket
+ESTABLISHED_STATE = '01'
+INDEX_MAX_AGE = 2  # seconds
+
+
+def _parse_table(path, state):
+    """port -> set(inode) for sockets of `path` in `state`."""
+    ports = {}
+    with open(path) as f:
+        next(f, None)  # header
+        for line in f:
+            fields = line.split()
+            if len(fields) < 10 or fields[3] != state:
+                continue
+            port = int(fields[1].rsplit(':', 1)[1], 16)
+            ports.setdefault(port, set()).add(fields[9])
+    return ports
+
+
+def _read_proc():
+    index = {}
+    for proto, tables in TABLES.items():
+        ports = {}
+        for table in tables:
+            path = os.path.join(PROC_NET, table)
+            if not os.path.exists(path):
+                continue  # e.g. IPv6 disabled
+            for port, inodes in _parse_table(path, LISTEN_STATE[proto]).items():
+                ports.setdefault(port, set()).update(inodes)
+        index[proto] = ports
+    return index
+
+
+def _read_psutil():
+    """Fallback for systems without procfs (inode is replaced by the pid)."""
+    index = {'tcp': {}, 'udp': {}}
+    for conn in psutil.net_connections(kind='inet'):
+        if not conn.laddr:
+            continue
+        if conn.type == socket.SOCK_STREAM and conn.status == psutil.CONN_LISTEN:
+            proto = 'tcp'
+        elif conn.type == socket.SOCK_DGRAM and not conn.raddr:
+            proto = 'udp'
+        else:
+            continue
+        owner = f"pid:{conn.pid}" if conn.pid else "pid:0"
+        index[proto].setdefault(conn.laddr.port, set()).add(owner)
+    return index
+
+
+class PortIndex:
+    """
+    listening port -> socket inodes -> owning PIDs, rebuilt at most every
+    `max_age` seconds. The inode -> PID walk over /proc/*/fd is the expensive
+    part, so it only happens when someone actually asks for owners.
+    """
+
+    def __init__(self, max_age=INDEX_MAX_AGE):
+        self.max_age = max_age
+        self.use_proc = os.path.exists(os.path.join(PROC_NET, 'tcp'))
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._index = {'tcp': {}, 'udp': {}}
+        self._pids = None    # inode -> pid, built lazily per snapshot
+        self.updated_at = 0
+
+    def refresh(self, force=False):
+        if not force and time.time() - self.updated_at < self.max_age:
+            return False
+        # Single-flight: concurrent callers keep using the current snapshot
+        if not self._refresh_lock.acquire(blocking=force or not self.updated_at):
+            return False
+        try:
+            try:
+                index = _read_proc() if self.use_proc else _read_psutil()
+            except Exception as e:
+                logger.error(f"Reading socket tables failed: {e}")
+                return False
+            with self._lock:
+                self._index = index
+                self._pids = None
+                self.updated_at = time.time()
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def is_listening(self, port, proto=None):
+        port = int(port)
+        with self._lock:
+            protos = (proto,) if proto else TABLES
+            return any(port in self._index[p] for p in protos)
+
+    def listening_ports(self, proto='tcp'):
+        with self._lock:
+            return set(self._index[proto])
+
+    def _inode_pids(self, wanted):
+        pids = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            fd_dir = f"/proc/{pid}/fd"
+            try:
+                for fd in os.listdir(fd_dir):
+                    target = os.readlink(f"{fd_dir}/{fd}")
+                    if target.startswith('socket:[') and target[8:-1] in wanted:
+                        pids[target[8:-1]] = int(pid)
+            except OSError:
+                continue  # process exited or not ours to read
+        return pids
+
+    def owners(self, port, proto=None):
+        """[{'pid', 'name'}] of the processes listening on `port`."""
+        port = int(port)
+        with self._lock:
+            protos = (proto,) if proto else TABLES
+            inodes = set()
+            for p in protos:
+                inodes.update(self._index[p].get(port, ()))
+            if self._pids is None and self.use_proc:
+                wanted = set()
+                for ports in self._index.values():
+                    for found in ports.values():
+                        wanted.update(found)
+                self._pids = self._inode_pids(wanted)
+            pids = sorted({self._pids.get(i) if self.use_proc else int(i[4:]) or None for i in inodes} - {None})
+        owners = []
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    name = f.read().strip()
+            except OSError:
+                name = None
+            owners.append({'pid': pid, 'name': name})
+        return owners
+
+
+port_index = PortIndex()
+
+
+def ports_health(ports):
+    """
+    Liveness of a tunnel from its forwarded ports:
+    active (all listening), degraded (some), down (none), unknown (no ports).
+    """
+    port_index.refresh()
+    state = {int(p): port_index.is_listening(p) for p in ports}
+    up = sum(state.values())
+    if not state:
+        status = 'unknown'
+    elif up == len(state):
+        status = 'active'
+    elif up:
+        status = 'degraded'
+    else:
+        status = 'down'
+    return {'status': status, 'listening': up, 'total': len(state),
+            'down_ports': sorted(p for p, ok in state.items() if not ok)}
+
+
+def tunnel_health(tunnel):
+    return ports_health(get_tunnel_ports(tunnel))
+
+
+def all_tunnels_health():
+    port_index.refresh()
+    return {t['id']: tunnel_health(t) for t in get_all_tunnels()}
+
+
+def established_sockets(ports):
+    """
+    Identities of the established TCP connections on local `ports` (socket
+    inode, or the address pair without procfs). Taken before and after a
+    config apply, the difference is the set of client connections it dropped.
+    """
+    ports = {int(p) for p in ports}
+    found = set()
+    if port_index.use_proc:
+        for table in TABLES['tcp']:
+            path = os.path.join(PROC_NET, table)
+            if not os.path.exists(path):
+                continue
+            for port, inodes in _parse_table(path, ESTABLISHED_STATE).items():
+                if port in ports:
+                    found.update(inodes)
+        return found
+    for conn in psutil.net_connections(kind='tcp'):
+        if conn.status == psutil.CONN_ESTABLISHED and conn.laddr and conn.raddr and conn.laddr.port in ports:
+            found.add((tuple(conn.laddr), tuple(conn.raddr)))
+    return found
+
+
+# Wrappers
+def check_port_health(port, proto=None):
+    port_index.refresh()
+    return port_index.is_listening(port, proto)
+def get_port_owners(port, proto=None):
+    port_index.refresh()
+    return port_index.owners(port, proto)
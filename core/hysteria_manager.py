@@ -4,6 +4,9 @@ import secrets
 import logging
 import subprocess
 from core.ssh_manager import SSHManager
+from core.artifacts import provide_remote_binary, ArtifactError
+from core.apply import ApplyPlan, remote_apply_script, binary_changed
+from core.utils import speedtest_ports
 
 # تنظیمات لاگ (برای عیب‌یابی دقیق)
 LOG_DIR = '/root/AlamorTunnel/logs'
@@ -22,7 +25,6 @@ REMOTE_BIN_PATH = "/root/alamor/bin/hysteria"
 REMOTE_CONFIG_PATH = "/root/alamor/bin/config.yaml"
 LOCAL_BIN_PATH = "/root/AlamorTunnel/bin/hysteria"
 LOCAL_CONFIG_PATH = "/root/AlamorTunnel/bin/client.yaml"
-DOWNLOAD_URL = "https://github.com/apernet/hysteria/releases/latest/download/hysteria-linux-amd64"
 STATS_PORT = 9999
 HOP_RANGE = "20000:50000"
 
@@ -38,7 +40,8 @@ def generate_server_config(config):
     """
     تولید کانفیگ YAML برای سرور Hysteria v2
     """
-    stats_secret = secrets.token_hex(8)
+    # secret قبلی حفظ می‌شود تا کانفیگ رندرشده بی‌دلیل تغییر نکند
+    stats_secret = config.get('stats_secret') or secrets.token_hex(8)
     
     # ساختار استاندارد کانفیگ Hysteria 2
     server_conf = {
@@ -79,6 +82,28 @@ def generate_server_config(config):
     }
     return yaml.dump(server_conf), stats_secret
 
+def render_server_remote(config):
+    """(unit, unit file, [(path, content)]) of the remote Hysteria server."""
+    yaml_content, stats_secret = generate_server_config(config)
+    config['stats_secret'] = stats_secret # ذخیره برای استفاده‌های بعدی
+    svc_content = f"""[Unit]
+Description=Hysteria 2 Server
+After=network.target
+
+[Service]
+Type=simple
+ExecStart={REMOTE_BIN_PATH} server -c {REMOTE_CONFIG_PATH}
+WorkingDirectory=/root/alamor/bin
+User=root
+Restart=always
+RestartSec=3
+LimitNOFILE=1048576
+
+[Install]
+WantedBy=multi-user.target
+"""
+    return 'hysteria-server', svc_content, [(REMOTE_CONFIG_PATH, yaml_content)]
+
 # ==========================================
 # بخش ۲: نصب سرور ریموت (خارج)
 # ==========================================
@@ -114,31 +139,25 @@ def install_hysteria_server_remote(server_ip, config):
         if not run_step("Install Dependencies", deps_cmd)[0]: 
             return False, "Dependency Installation Failed"
 
-        # 4. تولید سرتیفیکیت Self-Signed
+        # 4. تولید سرتیفیکیت Self-Signed (فقط اگر قبلاً ساخته نشده)
         cert_cmd = (
-            "openssl req -new -newkey rsa:2048 -days 3650 -nodes -x509 "
+            "[ -f /root/alamor/certs/server.crt ] || openssl req -new -newkey rsa:2048 -days 3650 -nodes -x509 "
             "-subj '/CN=www.bing.com' "
             "-keyout /root/alamor/certs/server.key -out /root/alamor/certs/server.crt"
         )
         if not run_step("Generate Certificates", cert_cmd)[0]: 
             return False, "Certificate Generation Failed"
 
-        # 5. دانلود هسته Hysteria (اگر وجود ندارد یا آپدیت نیاز است)
-        # از فلگ -k برای نادیده گرفتن خطاهای SSL در سرورهای قدیمی استفاده می‌کنیم
-        dl_cmd = (
-            f"curl -L -k -o {REMOTE_BIN_PATH} {DOWNLOAD_URL} "
-            f"&& chmod +x {REMOTE_BIN_PATH}"
-        )
-        if not run_step("Download Core", dl_cmd)[0]: 
+        # 5. هسته Hysteria از کش پنل آپلود می‌شود (یا در حالت download روی خود سرور گرفته می‌شود)
+        logger.info("STEP: Provide Core")
+        ok, out = provide_remote_binary('hysteria', server_ip, "root", ssh_pass, ssh_port,
+                                        remote_path=REMOTE_BIN_PATH, ssh=ssh)
+        if not ok:
+            logger.error(f"FAILED Provide Core: {out}")
             return False, "Core Download Failed"
 
-        # 6. تولید و آپلود کانفیگ
-        yaml_content, stats_secret = generate_server_config(config)
-        config['stats_secret'] = stats_secret # ذخیره برای استفاده‌های بعدی
-        
-        write_cmd = f"cat <<EOF > {REMOTE_CONFIG_PATH}\n{yaml_content}\nEOF"
-        if not run_step("Write Config", write_cmd)[0]: 
-            return False, "Config Write Failed"
+        # 6. تولید کانفیگ و فایل سرویس Systemd
+        svc_name, svc_content, files = render_server_remote(config)
 
         # 7. تنظیم فایروال (Port Hopping)
         # تمام پورت‌های رنج HOP_RANGE را به پورت اصلی تانل هدایت می‌کنیم
@@ -150,29 +169,14 @@ def install_hysteria_server_remote(server_ip, config):
         )
         run_step("Setup Firewall", fw_cmd)
 
-        # 8. ساخت فایل سرویس Systemd
-        svc_content = f"""[Unit]
-Description=Hysteria 2 Server
-After=network.target
-
-[Service]
-Type=simple
-ExecStart={REMOTE_BIN_PATH} server -c {REMOTE_CONFIG_PATH}
-WorkingDirectory=/root/alamor/bin
-User=root
-Restart=always
-RestartSec=3
-LimitNOFILE=1048576
-
-[Install]
-WantedBy=multi-user.target
-"""
-        svc_cmd = f"cat <<EOF > /etc/systemd/system/hysteria-server.service\n{svc_content}\nEOF"
-        run_step("Create Service File", svc_cmd)
-
-        # 9. استارت و فعال‌سازی سرویس
-        start_cmd = "systemctl daemon-reload && systemctl enable hysteria-server && systemctl restart hysteria-server && systemctl is-active hysteria-server"
-        ok, msg = run_step("Start Service", start_cmd)
+        # 8. نوشتن کانفیگ و سرویس فقط در صورت تغییر؛ ری‌استارت فقط وقتی ورودی‌ها عوض شده‌اند
+        start_cmd = remote_apply_script(
+            [(path, content, [svc_name]) for path, content in files]
+            + [(f"/etc/systemd/system/{svc_name}.service", svc_content, [svc_name])],
+            [svc_name],
+            restart=[svc_name] if binary_changed(out) else (),
+        ) + f"\nsleep 1; systemctl is-active {svc_name}"
+        ok, msg = run_step("Apply Config & Start Service", start_cmd)
         
         if ok and ("active" in msg or "running" in msg):
             return True, "Hysteria Server Installed Successfully"
@@ -187,68 +191,55 @@ WantedBy=multi-user.target
 # بخش ۳: نصب کلاینت لوکال (ایران)
 # ==========================================
 
-def install_hysteria_client_local(server_ip, config):
-    """
-    نصب کلاینت روی سرور ایران برای برقراری ارتباط با خارج
-    """
-    logger.info("Starting Local Client Installation")
-    try:
-        # 1. دانلود هسته اگر وجود نداشت
-        if not os.path.exists(LOCAL_BIN_PATH):
-            logger.info("Downloading Local Binary...")
-            os.makedirs(os.path.dirname(LOCAL_BIN_PATH), exist_ok=True)
-            subprocess.run(f"curl -L -k -o {LOCAL_BIN_PATH} {DOWNLOAD_URL}", shell=True, check=True)
-            subprocess.run(f"chmod +x {LOCAL_BIN_PATH}", shell=True, check=True)
-
-        # 2. تولید کانفیگ کلاینت
-        client_conf = {
-            "server": f"{server_ip}:{HOP_RANGE}", # استفاده از پورت هوپینگ برای اتصال
-            "auth": config['password'],
-            "tls": {
-                "sni": "www.bing.com",
-                "insecure": True
-            },
-            "bandwidth": {
-                "up": config.get('up_mbps', '100 mbps'),
-                "down": config.get('down_mbps', '100 mbps')
-            },
-            "socks5": {
-                "listen": "0.0.0.0:1080" # پورت ساکس پیش‌فرض
-            },
-            "http": {
-                "listen": "0.0.0.0:8080" # پورت HTTP پیش‌فرض
-            },
-            "transport": {
-                "type": "udp",
-                "udp": {
-                    "hopInterval": "30s" # تغییر پورت هر 30 ثانیه
-                }
+def render_client_local(server_ip, config):
+    """(unit, unit file, [(path, content)]) of the local Hysteria client."""
+    # تولید کانفیگ کلاینت
+    client_conf = {
+        "server": f"{server_ip}:{HOP_RANGE}", # استفاده از پورت هوپینگ برای اتصال
+        "auth": config['password'],
+        "tls": {
+            "sni": "www.bing.com",
+            "insecure": True
+        },
+        "bandwidth": {
+            "up": config.get('up_mbps', '100 mbps'),
+            "down": config.get('down_mbps', '100 mbps')
+        },
+        "socks5": {
+            "listen": "0.0.0.0:1080" # پورت ساکس پیش‌فرض
+        },
+        "http": {
+            "listen": "0.0.0.0:8080" # پورت HTTP پیش‌فرض
+        },
+        "transport": {
+            "type": "udp",
+            "udp": {
+                "hopInterval": "30s" # تغییر پورت هر 30 ثانیه
             }
         }
+    }
+    
+    # مدیریت پورت فورواردینگ (در صورت وجود)
+    if config.get('ports') or speedtest_ports(config):
+        tcp_fw = []
+        udp_fw = []
+        # تبدیل ورودی به لیست (چه رشته باشد چه لیست)
+        raw = config.get('ports') or []
+        ports = str(raw).split(',') if isinstance(raw, str) else list(raw)
+        ports += speedtest_ports(config)
         
-        # مدیریت پورت فورواردینگ (در صورت وجود)
-        if 'ports' in config and config['ports']:
-            tcp_fw = []
-            udp_fw = []
-            # تبدیل ورودی به لیست (چه رشته باشد چه لیست)
-            ports = str(config['ports']).split(',') if isinstance(config['ports'], str) else config['ports']
-            
-            for p in ports:
-                p = str(p).strip()
-                if p:
-                    # گوش دادن روی تمام اینترفیس‌ها (0.0.0.0) و ارسال به لوکال هاست
-                    tcp_fw.append({"listen": f"0.0.0.0:{p}", "remote": f"127.0.0.1:{p}"})
-                    udp_fw.append({"listen": f"0.0.0.0:{p}", "remote": f"127.0.0.1:{p}", "timeout": "60s"})
-            
-            client_conf['tcpForwarding'] = tcp_fw
-            client_conf['udpForwarding'] = udp_fw
-
-        # ذخیره فایل کانفیگ
-        with open(LOCAL_CONFIG_PATH, 'w') as f:
-            yaml.dump(client_conf, f)
+        for p in ports:
+            p = str(p).strip()
+            if p:
+                # گوش دادن روی تمام اینترفیس‌ها (0.0.0.0) و ارسال به لوکال هاست
+                tcp_fw.append({"listen": f"0.0.0.0:{p}", "remote": f"127.0.0.1:{p}"})
+                udp_fw.append({"listen": f"0.0.0.0:{p}", "remote": f"127.0.0.1:{p}", "timeout": "60s"})
+        
+        client_conf['tcpForwarding'] = tcp_fw
+        client_conf['udpForwarding'] = udp_fw
 
-        # 3. ساخت سرویس کلاینت
-        svc_content = f"""[Unit]
+    # ساخت سرویس کلاینت
+    svc_content = f"""[Unit]
 Description=Hysteria Client (Iran)
 After=network.target
 
@@ -262,18 +253,28 @@ LimitNOFILE=1048576
 [Install]
 WantedBy=multi-user.target
 """
-        with open("/etc/systemd/system/hysteria-client.service", "w") as f:
-            f.write(svc_content)
+    return 'hysteria-client', svc_content, [(LOCAL_CONFIG_PATH, yaml.dump(client_conf))]
+
+def install_hysteria_client_local(server_ip, config):
+    """
+    نصب کلاینت روی سرور ایران برای برقراری ارتباط با خارج
+    """
+    logger.info("Starting Local Client Installation")
+    try:
+        svc_name, svc_content, files = render_client_local(server_ip, config)
 
-        # 4. استارت سرویس لوکال
-        os.system("systemctl daemon-reload")
-        os.system("systemctl enable hysteria-client")
-        os.system("systemctl restart hysteria-client")
+        # هسته از کش محلی (sha256)، کانفیگ و سرویس؛ ری‌استارت فقط در صورت تغییر
+        plan = ApplyPlan(svc_name)
+        plan.add_binary('hysteria', LOCAL_BIN_PATH, [svc_name])
+        for path, content in files:
+            plan.add_file(path, content, [svc_name])
+        plan.add_unit(svc_name, svc_content)
+        plan.apply()
         
         logger.info("Local Client Installed Successfully")
         return True, "Client Installed Successfully"
 
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, ArtifactError) as e:
         logger.error(f"Local Download Failed: {e}")
         return False, "Failed to download Hysteria binary locally."
     except Exception as e:
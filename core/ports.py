@@ -0,0 +1,227 @@
+import re
+import glob
+import time
+import threading
+import logging
+from core.database import get_all_tunnels
+from core.health import port_index
+from core.systemd import SYSTEMD_DIR
+from core.utils import parse_tunnel_config, get_forwarded_ports, speedtest_ports, _parse_port_token
+
+logger = logging.getLogger("PortAllocator")
+
+PORT_COUNT = 65536
+ALLOC_MIN = 10000          # allocations stay clear of well-known / registered-by-habit ports
+RESERVE_TTL = 600          # seconds a port handed to a pending install stays claimed
+EPHEMERAL_RANGE_PATH = "/proc/sys/net/ipv4/ip_local_port_range"
+
+# Rendered configs on this host that may hold ports no DB row knows about
+# (hand-made units, older panel versions). A config file only counts while a
+# unit still points at it, so files left behind by a deleted tunnel do not.
+UNIT_GLOBS = [f"{SYSTEMD_DIR}/{core}-*.service" for core in ('rathole', 'backhaul', 'hysteria', 'gost', 'slipstream')]
+CONFIG_GLOBS = [
+    "/root/AlamorTunnel/bin/*.toml",
+    "/root/AlamorTunnel/bin/*.yaml",
+]
+CONFIG_PATTERNS = [
+    re.compile(r'''(?:bind_addr|listen)["']?\s*[:=]\s*["']?[\w.\[\]:-]*?:(\d{1,5})\b'''),   # toml / yaml / json
+    re.compile(r'''"(\d{1,5})(?:-\d{1,5})?='''),                                           # backhaul ports = ["443=..."]
+    re.compile(r'''-L=["']?(?:\w+://)?[^:\s"']*:(\d{1,5})'''),                             # gost -L
+    re.compile(r'''--(?:tcp|dns)-listen-port\s+(\d{1,5})'''),                              # slipstream
+]
+# Cores whose tunnel_port is bound on this (Iran) side; for hysteria/gost it is the remote server's
+LOCAL_TUNNEL_PORT = ('rathole', 'backhaul')
+
+_reservations = {}   # port -> (label, expires_at)
+_reservations_lock = threading.Lock()
+
+
+class PortBitmap:
+    """One bit per port (8 KiB): O(1) test/set, full bytes skipped when scanning."""
+
+    def __init__(self):
+        self.bits = bytearray(PORT_COUNT // 8)
+
+    def add(self, port):
+        self.bits[port >> 3] |= 1 << (port & 7)
+
+    def discard(self, port):
+        self.bits[port >> 3] &= ~(1 << (port & 7)) & 0xFF
+
+    def __contains__(self, port):
+        return bool(self.bits[port >> 3] & (1 << (port & 7)))
+
+    def free_ports(self, start, end):
+        """Unset ports in [start, end), ascending."""
+        port = start
+        while port < end:
+            byte = self.bits[port >> 3]
+            if byte == 0xFF and not port & 7:
+                port += 8
+                continue
+            if not byte & (1 << (port & 7)):
+                yield port
+            port += 1
+
+
+def local_ports(protocol, config):
+    """Ports a tunnel listens on on this host."""
+    if protocol not in LOCAL_TUNNEL_PORT:
+        # tunnel_port is the remote server's there; only gost's client_port may stand in for `ports`
+        config = {k: v for k, v in config.items() if k != 'tunnel_port'}
+    ports = set(get_forwarded_ports(config)) | set(speedtest_ports(config))
+    if protocol in LOCAL_TUNNEL_PORT:
+        found = _parse_port_token(config.get('tunnel_port')) if config.get('tunnel_port') is not None else []
+        ports.update(found[:1])
+    return sorted(p for p in ports if 0 < p < PORT_COUNT)
+
+
+def _ephemeral_range():
+    try:
+        with open(EPHEMERAL_RANGE_PATH) as f:
+            low, high = map(int, f.read().split())
+        return low, high
+    except (OSError, ValueError):
+        return 32768, 60999
+
+
+class PortMap:
+    """
+    Every port in use on this host, from the `tunnels` table, rendered config
+    files, live listeners (TCP and UDP share one map) and pending installs.
+    Answers is_free() in O(1); allocate()/free_range() scan only the range.
+    """
+
+    def __init__(self):
+        self.used = PortBitmap()
+        self.owners = {}     # port -> first source that claimed it
+
+    def claim(self, ports, owner):
+        for port in ports:
+            if port not in self.used:
+                self.used.add(port)
+                self.owners[port] = owner
+        return self
+
+    def is_free(self, port):
+        port = int(port)
+        return 0 < port < PORT_COUNT and port not in self.used
+
+    def owner(self, port):
+        owner = self.owners.get(int(port))
+        if owner == 'listener':
+            names = [o['name'] or f"pid {o['pid']}" for o in port_index.owners(port)]
+            owner = f"listening process ({', '.join(names)})" if names else "listening socket"
+        return owner
+
+    def conflicts(self, ports):
+        """[(port, owner)] for every port in `ports` that is taken."""
+        return [(p, self.owner(p)) for p in ports if not self.is_free(p)]
+
+    def _alloc_ranges(self, start, end):
+        low, high = _ephemeral_range()
+        # the kernel hands out source ports from the ephemeral range; never allocate there
+        for a, b in ((start, min(end, low)), (max(start, high + 1), end)):
+            if a < b:
+                yield a, b
+
+    def allocate(self, count, start=ALLOC_MIN, end=PORT_COUNT, owner="allocated"):
+        """`count` free ports (not necessarily adjacent), claimed in this map."""
+        found = []
+        for a, b in self._alloc_ranges(start, end):
+            for port in self.used.free_ports(a, b):
+                found.append(port)
+                if len(found) == count:
+                    self.claim(found, owner)
+                    return found
+        raise ValueError(f"only {len(found)} of {count} free ports available")
+
+    def free_range(self, length, start=ALLOC_MIN, end=PORT_COUNT, owner="allocated"):
+        """First `length` adjacent free ports, claimed in this map."""
+        for a, b in self._alloc_ranges(start, end):
+            run_start, run = a, 0
+            for port in self.used.free_ports(a, b):
+                if port != run_start + run:
+                    run_start, run = port, 0
+                run += 1
+                if run == length:
+                    ports = list(range(run_start, run_start + length))
+                    self.claim(ports, owner)
+                    return ports
+        raise ValueError(f"no {length} adjacent free ports available")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _ports_in(text):
+    ports = {int(m) for rx in CONFIG_PATTERNS for m in rx.findall(text)}
+    return [p for p in ports if 0 < p < PORT_COUNT]
+
+
+def _config_file_ports():
+    units = {path: _read(path) for pattern in UNIT_GLOBS for path in glob.glob(pattern)}
+    units = {path: text for path, text in units.items() if text is not None}
+    for path, text in units.items():
+        yield path, _ports_in(text)   # gost / slipstream carry their ports on the ExecStart line
+    referenced = " ".join(units.values())
+    for pattern in CONFIG_GLOBS:
+        for path in glob.glob(pattern):
+            text = _read(path) if path in referenced else None
+            if text is not None:
+                yield path, _ports_in(text)
+
+
+def reserve(ports, label, ttl=RESERVE_TTL):
+    """Hold ports for an install that has not reached the DB yet."""
+    expires = time.time() + ttl
+    with _reservations_lock:
+        for port in ports:
+            _reservations[int(port)] = (label, expires)
+
+
+def release(ports):
+    with _reservations_lock:
+        for port in ports:
+            _reservations.pop(int(port), None)
+
+
+def releasing(task, ports):
+    """Wrap a task generator so its reserved ports are released when it ends, however it ends."""
+    def run(*args):
+        try:
+            yield from task(*args)
+        finally:
+            release(ports)
+    run.__name__ = getattr(task, '__name__', 'task')
+    return run
+
+
+def build_port_map(tunnels=None, listeners=True):
+    """Fresh PortMap of this host (DB rows first, so conflicts name the tunnel)."""
+    pm = PortMap()
+    for t in get_all_tunnels() if tunnels is None else tunnels:
+        config = parse_tunnel_config(t['config'])
+        pm.claim(local_ports(t['transport'], config) or local_ports(t['transport'], {'tunnel_port': t['port']}),
+                 f"tunnel #{t['id']} ({t['name']})")
+
+    now = time.time()
+    with _reservations_lock:
+        for port, (label, expires) in list(_reservations.items()):
+            if expires < now:
+                del _reservations[port]
+            else:
+                pm.claim([port], f"pending install ({label})")
+
+    for path, ports in _config_file_ports():
+        pm.claim(ports, f"config {path}")
+
+    if listeners:
+        port_index.refresh()
+        pm.claim(port_index.listening_ports('tcp') | port_index.listening_ports('udp'), 'listener')
+    return pm
@@ -0,0 +1,264 @@
+import math
+import json
+import socket
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from core.config_loader import load_config
+from core.database import get_all_tunnels, add_probe_stats
+from core.utils import get_tunnel_ports
+
+logger = logging.getLogger("TunnelProber")
+
+DEFAULT_PROBE_INTERVAL = 30     # seconds between probe rounds
+DEFAULT_PROBE_FLUSH = 300       # seconds per histogram row in SQLite
+PROBE_TIMEOUT = 3.0
+PROBE_RETENTION = 30 * 86400    # seconds of probe_stats history kept
+PORTS_PER_TUNNEL = 2            # forwarded ports probed per tunnel and round
+PROBE_WORKERS = 16
+RECENT = 10                     # last probes kept for the live status
+PROBE_PAYLOAD = b"HEAD / HTTP/1.0\r\nUser-Agent: alamor-probe\r\n\r\n"
+# Cores that accept locally and just close the connection when the far end is
+# down. Elsewhere a close without reply is the backend's answer to a request
+# it does not speak (e.g. a VLESS inbound), so it counts neither way.
+CLOSE_MEANS_DOWN = ('gost', 'rathole')
+
+# Histogram: log-linear buckets, HIST_SUB_BUCKETS per power of two (~3% error)
+HIST_MIN_MS = 0.05
+HIST_SUB_BUCKETS = 32
+
+
+class LatencyHistogram:
+    """
+    HDR-style latency histogram (milliseconds). Sparse bucket dict, so an
+    idle tunnel costs nothing and two histograms merge by adding counts.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = {int(k): v for k, v in (buckets or {}).items()}
+        self.count = sum(self.buckets.values())
+        self.max = self._upper(max(self.buckets)) if self.buckets else 0.0
+
+    @staticmethod
+    def _index(value):
+        if value <= HIST_MIN_MS:
+            return 0
+        ratio = value / HIST_MIN_MS
+        exp = int(math.log2(ratio))
+        sub = int((ratio / (1 << exp) - 1) * HIST_SUB_BUCKETS)
+        return exp * HIST_SUB_BUCKETS + min(sub, HIST_SUB_BUCKETS - 1) + 1
+
+    @staticmethod
+    def _upper(index):
+        if index == 0:
+            return HIST_MIN_MS
+        exp, sub = divmod(index - 1, HIST_SUB_BUCKETS)
+        return HIST_MIN_MS * (1 << exp) * (1 + (sub + 1) / HIST_SUB_BUCKETS)
+
+    def record(self, value):
+        idx = self._index(value)
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for idx, n in other.buckets.items():
+            self.buckets[idx] = self.buckets.get(idx, 0) + n
+        self.count += other.count
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return round(min(self._upper(idx), self.max), 2)
+        return round(self.max, 2)
+
+    def summary(self):
+        return {'count': self.count, 'p50': self.percentile(50), 'p95': self.percentile(95),
+                'p99': self.percentile(99), 'max': round(self.max, 2) if self.count else None}
+
+
+def probe_port(port, host="127.0.0.1", timeout=PROBE_TIMEOUT):
+    """
+    Connect to a forwarded port and time the first reply byte to a tiny
+    HTTP request: the reply has to cross the tunnel, the connect alone only
+    proves the local listener is up. A close without any byte is reported
+    as error 'closed'; what it says about the far end depends on the core.
+    """
+    result = {'port': port, 'ok': False, 'connect': None, 'rtt': None, 'error': None}
+    sock = None
+    try:
+        start = time.perf_counter()
+        sock = socket.create_connection((host, int(port)), timeout=timeout)
+        result['connect'] = round((time.perf_counter() - start) * 1000, 2)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sent = time.perf_counter()
+        sock.sendall(PROBE_PAYLOAD)
+        # Only real bytes give a round trip (see CLOSE_MEANS_DOWN for a bare close)
+        if sock.recv(1):
+            result['rtt'] = round((time.perf_counter() - sent) * 1000, 2)
+            result['ok'] = True
+        else:
+            result['error'] = 'closed'
+    except socket.timeout:
+        result['error'] = 'no reply' if result['connect'] is not None else 'connect timeout'
+    except ConnectionRefusedError:
+        result['error'] = 'refused'
+    except OSError as e:
+        result['error'] = type(e).__name__
+    finally:
+        if sock is not None:
+            sock.close()
+    return result
+
+
+def _outcome(result, transport):
+    """'ok', 'failed', or 'closed' when a close without reply proves nothing."""
+    if result['ok']:
+        return 'ok'
+    if result['error'] == 'closed' and transport not in CLOSE_MEANS_DOWN:
+        return 'closed'
+    return 'failed'
+
+
+class _TunnelProbes:
+    def __init__(self):
+        self.window = LatencyHistogram()     # since the last flush
+        self.previous = LatencyHistogram()   # the flushed window before it
+        self.connect = LatencyHistogram()
+        self.failures = 0
+        self.recent = deque(maxlen=RECENT)
+
+
+class TunnelProber(threading.Thread):
+    """
+    Probes every tunnel's forwarded ports every `interval` seconds. Latencies
+    go into per-tunnel histograms in memory; each `flush_interval` the window
+    is written to `probe_stats` as p50/p95/p99 plus the sparse buckets.
+    """
+
+    def __init__(self, interval=DEFAULT_PROBE_INTERVAL, flush_interval=DEFAULT_PROBE_FLUSH):
+        super().__init__(name="tunnel-prober", daemon=True)
+        self.interval = max(5, int(interval))
+        self.flush_interval = max(self.interval, int(flush_interval))
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._tunnels = {}   # tunnel_id -> _TunnelProbes
+
+    def probe_round(self):
+        targets = []
+        for t in get_all_tunnels():
+            for port in get_tunnel_ports(t)[:PORTS_PER_TUNNEL]:
+                targets.append((t['id'], t['transport'], port))
+        if not targets:
+            return 0
+
+        def probe(target):
+            tid, transport, port = target
+            res = probe_port(port)
+            res['outcome'] = _outcome(res, transport)
+            return tid, res
+
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(targets))) as pool:
+            results = list(pool.map(probe, targets))
+
+        live = {tid for tid, _, _ in targets}
+        with self._lock:
+            for tid in set(self._tunnels) - live:
+                del self._tunnels[tid]   # deleted tunnels
+            for tid, res in results:
+                st = self._tunnels.setdefault(tid, _TunnelProbes())
+                st.recent.append(res)
+                if res['connect'] is not None:
+                    st.connect.record(res['connect'])
+                if res['ok']:
+                    st.window.record(res['rtt'])
+                elif res['outcome'] == 'failed':
+                    st.failures += 1
+        return len(results)
+
+    def flush(self):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for tid, st in self._tunnels.items():
+                if not st.window.count and not st.failures:
+                    continue
+                s = st.window.summary()
+                rows.append((tid, now, s['count'] + st.failures, st.failures, st.connect.percentile(50),
+                             s['p50'], s['p95'], s['p99'], s['max'], json.dumps(st.window.buckets)))
+                st.previous, st.window = st.window, LatencyHistogram()
+                st.connect, st.failures = LatencyHistogram(), 0
+        if not rows:
+            return 0
+        try:
+            return add_probe_stats(rows, keep_since=now - PROBE_RETENTION)
+        except Exception as e:
+            logger.error(f"Probe stats flush failed: {e}")
+            return 0
+
+    def get(self, tunnel_id):
+        """Live view: last probe + percentiles over the current and previous window."""
+        with self._lock:
+            st = self._tunnels.get(tunnel_id)
+            if st is None or not st.recent:
+                return None
+            hist = LatencyHistogram().merge(st.previous).merge(st.window)
+            recent = list(st.recent)
+        last = recent[-1]
+        # 'closed' probes say nothing about the far end: left out of loss and reachable
+        counted = [r for r in recent if r['outcome'] != 'closed']
+        latest = [r for r in recent[-PORTS_PER_TUNNEL:] if r['outcome'] != 'closed']
+        failed = sum(1 for r in counted if r['outcome'] == 'failed')
+        s = hist.summary()
+        return {
+            'latency': last['rtt'], 'connect': last['connect'], 'error': last['error'],
+            'p50': s['p50'], 'p95': s['p95'], 'p99': s['p99'],
+            'loss': round(failed / len(counted), 2) if counted else None,
+            'reachable': any(r['ok'] for r in latest) if latest else None,   # None = unknown
+        }
+
+    def run(self):
+        logger.info(f"Tunnel Prober Started (interval={self.interval}s, flush={self.flush_interval}s)")
+        last_flush = time.time()
+        while not self._stop_event.is_set():
+            try:
+                self.probe_round()
+                if time.time() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.time()
+            except Exception as e:
+                logger.error(f"Probe round failed: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+        self.flush()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+prober = None
+
+
+def start_tunnel_prober():
+    global prober
+    if prober and prober.is_alive():
+        return prober
+    cfg = load_config()
+    prober = TunnelProber(
+        cfg.get('probe_interval', DEFAULT_PROBE_INTERVAL),
+        cfg.get('probe_flush_interval', DEFAULT_PROBE_FLUSH),
+    )
+    prober.start()
+    return prober
+
+
+def get_probe_summary(tunnel_id):
+    return prober.get(tunnel_id) if prober else None
@@ -1,27 +1,23 @@
-import os
-import subprocess
+import re
 import logging
 from core.ssh_manager import SSHManager
+from core.artifacts import provide_remote_binary, store
+from core.apply import ApplyPlan, remote_apply_script, binary_changed
+from core.utils import speedtest_ports
 
 logger = logging.getLogger("RatholeManager")
 INSTALL_DIR = "/root/AlamorTunnel/bin"
-REMOTE_REPO = "https://github.com/rapiz1/rathole/releases/latest/download/rathole-x86_64-unknown-linux-gnu.zip"
 
 def check_binary(binary_name):
-    file_path = f"{INSTALL_DIR}/{binary_name}"
-    if os.path.exists(file_path): return True
     try:
-        if not os.path.exists(INSTALL_DIR): os.makedirs(INSTALL_DIR)
-        subprocess.run(f"curl -k -L -o {file_path}.zip {REMOTE_REPO}", shell=True, check=True)
-        subprocess.run(f"unzip -o {file_path}.zip -d {INSTALL_DIR}", shell=True, check=True)
-        subprocess.run(f"chmod +x {file_path}", shell=True, check=True)
+        store.ensure(binary_name)  # نصب خود فایل با ApplyPlan انجام می‌شود
         return True
     except Exception as e:
         logger.error(f"Binary Check Failed: {e}")
         return False
 
-def install_local_rathole(config_data):
-    if not check_binary("rathole"): raise Exception("Rathole binary missing locally.")
+def render_local_rathole(config_data):
+    """(unit, unit file, [(path, content)]) of the Iran (server) side."""
     port = config_data['tunnel_port']
     bind_ip = "0.0.0.0"
     
@@ -30,44 +26,26 @@ def install_local_rathole(config_data):
         transport_block += f'\n[server.transport.tcp]\nnodelay = {str(config_data.get("nodelay", True)).lower()}'
 
     services = ""
-    for p in config_data['ports']:
+    for p in list(config_data['ports']) + speedtest_ports(config_data):
         services += f'\n[server.services.{p}]\ntype = "{config_data.get("transport", "tcp")}"\nbind_addr = "{bind_ip}:{p}"\n'
 
     config_content = f"""[server]\nbind_addr = "{bind_ip}:{port}"\ndefault_token = "{config_data['token']}"\n{transport_block}\n{services}\n"""
     
-    with open(f"{INSTALL_DIR}/rathole_iran{port}.toml", "w") as f: f.write(config_content)
-
     svc_name = f"rathole-iran{port}"
     svc_content = f"""[Unit]\nDescription=Rathole Iran {port}\nAfter=network.target\n[Service]\nExecStart={INSTALL_DIR}/rathole {INSTALL_DIR}/rathole_iran{port}.toml\nRestart=always\n[Install]\nWantedBy=multi-user.target\n"""
-    
-    with open(f"/etc/systemd/system/{svc_name}.service", "w") as f: f.write(svc_content)
-    os.system(f"systemctl daemon-reload && systemctl enable {svc_name} && systemctl restart {svc_name}")
-    return True
+    return svc_name, svc_content, [(f"{INSTALL_DIR}/rathole_iran{port}.toml", config_content)]
 
-def install_remote_rathole(ssh_ip, iran_ip, config_data):
+def render_remote_rathole(iran_ip, config_data):
+    """(unit, unit file, [(path, content)]) of the Kharej (client) side."""
     port = config_data['tunnel_port']
     remote_addr = f"{iran_ip}:{port}"
     
     services = ""
-    for p in config_data['ports']:
+    for p in list(config_data['ports']) + speedtest_ports(config_data):
         services += f'\n[client.services.{p}]\ntype = "{config_data.get("transport", "tcp")}"\nlocal_addr = "0.0.0.0:{p}"\n'
 
-    ssh_user = config_data.get('ssh_user', 'root')
-    ssh_pass = config_data.get('ssh_pass')
-    ssh_key = config_data.get('ssh_key')
-    ssh_port = int(config_data.get('ssh_port', 22))
-
-    remote_script = f"""
-    export DEBIAN_FRONTEND=noninteractive
-    apt-get update && apt-get install -y unzip curl
-    mkdir -p /root/alamor/bin
-    if [ ! -f /root/alamor/bin/rathole ]; then
-        curl -L -k -o /tmp/rathole.zip {REMOTE_REPO}
-        unzip -o /tmp/rathole.zip -d /root/alamor/bin/
-        chmod +x /root/alamor/bin/rathole
-    fi
-    cat > /root/alamor/bin/rathole_kharej{port}.toml <<EOL
-[client]
+    svc_name = f"rathole-kharej{port}"
+    config_content = f"""[client]
 remote_addr = "{remote_addr}"
 default_token = "{config_data['token']}"
 retry_interval = 1
@@ -76,9 +54,8 @@ type = "{config_data.get('transport', 'tcp')}"
 [client.transport.tcp]
 nodelay = {str(config_data.get('nodelay', True)).lower()}
 {services}
-EOL
-    cat > /etc/systemd/system/rathole-kharej{port}.service <<EOL
-[Unit]
+"""
+    svc_content = f"""[Unit]
 Description=Rathole Kharej {port}
 After=network.target
 [Service]
@@ -86,10 +63,49 @@ ExecStart=/root/alamor/bin/rathole /root/alamor/bin/rathole_kharej{port}.toml
 Restart=always
 [Install]
 WantedBy=multi-user.target
-EOL
-    systemctl daemon-reload && systemctl enable rathole-kharej{port} && systemctl restart rathole-kharej{port}
+"""
+    return svc_name, svc_content, [(f"/root/alamor/bin/rathole_kharej{port}.toml", config_content)]
+
+def services_only_change(old_content, new_content):
     """
-    
+    rathole watches its config file and hot-reloads edits of the
+    [server.services.*] / [client.services.*] sections; anything above them
+    (bind address, token, transport) still needs a restart.
+    """
+    if old_content is None:
+        return False
+    head = lambda c: re.split(r'^\[(?:server|client)\.services\.', c, maxsplit=1, flags=re.M)[0].strip()
+    return head(old_content) == head(new_content)
+
+def install_local_rathole(config_data):
+    if not check_binary("rathole"): raise Exception("Rathole binary missing locally.")
+    svc_name, svc_content, files = render_local_rathole(config_data)
+
+    plan = ApplyPlan(svc_name)
+    plan.add_binary("rathole", f"{INSTALL_DIR}/rathole", [svc_name])
+    for path, content in files:
+        plan.add_file(path, content, [svc_name])
+    plan.add_unit(svc_name, svc_content)
+    plan.apply()
+    return True
+
+def install_remote_rathole(ssh_ip, iran_ip, config_data):
+    ssh_user = config_data.get('ssh_user', 'root')
+    ssh_pass = config_data.get('ssh_pass')
+    ssh_key = config_data.get('ssh_key')
+    ssh_port = int(config_data.get('ssh_port', 22))
+    svc_name, svc_content, files = render_remote_rathole(iran_ip, config_data)
+
     # FIX: ارسال تمام آرگومان‌های مورد نیاز به تابع run_remote_command
     ssh = SSHManager()
-    return ssh.run_remote_command(ssh_ip, ssh_user, ssh_pass, remote_script, ssh_port, ssh_key)
\ No newline at end of file
+    ok, msg = provide_remote_binary('rathole', ssh_ip, ssh_user, ssh_pass, ssh_port, ssh_key,
+                                    "/root/alamor/bin/rathole", ssh)
+    if not ok:
+        return False, msg
+    remote_script = remote_apply_script(
+        [(path, content, [svc_name]) for path, content in files]
+        + [(f"/etc/systemd/system/{svc_name}.service", svc_content, [svc_name])],
+        [svc_name],
+        restart=[svc_name] if binary_changed(msg) else (),
+    )
+    return ssh.run_remote_command(ssh_ip, ssh_user, ssh_pass, remote_script, ssh_port, ssh_key)
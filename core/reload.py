@@ -0,0 +1,304 @@
+import re
+import time
+import shutil
+import secrets
+import logging
+import subprocess
+from contextlib import contextmanager, ExitStack
+from core.apply import ApplyPlan, remote_apply_script, remote_remove_script
+from core.backhaul_manager import BackhaulManager, stop_and_delete_backhaul
+from core.config_loader import load_config
+from core.database import get_tunnel_by_id, update_tunnel_config
+from core.gost_manager import render_gost_client_local, render_server_remote as render_gost_server
+from core.health import established_sockets
+from core.hysteria_manager import render_client_local as render_hysteria_client, LOCAL_CONFIG_PATH as HYSTERIA_CLIENT_CONFIG
+from core.hysteria_manager import render_server_remote as render_hysteria_server
+from core.rathole_manager import render_local_rathole, render_remote_rathole, services_only_change
+from core.rathole_manager import INSTALL_DIR as RATHOLE_DIR
+from core.ssh_manager import SSHManager
+from core.systemd import UnitTransaction
+from core.tasks import task_status, current_task_id
+from core.utils import parse_tunnel_config, get_forwarded_ports, get_public_ip
+
+logger = logging.getLogger("TunnelReload")
+
+DEFAULT_DRAIN_TIMEOUT = 30   # seconds an edit waits for open connections before restarting anyway
+DEFAULT_REFUSE_WINDOW = 5    # seconds an in-place restart may turn new clients away while draining
+RELOAD_SETTLE = 3            # seconds after an apply before connections are counted again
+DRAIN_POLL = 1
+DRAIN_COMMENT = "alamor-drain"
+# iptables-save -c line of a drain rule: [packets:bytes] -A INPUT ... --dport N ... --comment alamor-drain
+DRAIN_RULE_RE = re.compile(rf'^\[(\d+):\d+\] -A INPUT .*?--dport (\d+)\b.*?--comment "?{DRAIN_COMMENT}"?', re.M)
+
+# How an edit reaches the running core, cheapest first
+NOOP = 'noop'      # rendered files unchanged
+LIVE = 'live'      # core picks the new file up by itself, no restart
+SWITCH = 'switch'  # unit name changed: start the new unit next to the old one, then retire the old
+DRAIN = 'drain'    # wait for open connections to finish, then restart
+
+# transport -> check(old file, new file): can the running core reload this edit live?
+# Only rathole does (it watches its config file); backhaul, hysteria and gost
+# have no reload signal, so their edits go through SWITCH or DRAIN.
+LIVE_RELOAD = {
+    'rathole': services_only_change,
+}
+
+
+def render_tunnel(transport, config, iran_ip):
+    """
+    (local, remote) renders of one tunnel, each (unit, unit file, [(path, content)]).
+    """
+    server_ip = config.get('ssh_ip')
+    if transport == 'backhaul':
+        mgr = BackhaulManager()
+        return mgr.render_local(config), mgr.render_remote(iran_ip, config)
+    if transport == 'rathole':
+        return render_local_rathole(config), render_remote_rathole(iran_ip, config)
+    if transport == 'hysteria':
+        return render_hysteria_client(server_ip, config), render_hysteria_server(config)
+    if transport == 'gost':
+        return render_gost_client_local(server_ip, config), render_gost_server(config)
+    raise ValueError(f"Live apply is not supported for '{transport}' tunnels")
+
+
+def queue_teardown(tunnel, tx):
+    """Queue the removal of a tunnel's local units on `tx` (one reload for many tunnels)."""
+    transport, port = tunnel['transport'], tunnel['port']
+    if transport == 'backhaul':
+        stop_and_delete_backhaul(port, tx)
+    elif transport == 'rathole':
+        tx.remove(f"rathole-iran{port}", files=[f"{RATHOLE_DIR}/rathole_iran{port}.toml"])
+    elif transport == 'hysteria':
+        # unit is shared by all hysteria tunnels, so it is only stopped; its
+        # config goes so the port index does not keep its ports claimed
+        tx.stop('hysteria-client').disable('hysteria-client').remove_files(HYSTERIA_CLIENT_CONFIG)
+    elif transport == 'gost':
+        tx.remove(f"gost-client-{port}")
+
+
+def _tunnel_port(transport, config, fallback):
+    if transport == 'gost':
+        return config.get('client_port', fallback)
+    return config.get('tunnel_port', fallback)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _local_plan(transport, rendered, live=False):
+    unit, unit_content, files = rendered
+    plan = ApplyPlan(unit)
+    for path, content in files:
+        # live: the core reloads this file itself, so a change must not restart the unit
+        plan.add_file(path, content, [] if live else [unit])
+    plan.add_unit(unit, unit_content)
+    return plan
+
+
+def choose_strategy(transport, old_local, new_local):
+    old_unit = old_local[0]
+    unit, _, files = new_local
+    if unit != old_unit:
+        return SWITCH
+    plan = _local_plan(transport, new_local).plan()
+    if not plan['restart']:
+        return NOOP
+    changed = {c['path'] for c in plan['changes'] if c['action'] != 'noop'}
+    check = LIVE_RELOAD.get(transport)
+    if check and all(path in dict(files) for path in changed) and \
+            all(check(_read(path), content) for path, content in files if path in changed):
+        return LIVE
+    return DRAIN
+
+
+def _remote_scripts(transport, old_remote, new_remote):
+    """
+    (apply, remove) scripts for the far side of an edit, '' when not needed.
+    `remove` retires the old remote unit after a SWITCH; the caller runs it
+    only once the old local unit is drained.
+    """
+    if old_remote == new_remote:
+        return "", ""
+    unit, unit_content, files = new_remote
+    check = LIVE_RELOAD.get(transport)
+    old_files = dict(old_remote[2]) if old_remote[0] == unit else {}
+    specs = []
+    for path, content in files:
+        live = check is not None and check(old_files.get(path), content)
+        specs.append((path, content, [] if live else [unit]))
+    specs.append((f"/etc/systemd/system/{unit}.service", unit_content, [unit]))
+    remove = remote_remove_script([old_remote[0]]) if old_remote[0] != unit else ""
+    return remote_apply_script(specs, [unit]), remove
+
+
+def _run_remote(config, script):
+    ssh = SSHManager()
+    return ssh.run_remote_command(config.get('ssh_ip'), config.get('ssh_user', 'root'), config.get('ssh_pass'),
+                                  script, int(config.get('ssh_port', 22)), config.get('ssh_key'))
+
+
+def _iptables_restore(binary, lines):
+    payload = "*filter\n" + "\n".join(lines) + "\nCOMMIT\n"
+    res = subprocess.run([f"{binary}-restore", "--noflush"], input=payload, capture_output=True, text=True,
+                         timeout=10)
+    if res.returncode != 0:
+        logger.error(f"{binary}-restore failed: {res.stderr.strip()}")
+    return res.returncode == 0
+
+
+def _refused_count(binary, ports):
+    """SYNs the drain rules on `ports` have rejected so far, from the rule counters."""
+    try:
+        res = subprocess.run([f"{binary}-save", "-c", "-t", "filter"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"{binary}-save failed: {e}")
+        return 0
+    return sum(int(n) for n, port in DRAIN_RULE_RE.findall(res.stdout) if int(port) in ports)
+
+
+@contextmanager
+def refuse_new_connections(ports):
+    """
+    Reset new TCP connections (SYN) to `ports` while inside the block, so a
+    core being drained stops picking up clients; open sessions are untouched.
+    Yields a dict whose 'refused' holds, after the block, how many new
+    connections were turned away.
+    """
+    rules = [f"INPUT -p tcp -m tcp --dport {p} --syn -m comment --comment {DRAIN_COMMENT} "
+             f"-j REJECT --reject-with tcp-reset" for p in sorted(ports)]
+    applied = []
+    for binary in ('iptables', 'ip6tables'):
+        if rules and shutil.which(f"{binary}-restore") and _iptables_restore(binary, [f"-I {r}" for r in rules]):
+            applied.append(binary)
+    if rules and not applied:
+        logger.warning("Cannot refuse new connections (iptables missing); drain may run into its timeout")
+    stats = {'refusing': bool(applied), 'refused': 0}
+    try:
+        yield stats
+    finally:
+        for binary in applied:
+            # counters go with the rules, so read them first
+            stats['refused'] += _refused_count(binary, set(ports))
+            _iptables_restore(binary, [f"-D {r}" for r in rules])
+
+
+def _drain(ports, timeout):
+    """
+    Generator: waits until no client connection is open on `ports`, yields
+    the open count. Run it inside refuse_new_connections(ports).
+    """
+    deadline = time.time() + timeout
+    while True:
+        open_now = len(established_sockets(ports))
+        yield open_now
+        if not open_now or time.time() >= deadline:
+            return
+        time.sleep(DRAIN_POLL)
+
+
+def process_tunnel_apply(tunnel_id, updates, drain_timeout=None):
+    """
+    Task: merge `updates` into a tunnel's config, re-render both sides and
+    bring the running cores to it with the least disruptive strategy.
+    The result reports the strategy, how many client connections the apply
+    dropped and how many new ones were refused while draining.
+    """
+    tunnel = get_tunnel_by_id(tunnel_id)
+    if not tunnel:
+        raise ValueError(f"Tunnel {tunnel_id} not found")
+    transport = tunnel['transport']
+    old = parse_tunnel_config(tunnel['config'])
+    new = {**old, **updates}
+    cfg = load_config()
+    if drain_timeout is None:
+        drain_timeout = cfg.get('reload_drain_timeout', DEFAULT_DRAIN_TIMEOUT)
+    refuse_window = cfg.get('reload_refuse_window', DEFAULT_REFUSE_WINDOW)
+
+    yield 5, "Rendering configuration..."
+    iran_ip = new.get('iran_ip')
+    if not iran_ip and transport in ('backhaul', 'rathole'):
+        iran_ip = new['iran_ip'] = get_public_ip()  # tunnels installed before iran_ip was saved
+    if transport == 'hysteria':
+        # tunnels installed before stats_secret was saved would get a fresh random
+        # secret per render, so the remote side would differ (and restart) on every edit
+        new.setdefault('stats_secret', secrets.token_hex(8))
+        old.setdefault('stats_secret', new['stats_secret'])
+    old_local, old_remote = render_tunnel(transport, dict(old), iran_ip)
+    new_local, new_remote = render_tunnel(transport, new, iran_ip)
+    strategy = choose_strategy(transport, old_local, new_local)
+    remote_script, remote_remove = _remote_scripts(transport, old_remote, new_remote)
+
+    old_ports = get_forwarded_ports(old, tunnel['port'])
+    new_ports = get_forwarded_ports(new, tunnel['port'])
+    watched = set(old_ports) | set(new_ports)
+    yield 15, f"Strategy: {strategy}{' + remote update' if remote_script else ''}"
+
+    waited = 0
+    side_by_side = strategy == SWITCH and not set(old_ports) & set(new_ports)
+    refusal = {'refused': 0}
+    with ExitStack() as stack:
+        if strategy == DRAIN or (strategy == SWITCH and not side_by_side):
+            # no new clients on the old core until the new one is up, or it never drains;
+            # the same ports come back after the restart, so only turn clients away briefly
+            refusal = stack.enter_context(refuse_new_connections(old_ports))
+            start = time.time()
+            for open_now in _drain(old_ports, min(drain_timeout, refuse_window)):
+                yield 25, f"Draining {open_now} open connection(s)..."
+            waited = round(time.time() - start, 1)
+
+        # Connections are counted around each disruptive step only: sessions that
+        # end by themselves while draining are not "dropped".
+        before = established_sockets(watched)
+        if remote_script:
+            yield 40, "Applying remote side..."
+            # side by side, the old remote unit still serves the old local one until it drained
+            ok, out = _run_remote(new, remote_script + ("" if side_by_side else remote_remove))
+            if not ok:
+                raise RuntimeError(f"Remote apply failed: {out}")
+            logger.info(f"Remote apply for tunnel {tunnel_id}: {out.strip()}")
+
+        yield 60, "Applying local side..."
+        with UnitTransaction() as tx:
+            if strategy == SWITCH and not side_by_side:
+                tx.remove(old_local[0])
+            _local_plan(transport, new_local, live=strategy == LIVE).apply(tx=tx)
+        if strategy != NOOP or remote_script:
+            time.sleep(RELOAD_SETTLE)
+        after = established_sockets(watched)
+    connections, dropped = len(before), len(before - after)
+    refused = refusal['refused']
+
+    if side_by_side:
+        # new unit is up on its own ports; the old one (whose ports are going away)
+        # finishes its sessions first
+        with refuse_new_connections(old_ports) as retired:
+            start = time.time()
+            for open_now in _drain(old_ports, drain_timeout):
+                yield 75, f"Switched; old unit still has {open_now} connection(s)..."
+            waited = round(time.time() - start, 1)
+            remaining = established_sockets(old_ports)
+            UnitTransaction().remove(old_local[0]).commit()
+            if remote_remove:
+                ok, out = _run_remote(new, remote_remove)
+                if not ok:
+                    logger.error(f"Removing old remote unit of tunnel {tunnel_id} failed: {out}")
+            time.sleep(RELOAD_SETTLE)
+            dropped += len(remaining - established_sockets(old_ports))
+        refused += retired['refused']
+
+    yield 90, "Saving configuration..."
+    update_tunnel_config(tunnel_id, tunnel['name'], transport, _tunnel_port(transport, new, tunnel['port']), new)
+
+    result = {'strategy': strategy, 'remote': bool(remote_script), 'connections': connections,
+              'dropped': dropped, 'refused': refused, 'drain_wait': waited}
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result=result)
+    logger.info(f"Applied edit of tunnel {tunnel_id} ({transport}): {result}")
+    yield 100, (f"Applied ({strategy}): {dropped} of {connections} connection(s) dropped, "
+                f"{refused} new connection(s) refused")
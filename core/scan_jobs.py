@@ -0,0 +1,201 @@
+import json
+import heapq
+import random
+import logging
+import uuid
+import itertools
+import time
+from core.scanner import run_scan, CF_RANGES, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+from core.targets import AdaptiveTargets, total_addresses, DEFAULT_EXPLORE
+from core.database import create_scan_job, update_scan_job, get_scan_job, get_scan_jobs, add_scan_hits
+from core.tasks import task_status, current_task_id
+from core.executor import executor, PRIORITY_LOW
+from core import clean_ips
+
+logger = logging.getLogger("ScanJobs")
+
+TOP_K = 20            # best IPs kept per job
+CHUNK_SIZE = 2000     # targets per checkpoint
+CONFIRM_SAMPLES = 3   # handshakes per hit (latency median / jitter / loss)
+DEFAULT_COUNT = 20000
+HIT_FLUSH_INTERVAL = 1.0
+ACTIVE = ('queued', 'running')
+
+
+def score(hit):
+    """Lower is better: latency, penalised by jitter and packet loss."""
+    return (hit['latency'] or 0) + 2 * (hit.get('jitter') or 0) + 1000 * (hit.get('loss') or 0)
+
+
+class TopK:
+    """Keeps the K best hits (lowest score) with a bounded max-heap."""
+
+    def __init__(self, k=TOP_K, items=None):
+        self.k = k
+        self._heap = []
+        for hit in items or []:
+            self.push(hit)
+
+    def push(self, hit):
+        entry = (-score(hit), hit['ip'], hit)
+        # Same IP seen again (resumed chunk): replace the old entry
+        self._heap = [e for e in self._heap if e[1] != hit['ip']]
+        heapq.heapify(self._heap)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def ranked(self):
+        return [e[2] for e in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+
+
+def _job_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'] or '{}')
+    job['top'] = json.loads(job['top'] or '[]')
+    job['state'] = json.loads(job['state']) if job.get('state') else None
+    return job
+
+
+def get_job(job_id):
+    row = get_scan_job(job_id)
+    return _job_dict(row) if row else None
+
+
+def list_jobs(limit=50):
+    return [_job_dict(r) for r in get_scan_jobs(limit=limit)]
+
+
+def process_scan_job(job_id):
+    """
+    Executor task: sweep the job's ranges chunk by chunk from its saved cursor.
+    Targets come from the adaptive sampler (no repeats, leans towards blocks
+    that already produced hits). Every chunk ends with a checkpoint (sampler
+    state, counters, top-K) so a restart continues where it stopped.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise Exception(f"Scan job {job_id} not found")
+    params = job['params']
+    domain = job['domain']
+    ranges = params.get('ranges') or CF_RANGES
+    total, cursor = job['total'], job['cursor']
+    probed, hits = job['probed'], job['hits']
+    top = TopK(params.get('top_k', TOP_K), job['top'])
+    limit = params.get('limit') or 0
+    task_id = current_task_id()
+    explore = DEFAULT_EXPLORE if params.get('adaptive', True) else 1.0
+    sampler = AdaptiveTargets(ranges, params['seed'], explore=explore, state=job['state'], start=cursor)
+
+    def flush_hits(batch):
+        add_scan_hits(job_id, batch)
+        # Every hit also warms the per-domain clean IP cache
+        clean_ips.record(domain, batch)
+
+    update_scan_job(job_id, status='running')
+    yield 1, f"Scanning {domain}: {total - cursor} of {total} targets left..."
+
+    finished = False
+    try:
+        while cursor < total and not (limit and hits >= limit):
+            end = min(total, cursor + CHUNK_SIZE)
+            found = []
+            pending = {'hits': [], 'at': time.time()}
+
+            def on_result(res):
+                sampler.feedback(res['ip'], res['ok'])
+                if not res['ok']:
+                    return
+                found.append(res)
+                pending['hits'].append(res)
+                # Hits reach the DB (and the SSE stream) about once a second, not per chunk
+                if time.time() - pending['at'] >= HIT_FLUSH_INTERVAL:
+                    flush_hits(pending['hits'])
+                    pending['hits'], pending['at'] = [], time.time()
+                if task_id:
+                    task_status.append_line(task_id, f"HIT {res['ip']} {res['latency']}ms "
+                                                     f"jitter {res['jitter']}ms loss {res['loss']:.0%}")
+
+            targets = itertools.islice(sampler, end - cursor)
+            run_scan(targets, domain, concurrency=params.get('concurrency', DEFAULT_CONCURRENCY),
+                     timeout=params.get('timeout', DEFAULT_TIMEOUT), port=params.get('port', 443),
+                     samples=CONFIRM_SAMPLES,
+                     on_result=on_result)
+
+            if pending['hits']:
+                flush_hits(pending['hits'])
+            if found:
+                for hit in found:
+                    top.push(hit)
+            if sampler.produced == cursor:
+                break  # ranges exhausted
+            probed += sampler.produced - cursor
+            hits += len(found)
+            cursor = sampler.produced
+            update_scan_job(job_id, cursor=cursor, probed=probed, hits=hits, top=top.ranked(),
+                            state=sampler.state())
+
+            best = top.ranked()[:1]
+            best_txt = f", best {best[0]['ip']} {best[0]['latency']}ms" if best else ""
+            yield max(1, int(99 * cursor / total)), f"Probed {probed}/{total}, {hits} clean{best_txt}"
+
+        finished = True
+        update_scan_job(job_id, status='completed')
+        if task_id:
+            task_status.update(task_id, result=top.ranked())
+        yield 100, f"Scan finished: {hits} clean IPs"
+    except GeneratorExit:
+        # Cancelled between chunks: progress so far is already checkpointed
+        update_scan_job(job_id, status='cancelled')
+        raise
+    except Exception as e:
+        update_scan_job(job_id, status='error', error=str(e))
+        raise
+    finally:
+        if not finished:
+            logger.info(f"Scan {job_id} stopped at {cursor}/{total}")
+
+
+def start_scan_job(domain, count=DEFAULT_COUNT, ranges=None, concurrency=DEFAULT_CONCURRENCY,
+                   timeout=DEFAULT_TIMEOUT, limit=0, top_k=TOP_K, port=443, adaptive=True):
+    ranges = ranges or CF_RANGES
+    job_id = str(uuid.uuid4())
+    params = {
+        'ranges': ranges, 'seed': random.getrandbits(32), 'concurrency': concurrency,
+        'timeout': timeout, 'limit': limit, 'top_k': top_k, 'port': port, 'adaptive': adaptive,
+    }
+    create_scan_job(job_id, domain, params, min(int(count), total_addresses(ranges)))
+    executor.submit(process_scan_job, (job_id,), key=f"scan:{domain}", priority=PRIORITY_LOW, task_id=job_id)
+    return job_id
+
+
+def resume_scan_job(job_id):
+    job = get_job(job_id)
+    if not job or job['cursor'] >= job['total'] or executor.is_active(job_id):
+        return False
+    update_scan_job(job_id, status='queued', error=None)
+    executor.submit(process_scan_job, (job_id,), key=f"scan:{job['domain']}", priority=PRIORITY_LOW, task_id=job_id)
+    return True
+
+
+def cancel_scan_job(job_id):
+    cancelled = executor.cancel(job_id)
+    job = get_job(job_id)
+    # A running sweep marks itself at its next checkpoint; queued or orphaned
+    # (left over from before a restart) jobs are marked here
+    if job and job['status'] == 'queued' or (job and job['status'] == 'running' and not cancelled):
+        update_scan_job(job_id, status='cancelled')
+        return True
+    return cancelled
+
+
+def resume_interrupted_scans():
+    """Called at startup: continue sweeps that were running when the panel stopped."""
+    resumed = 0
+    for row in get_scan_jobs(statuses=ACTIVE):
+        if resume_scan_job(row['id']):
+            resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} interrupted scan jobs")
+    return resumed
@@ -1,57 +1,178 @@
-import subprocess
-import concurrent.futures
+import ssl
+import time
 import random
+import itertools
+import statistics
+import asyncio
+import logging
+from core.targets import AdaptiveTargets, CF_RANGES_V4
+
+try:
+    import resource
+except ImportError:  # non-posix
+    resource = None
+
+logger = logging.getLogger("CleanIPScanner")
+
+CF_RANGES = CF_RANGES_V4
+
+DEFAULT_CONCURRENCY = 1000   # probes in flight at the same time
+DEFAULT_TIMEOUT = 2.0        # seconds for TCP + TLS + first response line
+DEFAULT_TARGETS = 5000
+GOOD_STATUS = (200, 301, 302, 403, 404)
+FD_RESERVE = 64              # file descriptors left for Flask/SSH/SQLite
+
+
+def _ssl_context(verify=True):
+    ctx = ssl.create_default_context()
+    if not verify:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    # Only the handshake matters; skip session tickets bookkeeping
+    ctx.options |= ssl.OP_NO_TICKET
+    return ctx
+
+
+def _raise_fd_limit(wanted):
+    """Thousands of sockets need a higher RLIMIT_NOFILE; returns usable concurrency."""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = wanted + FD_RESERVE
+    if soft < need:
+        new_soft = need if hard == resource.RLIM_INFINITY else min(need, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        except (ValueError, OSError):
+            pass
+    return max(1, min(wanted, soft - FD_RESERVE))
+
+
+async def probe(ip, domain, port=443, timeout=DEFAULT_TIMEOUT, ctx=None, http=True):
+    """
+    One TCP + TLS handshake to `ip` with SNI=`domain`, then (optionally) a
+    HEAD request on the same connection.
+    Returns {'ip', 'ok', 'latency' (handshake ms), 'ttfb' (ms), 'status', 'error'}.
+    """
+    ctx = ctx or _ssl_context()
+    result = {'ip': ip, 'ok': False, 'latency': None, 'ttfb': None, 'status': None, 'error': None}
+    writer = None
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(ip, port, ssl=ctx, server_hostname=domain,
+                                    ssl_handshake_timeout=timeout),
+            timeout)
+        result['latency'] = round((time.perf_counter() - start) * 1000, 1)
+        if not http:
+            result['ok'] = True
+            return result
+
+        writer.write(f"HEAD / HTTP/1.1\r\nHost: {domain}\r\nUser-Agent: Mozilla/5.0\r\nConnection: close\r\n\r\n".encode())
+        sent = time.perf_counter()
+        line = await asyncio.wait_for(reader.readline(), timeout)
+        result['ttfb'] = round((time.perf_counter() - sent) * 1000, 1)
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].isdigit():
+            result['status'] = int(parts[1])
+            result['ok'] = result['status'] in GOOD_STATUS
+        else:
+            result['error'] = 'bad response'
+    except asyncio.TimeoutError:
+        result['error'] = 'timeout'
+    except ssl.SSLError as e:
+        result['error'] = f"tls: {e.reason or e}"
+    except (OSError, EOFError) as e:
+        result['error'] = type(e).__name__
+    finally:
+        if writer is not None:
+            writer.transport.abort()  # no close_notify round trip
+    return result
+
+
+async def measure(first, domain, samples, port=443, timeout=DEFAULT_TIMEOUT, ctx=None, http=True):
+    """Re-probe a hit `samples - 1` more times: median latency, jitter and loss."""
+    results = [first]
+    for _ in range(samples - 1):
+        results.append(await probe(first['ip'], domain, port, timeout, ctx, http))
+    ok = [r for r in results if r['ok']]
+    latencies = [r['latency'] for r in ok]
+    hit = dict(first)
+    hit['samples'] = len(results)
+    hit['loss'] = round(1 - len(ok) / len(results), 3)
+    hit['latency'] = round(statistics.median(latencies), 1) if latencies else None
+    hit['jitter'] = round(statistics.pstdev(latencies), 1) if len(latencies) > 1 else 0.0
+    hit['ok'] = bool(ok)
+    return hit
+
+
+async def scan(targets, domain, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+               limit=None, on_result=None, port=443, verify=True, http=True, samples=1):
+    """
+    Probe every address from the `targets` iterable with at most `concurrency`
+    connections open. Targets are pulled lazily, so huge ranges are fine.
+    With `samples` > 1 each hit is re-probed to get jitter and loss.
+    Stops early once `limit` good IPs were found. Returns the good results.
+    """
+    concurrency = _raise_fd_limit(int(concurrency))
+    ctx = _ssl_context(verify)
+    targets = iter(targets)
+    hits = []
+    done = asyncio.Event()
+
+    async def worker():
+        # N workers share one iterator: same effect as a semaphore, without
+        # creating one pending task per target
+        for ip in targets:
+            if done.is_set():
+                return
+            res = await probe(ip, domain, port, timeout, ctx, http)
+            if res['ok'] and samples > 1:
+                res = await measure(res, domain, samples, port, timeout, ctx, http)
+            if on_result:
+                on_result(res)
+            if res['ok']:
+                hits.append(res)
+                if limit and len(hits) >= limit:
+                    done.set()
+                    return
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return sorted(hits, key=lambda r: r['latency'])
+
+
+def run_scan(targets, domain, **kwargs):
+    """Sync entry point (Flask threads / CLI)."""
+    return asyncio.run(scan(targets, domain, **kwargs))
 
-# لیست کوتاهی از رنج‌های کلاودفلر (برای نمونه)
-# در نسخه واقعی می‌تونی کل رنج‌ها رو بذاری
-CF_RANGES = [
-    "104.16.0.0/24", "104.17.0.0/24", "104.18.0.0/24", 
-    "104.19.0.0/24", "104.20.0.0/24", "104.21.0.0/24",
-    "172.64.0.0/24", "172.67.0.0/24"
-]
 
 def check_ip(ip, domain, timeout=1):
     """تست اتصال به یک IP خاص با SNI دامنه خودمان"""
-    try:
-        # استفاده از curl برای تست واقعی هندشیک SSL
-        # --resolve دامنه رو مجبور میکنه به این IP وصل شه
-        cmd = f"curl -s -o /dev/null -w '%{{http_code}}' --connect-timeout {timeout} --max-time {timeout + 1} --resolve {domain}:443:{ip} https://{domain}"
-        
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        
-        if result.stdout.strip() in ["200", "301", "302", "403", "404"]:
-            return True, ip
-        return False, ip
-    except:
-        return False, ip
-
-def scan_for_clean_ip(domain, max_threads=10, limit=5):
+    res = asyncio.run(probe(ip, domain, timeout=timeout))
+    return res['ok'], ip
+
+
+def scan_for_clean_ip(domain, max_threads=DEFAULT_CONCURRENCY, limit=5, count=DEFAULT_TARGETS, ranges=None):
     """اسکن رندوم برای پیدا کردن IP تمیز"""
-    found_ips = []
-    # تولید 50 آی‌پی رندوم از رنج‌ها برای تست سریع
-    test_ips = []
-    for _ in range(50):
-        subnet = random.choice(CF_RANGES)
-        base = ".".join(subnet.split('.')[:3])
-        last = random.randint(1, 254)
-        test_ips.append(f"{base}.{last}")
-
-    logs = []
-    logs.append(f"Generated {len(test_ips)} targets from Cloudflare pool...")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
-        future_to_ip = {executor.submit(check_ip, ip, domain): ip for ip in test_ips}
-        
-        for future in concurrent.futures.as_completed(future_to_ip):
-            success, ip = future.result()
-            if success:
-                latency = 0 # میشه پینگ هم گرفت ولی فعلا ساده‌ش کردیم
-                found_ips.append({'ip': ip, 'latency': 'LOW'})
-                logs.append(f"HIT: {ip} is responsive!")
-                if len(found_ips) >= limit:
-                    break
-            else:
-                pass 
-                # logs.append(f"MISS: {ip} timed out") # لاگ شلوغ نشه
-
-    return found_ips, logs
\ No newline at end of file
+    logs = [f"Sweeping {count} targets from {len(ranges or CF_RANGES)} Cloudflare ranges "
+            f"({max_threads} probes in flight)..."]
+    stats = {'probed': 0}
+
+    def on_result(res):
+        stats['probed'] += 1
+        if res['ok']:
+            logs.append(f"HIT: {res['ip']} handshake {res['latency']}ms (HTTP {res['status']})")
+
+    # Adaptive sampling: blocks that already produced a hit get probed more
+    targets = AdaptiveTargets(ranges or CF_RANGES, seed=random.getrandbits(32))
+
+    def on_result_adaptive(res):
+        targets.feedback(res['ip'], res['ok'])
+        on_result(res)
+
+    started = time.time()
+    found = run_scan(itertools.islice(targets, count), domain, concurrency=max_threads,
+                     limit=limit, on_result=on_result_adaptive)
+    logs.append(f"Probed {stats['probed']} IPs in {time.time() - started:.1f}s")
+    return found, logs
@@ -1,38 +1,23 @@
-import os
-import subprocess
-from core.ssh_manager import run_remote_command
+from core.ssh_manager import SSHManager
+from core.artifacts import provide_remote_binary, store
+from core.apply import ApplyPlan, remote_apply_script, binary_changed
 
 # --- CONFIGURATION ---
 INSTALL_DIR = "/root/AlamorTunnel/bin"
-REPO_URL = "https://files.irplatforme.ir/files"
 
 def check_binary(binary_name):
-    # چک کردن هر دو فایل کلاینت و سرور
-    client_path = f"{INSTALL_DIR}/slipstream-client"
-    server_path = f"{INSTALL_DIR}/slipstream-server"
-    
-    if os.path.exists(client_path) and os.path.exists(server_path): return True
-    
+    # چک کردن هر دو فایل کلاینت و سرور در کش (نصب خود فایل با ApplyPlan)
     try:
-        if not os.path.exists(INSTALL_DIR): os.makedirs(INSTALL_DIR)
-        # دانلود پک کامل اسلیپ‌استریم
-        subprocess.run(f"curl -L -o {INSTALL_DIR}/slipstream.tar.gz {REPO_URL}/slipstream.tar.gz", shell=True, check=True)
-        subprocess.run(f"tar -xzf {INSTALL_DIR}/slipstream.tar.gz -C {INSTALL_DIR}", shell=True, check=True)
-        subprocess.run(f"chmod +x {client_path}", shell=True, check=True)
-        subprocess.run(f"chmod +x {server_path}", shell=True, check=True)
-        if os.path.exists(f"{INSTALL_DIR}/slipstream.tar.gz"): os.remove(f"{INSTALL_DIR}/slipstream.tar.gz")
+        # پک اسلیپ‌استریم یک بار دانلود و هر دو باینری در کش ذخیره می‌شوند
+        store.ensure("slipstream-client")
+        store.ensure("slipstream-server")
         return True
     except: return False
 
 def install_slipstream_server_remote_gen(ssh_ip, config):
     # اسکریپت ریموت برای سرور خارج (دانلود باینری)
-    script = f"""
+    prepare = f"""
     mkdir -p {INSTALL_DIR}
-    if [ ! -f {INSTALL_DIR}/slipstream-server ]; then
-        curl -L -o {INSTALL_DIR}/slipstream.tar.gz {REPO_URL}/slipstream.tar.gz
-        tar -xzf {INSTALL_DIR}/slipstream.tar.gz -C {INSTALL_DIR}
-        chmod +x {INSTALL_DIR}/slipstream-server
-    fi
     
     cd {INSTALL_DIR}
     if [ ! -f cert.pem ]; then
@@ -40,9 +25,8 @@ def install_slipstream_server_remote_gen(ssh_ip, config):
     fi
     
     ufw allow {config['tunnel_port']}/udp
-    
-    cat > /etc/systemd/system/slipstream-server.service <<EOL
-[Unit]
+    """
+    svc = f"""[Unit]
 Description=Slipstream Server
 After=network.target
 [Service]
@@ -57,19 +41,30 @@ ExecStart={INSTALL_DIR}/slipstream-server \\
 Restart=always
 [Install]
 WantedBy=multi-user.target
-EOL
-    systemctl daemon-reload && systemctl enable slipstream-server && systemctl restart slipstream-server
-    """
+"""
     
-    success, out = run_remote_command(ssh_ip, script)
+    ssh = SSHManager()
+    ssh_user = config.get('ssh_user', 'root')
+    ssh_pass = config.get('ssh_pass')
+    ssh_key = config.get('ssh_key')
+    ssh_port = int(config.get('ssh_port', 22))
+
+    success, out = provide_remote_binary("slipstream-server", ssh_ip, ssh_user, ssh_pass, ssh_port, ssh_key,
+                                         f"{INSTALL_DIR}/slipstream-server", ssh)
+    if success:
+        script = prepare + remote_apply_script(
+            [("/etc/systemd/system/slipstream-server.service", svc, ['slipstream-server'])],
+            ['slipstream-server'],
+            restart=['slipstream-server'] if binary_changed(out) else (),
+        )
+        success, out = ssh.run_remote_command(ssh_ip, ssh_user, ssh_pass, script, ssh_port, ssh_key)
     yield "Remote Installation Complete." if success else f"Remote Error: {out}"
 
 def install_slipstream_client_local_gen(remote_ip, config):
     if not check_binary("slipstream-client"):
         raise Exception("Slipstream binaries missing locally.")
 
-    svc = f"""
-[Unit]
+    svc = f"""[Unit]
 Description=Slipstream Client
 After=network.target
 [Service]
@@ -82,8 +77,8 @@ Restart=always
 [Install]
 WantedBy=multi-user.target
 """
-    with open("/etc/systemd/system/slipstream-client.service", "w") as f:
-        f.write(svc)
-    
-    os.system("systemctl daemon-reload && systemctl enable slipstream-client && systemctl restart slipstream-client")
-    yield "Local Service Started."
\ No newline at end of file
+    plan = ApplyPlan("slipstream-client")
+    plan.add_binary("slipstream-client", f"{INSTALL_DIR}/slipstream-client", ["slipstream-client"])
+    plan.add_unit("slipstream-client", svc)
+    result = plan.apply()
+    yield "Local Service Started." if result['restart'] or result['started'] else "Local Service Unchanged."
\ No newline at end of file
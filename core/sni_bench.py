@@ -0,0 +1,177 @@
+import ssl
+import time
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from core.tasks import task_status, current_task_id
+
+logger = logging.getLogger("SNIBench")
+
+# لیست دامنه‌های پیشنهادی (سایت‌های پربازدید ایرانی)
+CANDIDATES = [
+    "www.digikala.com",
+    "www.aparat.com",
+    "www.varzesh3.com",
+    "www.filimo.com",
+    "www.namava.ir",
+    "www.telewebion.com",
+    "divar.ir",
+    "snapp.ir",
+    "torob.com",
+    "bama.ir",
+    "www.shatelland.com",
+    "www.asiatech.ir",
+    "www.mci.ir",
+    "www.irancel.ir",
+    "cafebazaar.ir",
+    "tamasha.com",
+    "www.blogfa.com",
+    "www.ninisite.com"
+]
+
+DEFAULT_SAMPLES = 5
+DEFAULT_CONCURRENCY = 10
+DEFAULT_TIMEOUT = 5
+PHASES = ('dns', 'tcp', 'tls', 'ttfb')
+
+
+def clean_domain(domain):
+    return domain.strip().replace("https://", "").replace("http://", "").split("/")[0]
+
+
+def _ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile (values need not be sorted)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+def measure_once(domain, port=443, timeout=DEFAULT_TIMEOUT, context=None):
+    """
+    One sample on ONE connection, timed phase by phase:
+    dns (getaddrinfo) -> tcp connect -> tls handshake (SNI) -> first response byte.
+    """
+    sample = {'ok': False, 'dns': None, 'tcp': None, 'tls': None, 'ttfb': None,
+              'ip': None, 'tls_version': None, 'status_code': 0, 'msg': ''}
+    context = context or ssl.create_default_context()
+    sock = None
+    try:
+        t = time.perf_counter()
+        family, socktype, proto, _, addr = socket.getaddrinfo(domain, port, type=socket.SOCK_STREAM)[0]
+        sample['dns'] = _ms(t)
+        sample['ip'] = addr[0]
+
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        t = time.perf_counter()
+        sock.connect(addr)
+        sample['tcp'] = _ms(t)
+
+        t = time.perf_counter()
+        sock = context.wrap_socket(sock, server_hostname=domain)
+        sample['tls'] = _ms(t)
+        sample['tls_version'] = sock.version()
+
+        request = f"GET / HTTP/1.1\r\nHost: {domain}\r\nUser-Agent: Mozilla/5.0\r\nAccept: */*\r\nConnection: close\r\n\r\n"
+        t = time.perf_counter()
+        sock.sendall(request.encode())
+        first = sock.recv(1024)
+        sample['ttfb'] = _ms(t)
+
+        status_line = first.split(b"\r\n", 1)[0].split()
+        if len(status_line) >= 2 and status_line[1].isdigit():
+            sample['status_code'] = int(status_line[1])
+        if 200 <= sample['status_code'] < 400:
+            sample['ok'] = True
+            sample['msg'] = "OK"
+        else:
+            sample['msg'] = f"Bad Status: {sample['status_code']}" if sample['status_code'] else "Bad HTTP response"
+    except socket.timeout:
+        sample['msg'] = "Timeout (Blocked?)"
+    except ssl.SSLError:
+        sample['msg'] = "SSL Error (No TLS support?)"
+    except socket.gaierror:
+        sample['msg'] = "DNS Error (Invalid Domain)"
+    except Exception as e:
+        sample['msg'] = str(e)
+    finally:
+        if sock is not None:
+            sock.close()
+    return sample
+
+
+def bench_domain(domain, samples=DEFAULT_SAMPLES, port=443, timeout=DEFAULT_TIMEOUT):
+    """
+    `samples` sequential measurements -> p50/p95 per phase.
+    `latency` is the p50 of TCP + TLS: the handshake cost a tunnel pays, without DNS.
+    """
+    domain = clean_domain(domain)
+    context = ssl.create_default_context()
+    runs = [measure_once(domain, port, timeout, context) for _ in range(max(1, int(samples)))]
+    good = [r for r in runs if r['ok']]
+    if not good:
+        msg = runs[-1]['msg']
+    elif len(good) < len(runs):
+        msg = f"{len(runs) - len(good)}/{len(runs)} samples failed"
+    else:
+        msg = "OK"
+    result = {
+        'domain': domain,
+        'valid': bool(good),
+        'samples': len(runs),
+        'success': len(good),
+        'ip': next((r['ip'] for r in runs if r['ip']), None),
+        'tls_version': next((r['tls_version'] for r in runs if r['tls_version']), None),
+        'status_code': (good or runs)[-1]['status_code'],
+        'msg': msg,
+    }
+    for phase in PHASES:
+        values = [r[phase] for r in good if r[phase] is not None]
+        result[phase] = {'p50': _percentile(values, 50), 'p95': _percentile(values, 95)}
+    handshakes = [r['tcp'] + r['tls'] for r in good]
+    result['latency'] = _percentile(handshakes, 50) or 0
+    result['latency_p95'] = _percentile(handshakes, 95) or 0
+    return result
+
+
+def iter_bench(domains, samples=DEFAULT_SAMPLES, concurrency=DEFAULT_CONCURRENCY, port=443, timeout=DEFAULT_TIMEOUT):
+    """Benchmark domains concurrently; yield each result as soon as it is ready."""
+    domains = [d for d in (clean_domain(d) for d in domains) if d]
+    if not domains:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(int(concurrency), len(domains)))) as pool:
+        futures = {pool.submit(bench_domain, d, samples, port, timeout): d for d in domains}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'domain': futures[future], 'valid': False, 'latency': 0, 'msg': str(e)}
+
+
+def rank(results):
+    """Valid candidates, fastest (p50 handshake, then p95) first."""
+    return sorted((r for r in results if r['valid']), key=lambda r: (r['latency'], r.get('latency_p95', 0)))
+
+
+def process_sni_bench(domains, samples=DEFAULT_SAMPLES, concurrency=DEFAULT_CONCURRENCY):
+    """Task generator for the executor: one progress line per finished domain + ranking."""
+    domains = domains or CANDIDATES
+    total = len(domains)
+    yield 5, f"Benchmarking {total} SNI candidates ({samples} samples each)..."
+    results = []
+    for res in iter_bench(domains, samples, concurrency):
+        results.append(res)
+        note = f"{res['latency']}ms p95 {res.get('latency_p95')}ms" if res['valid'] else res['msg']
+        yield 5 + int(90 * len(results) / total), f"{res['domain']}: {note}"
+
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result={'ranking': rank(results), 'results': results})
+    yield 100, f"{len(rank(results))}/{total} candidates usable"
@@ -0,0 +1,408 @@
+import socket
+import secrets
+import statistics
+import threading
+import time
+import logging
+from core.config_loader import load_config
+from core.database import get_tunnel_by_id, get_connected_server, add_speedtest_result, get_speedtest_history
+from core.executor import executor, PRIORITY_LOW
+from core.traffic import run_advanced_speedtest
+from core.ssh_manager import SSHManager
+from core.tasks import task_status, current_task_id
+from core.ports import build_port_map, reserve, release
+from core.prober import probe_port
+from core.reload import process_tunnel_apply
+from core.utils import parse_tunnel_config, speedtest_ports
+
+logger = logging.getLogger("TunnelSpeedtest")
+
+# Throughput is measured THROUGH the tunnel: streams enter the tunnel's
+# dedicated speedtest forward on this host, cross the tunnel and end in a tiny
+# sink/source on the remote. The real service behind the user ports keeps its port.
+DEFAULT_STREAMS = 4
+DEFAULT_DURATION = 10     # seconds per direction
+DEFAULT_WARMUP = 2        # first seconds (TCP slow start) left out of the result
+MAX_STREAMS = 32
+MAX_DURATION = 60
+CHUNK = 64 * 1024
+CONNECT_TIMEOUT = 5
+IO_TIMEOUT = 10
+SINK_PATH = "/tmp/alamor-speedtest-sink.py"
+SINK_GRACE = 30           # extra seconds the sink stays up after the planned test
+HOST_LINK_KEY = "speedtest:host"
+# Every test (tunnel or host uplink) saturates this host's uplink, so all of
+# them share one executor key and run one after another
+SPEEDTEST_KEY = "speedtest"
+# cores that can carry an extra plain TCP forward (gost's local side is a proxy)
+SPEEDTEST_TRANSPORTS = ('rathole', 'backhaul', 'hysteria')
+
+# Runs on the remote with plain python3: `U` = read and count until EOF,
+# `D` = send zeros until the client hangs up. Exits by itself after `ttl`.
+SINK_SCRIPT = r'''
+import socket, sys, threading, time
+port, token, ttl, host = int(sys.argv[1]), sys.argv[2].encode(), float(sys.argv[3]), sys.argv[4]
+srv = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+try:
+    srv.bind((host, port))
+except OSError as e:
+    print("BIND_FAILED %s" % e, flush=True)
+    sys.exit(1)
+srv.listen(128)
+srv.settimeout(1)
+deadline = time.time() + ttl
+zeros = bytes(65536)
+print("READY", flush=True)
+
+def handle(c):
+    try:
+        c.settimeout(15)
+        head = b""
+        while not head.endswith(b"\n") and len(head) < 256:
+            b = c.recv(1)
+            if not b:
+                return
+            head += b
+        parts = head.split()
+        if len(parts) != 2 or parts[0] != token:
+            # e.g. the prober's HEAD request: answer so its round trip can be timed
+            c.sendall(b"ALAMOR-SINK\n")
+            c.recv(4096)
+            return
+        if parts[1] == b"U":
+            buf, total = bytearray(65536), 0
+            while True:
+                n = c.recv_into(buf)
+                if not n:
+                    break
+                total += n
+            c.sendall(str(total).encode())
+        elif parts[1] == b"D":
+            while time.time() < deadline:
+                c.sendall(zeros)
+    except OSError:
+        pass
+    finally:
+        c.close()
+
+while time.time() < deadline:
+    try:
+        conn, _ = srv.accept()
+    except socket.timeout:
+        continue
+    threading.Thread(target=handle, args=(conn,), daemon=True).start()
+'''
+
+
+class SpeedtestError(Exception):
+    pass
+
+
+def _tunnel_ssh(config):
+    """SSH credentials of the tunnel's remote end (stored at install time)."""
+    if config.get('ssh_ip'):
+        return (config['ssh_ip'], config.get('ssh_user') or 'root', config.get('ssh_pass'),
+                config.get('ssh_key'), int(config.get('ssh_port') or 22))
+    server = get_connected_server()
+    if not server:
+        raise SpeedtestError("No remote server known for this tunnel")
+    ip, user, password, ssh_key, port = server
+    return ip, user, password, ssh_key, port
+
+
+def start_sink(ssh_info, host, port, token, ttl, ssh=None):
+    ip, user, password, ssh_key, ssh_port = ssh_info
+    ssh = ssh or SSHManager()
+    sftp = ssh.open_sftp(ip, user, password, ssh_port, ssh_key)
+    try:
+        with sftp.open(SINK_PATH, 'w') as f:
+            f.write(SINK_SCRIPT)
+    finally:
+        sftp.close()
+    log = f"/tmp/alamor-speedtest-{port}.log"
+    cmd = (f"nohup python3 {SINK_PATH} {port} {token} {int(ttl)} {host} > {log} 2>&1 & "
+           f"for i in 1 2 3 4 5 6 7 8 9 10; do grep -q . {log} && break; sleep 0.3; done; cat {log}")
+    ok, out = ssh.run_remote_command(ip, user, password, cmd, ssh_port, ssh_key, on_line=lambda line: None)
+    if not ok or "READY" not in out:
+        if "BIND_FAILED" in out:
+            raise SpeedtestError(f"Speedtest port {port} is taken on the remote end by another process")
+        raise SpeedtestError(f"Could not start the speedtest sink: {out.strip() or 'python3 missing?'}")
+
+
+def stop_sink(ssh_info, port, ssh=None):
+    ip, user, password, ssh_key, ssh_port = ssh_info
+    ssh = ssh or SSHManager()
+    ssh.run_remote_command(ip, user, password, f"pkill -f '{SINK_PATH} {port} ' || true",
+                           ssh_port, ssh_key, on_line=lambda line: None)
+
+
+def _run_stream(host, port, token, mode, barrier, state, counts, index):
+    """One TCP stream; per-second byte counts go into counts[index]."""
+    sock = None
+    try:
+        sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(IO_TIMEOUT)
+        sock.sendall(f"{token} {mode}\n".encode())
+    except OSError as e:
+        state['errors'].append(f"connect: {e}")
+        if sock is not None:
+            sock.close()
+        sock = None
+    try:
+        barrier.wait()   # every stream starts the clock together
+    except threading.BrokenBarrierError:
+        pass
+    if sock is None:
+        return 0
+    t0, end = state['t0'], state['t0'] + state['duration']
+    buckets = counts[index]
+    payload = memoryview(bytes(CHUNK))
+    buf = bytearray(CHUNK)
+    delivered = 0
+    try:
+        while True:
+            if mode == 'U':
+                n = sock.send(payload)
+            else:
+                n = sock.recv_into(buf)
+                if not n:
+                    break
+            now = time.perf_counter()
+            if now >= end:
+                break
+            buckets[int(now - t0)] += n
+        if mode == 'U':
+            # The sink answers with what really arrived (not just what left our buffer)
+            sock.shutdown(socket.SHUT_WR)
+            reply = sock.recv(64)
+            delivered = int(reply) if reply.strip().isdigit() else 0
+    except OSError as e:
+        state['errors'].append(f"{mode}: {e}")
+    finally:
+        sock.close()
+    return delivered
+
+
+def measure_direction(host, port, token, mode, streams=DEFAULT_STREAMS, duration=DEFAULT_DURATION,
+                      warmup=DEFAULT_WARMUP):
+    """
+    `streams` parallel connections for `duration` seconds in one direction.
+    Returns Mbps over the post-warm-up seconds plus per-second samples.
+    """
+    counts = [[0] * (duration + 1) for _ in range(streams)]
+    state = {'duration': duration, 'errors': [], 't0': 0}
+    delivered = [0] * streams
+
+    def start_clock():
+        state['t0'] = time.perf_counter()
+
+    barrier = threading.Barrier(streams, action=start_clock)
+
+    def worker(i):
+        delivered[i] = _run_stream(host, port, token, mode, barrier, state, counts, i)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(streams)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(duration + CONNECT_TIMEOUT + IO_TIMEOUT * 2)
+
+    per_second = [sum(c[s] for c in counts) for s in range(duration)]
+    samples = [round(b * 8 / 1e6, 2) for b in per_second]
+    measured = per_second[warmup:] or per_second
+    mbps = round(sum(measured) * 8 / 1e6 / max(1, len(measured)), 2)
+    return {
+        'mbps': mbps,
+        'bytes': sum(per_second),
+        'delivered': sum(delivered) if mode == 'U' else None,
+        'samples': samples,
+        'jitter': round(statistics.pstdev(samples[warmup:]), 2) if len(samples[warmup:]) > 1 else 0.0,
+        'errors': state['errors'][:5],
+    }
+
+
+def _check_forward(tunnel, add_forward):
+    """Tunnels installed before speedtest forwards existed need the operator's go-ahead."""
+    if tunnel['transport'] not in SPEEDTEST_TRANSPORTS:
+        raise SpeedtestError(f"Speedtests are not supported for {tunnel['transport']} tunnels")
+    if not add_forward and not speedtest_ports(parse_tunnel_config(tunnel['config'])):
+        raise SpeedtestError("This tunnel has no speedtest forward yet. Add a free port as "
+                             "'speedtest_port' on its edit page, or start the test with add_forward=1 "
+                             "(restarts the tunnel)")
+
+
+def _speedtest_forward(tunnel, config, add_forward=False):
+    """
+    Generator -> the tunnel's speedtest port. Tunnels installed before it
+    existed only get one with `add_forward`, through the normal apply path
+    (live reload for rathole, drained restart for the others).
+    """
+    ports = speedtest_ports(config)
+    if ports:
+        return ports[0]
+    _check_forward(tunnel, add_forward)
+    port = build_port_map().allocate(1, owner='speedtest forward')[0]
+    # held until the apply has written it to the DB, so a parallel install cannot take it
+    reserve([port], f"speedtest forward of tunnel #{tunnel['id']}")
+    try:
+        # an apply touches the host's units: same key as installs and edits on that host
+        with executor.hold_key(_tunnel_ssh(config)[0]):
+            for _, msg in process_tunnel_apply(tunnel['id'], {'speedtest_port': port}):
+                yield 5, f"Adding speedtest forward {port}: {msg}"
+    finally:
+        release([port])
+    return port
+
+
+def speedtest_steps(tunnel_id, streams=None, duration=None, warmup=None, out=None, add_forward=False):
+    """
+    Upload and download through the tunnel's speedtest forward, yielding
+    (progress, message). A throw-away sink is started on the remote end
+    behind that forward, and removed again afterwards. A tunnel without a
+    forward only gets one (and the restart that comes with it) with `add_forward`.
+    The result dict ends up in out['result'].
+    """
+    tunnel = get_tunnel_by_id(tunnel_id)
+    if not tunnel:
+        raise SpeedtestError(f"Tunnel {tunnel_id} not found")
+    cfg = load_config()
+    streams = max(1, min(MAX_STREAMS, int(streams or cfg.get('speedtest_streams', DEFAULT_STREAMS))))
+    duration = max(2, min(MAX_DURATION, int(duration or cfg.get('speedtest_duration', DEFAULT_DURATION))))
+    if warmup is None:
+        warmup = cfg.get('speedtest_warmup', DEFAULT_WARMUP)
+    warmup = max(0, min(duration - 1, int(warmup)))
+
+    if tunnel['transport'] not in SPEEDTEST_TRANSPORTS:
+        raise SpeedtestError(f"Speedtests are not supported for {tunnel['transport']} tunnels")
+    config = parse_tunnel_config(tunnel['config'])
+    port = yield from _speedtest_forward(tunnel, config, add_forward)
+    ssh_info = _tunnel_ssh(config)
+    token = secrets.token_hex(8)
+
+    yield 10, f"Starting sink on {ssh_info[0]} (127.0.0.1:{port})..."
+    start_sink(ssh_info, "127.0.0.1", port, token, 2 * duration + SINK_GRACE)
+    try:
+        # Round trip through the tunnel: the sink answers the probe request with ALAMOR-SINK
+        rtts = [r['rtt'] for r in (probe_port(port) for _ in range(3)) if r['ok']]
+        yield 20, f"Upload: {streams} streams x {duration}s (warm-up {warmup}s)..."
+        upload = measure_direction("127.0.0.1", port, token, 'U', streams, duration, warmup)
+        yield 55, f"Upload {upload['mbps']} Mbps. Download: {streams} streams x {duration}s..."
+        download = measure_direction("127.0.0.1", port, token, 'D', streams, duration, warmup)
+        yield 95, f"Download {download['mbps']} Mbps"
+    finally:
+        stop_sink(ssh_info, port)
+
+    result = {
+        'tunnel_id': tunnel_id, 'transport': tunnel['transport'], 'port': port,
+        'streams': streams, 'duration': duration, 'warmup': warmup,
+        'ping': round(statistics.median(rtts), 2) if rtts else None,
+        'upload': upload, 'download': download, 'finished_at': time.time(),
+    }
+    if out is not None:
+        out['result'] = result
+
+
+def run_tunnel_speedtest(tunnel_id, streams=None, duration=None, warmup=None, add_forward=False):
+    """Blocking variant (CLI / tests)."""
+    out = {}
+    for _ in speedtest_steps(tunnel_id, streams, duration, warmup, out, add_forward):
+        pass
+    return out['result']
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def process_tunnel_speedtest(tunnel_id, streams=None, duration=None, warmup=None, add_forward=False):
+    """Task generator for the executor; every run (or failure) lands in speedtest_history."""
+    out = {}
+    try:
+        yield from speedtest_steps(tunnel_id, streams, duration, warmup, out, add_forward)
+    except Exception as e:
+        tunnel = get_tunnel_by_id(tunnel_id)
+        add_speedtest_result(tunnel_id, tunnel['transport'] if tunnel else None, time.time(),
+                             None, None, None, error=str(e))
+        raise
+    result = out['result']
+    add_speedtest_result(tunnel_id, result['transport'], result['finished_at'], result['ping'],
+                         result['download']['mbps'], result['upload']['mbps'], result['streams'],
+                         result['duration'], detail={'upload': result['upload']['samples'],
+                                                     'download': result['download']['samples']})
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result=result)
+    yield 100, f"Up {result['upload']['mbps']} Mbps / Down {result['download']['mbps']} Mbps"
+
+
+def process_host_speedtest():
+    """Speedtest of the host's own uplink (no tunnel), as an executor task."""
+    yield 10, "Ping, download and upload from this server..."
+    result = run_advanced_speedtest()
+    result['finished_at'] = time.time()
+    add_speedtest_result(None, None, result['finished_at'], _num(result['ping']),
+                         _num(result['download']), _num(result['upload']),
+                         error=None if result['connectivity'] else result['message'])
+    task_id = current_task_id()
+    if task_id:
+        task_status.update(task_id, result=result)
+    yield 100, f"Ping {result['ping']} ms / Down {result['download']} Mbps / Up {result['upload']} Mbps"
+
+
+def link_key(tunnel_id):
+    """One speedtest in flight per link: a tunnel's link is its remote host."""
+    tunnel = get_tunnel_by_id(tunnel_id)
+    if not tunnel:
+        raise SpeedtestError(f"Tunnel {tunnel_id} not found")
+    return f"speedtest:{_tunnel_ssh(parse_tunnel_config(tunnel['config']))[0]}"
+
+
+_link_tasks = {}   # link key -> task_id of its last queued test
+_link_lock = threading.Lock()
+
+
+def _submit_once(link, func, args):
+    """
+    Queue a test unless the same link already has one queued/running.
+    All tests run under SPEEDTEST_KEY, so two never overlap (they would
+    only measure each other). Returns (task_id, started).
+    """
+    with _link_lock:
+        task_id = _link_tasks.get(link)
+        if task_id and executor.is_active(task_id):
+            return task_id, False
+        task_id = executor.submit(func, args, key=SPEEDTEST_KEY, priority=PRIORITY_LOW)
+        _link_tasks[link] = task_id
+        return task_id, True
+
+
+def start_tunnel_speedtest(tunnel_id, streams=None, duration=None, add_forward=False):
+    tunnel = get_tunnel_by_id(tunnel_id)
+    if not tunnel:
+        raise SpeedtestError(f"Tunnel {tunnel_id} not found")
+    _check_forward(tunnel, add_forward)
+    return _submit_once(link_key(tunnel_id), process_tunnel_speedtest,
+                        (tunnel_id, streams, duration, None, add_forward))
+
+
+def start_host_speedtest():
+    return _submit_once(HOST_LINK_KEY, process_host_speedtest, ())
+
+
+def speedtest_series(tunnel_id=None, since=0, limit=500):
+    """Chart-ready series: ts + ping/download/upload (failed runs as gaps)."""
+    rows = get_speedtest_history(tunnel_id, since, limit)
+    return {
+        'tunnel_id': tunnel_id,
+        'ts': [r['ts'] for r in rows],
+        'ping': [r['ping'] for r in rows],
+        'download': [r['download'] for r in rows],
+        'upload': [r['upload'] for r in rows],
+        'transport': [r['transport'] for r in rows],
+        'error': [r['error'] for r in rows],
+    }
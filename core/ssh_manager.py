@@ -2,49 +2,264 @@ import paramiko
 import time
 import socket
 import logging
+import threading
+import codecs
+import re
 import io
+from collections import deque
+from core.config_loader import load_config
+from core.tasks import emit_line, current_task_cancelled
 
 # Setup logger
 logger = logging.getLogger("SSHManager")
 
-class SSHManager:
-    def __init__(self):
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+CONNECT_TIMEOUT = 20
+KEEPALIVE_INTERVAL = 30     # paramiko keepalive packets (seconds)
+IDLE_TIMEOUT = 300          # close transports unused for this long
+HEALTH_CHECK_AFTER = 15     # probe a transport before reuse if idle longer than this
+DEFAULT_STEP_TIMEOUT = 900  # kill a remote step that runs longer than this (seconds)
+TAIL_LINES = 200            # output lines kept in memory per command
+MAX_LINE = 4096             # a line without newline is flushed at this size
+_LINE_SPLIT = re.compile(r'\r\n|\r|\n')  # pty output: apt/curl progress uses bare \r
+
 
-    def run_remote_command(self, ip, user, password, command, port=22, ssh_key=None):
+def _load_pkey(ssh_key):
+    if not ssh_key or not ssh_key.strip():
+        return None
+    for key_cls in (paramiko.RSAKey, paramiko.Ed25519Key, paramiko.ECDSAKey):
         try:
-            logger.info(f"Connecting to {ip}:{port}...")
-            
-            pkey = None
-            if ssh_key and ssh_key.strip():
+            return key_cls.from_private_key(io.StringIO(ssh_key))
+        except paramiko.SSHException:
+            continue
+    logger.warning("Could not parse SSH Key, falling back to password.")
+    return None
+
+
+class _PoolEntry:
+    def __init__(self, client):
+        self.client = client
+        self.transport = client.get_transport()
+        self.last_used = time.time()
+
+
+class SSHConnectionPool:
+    """
+    Keeps one authenticated paramiko Transport per (ip, port, user).
+    Every command opens a new channel on the existing transport, so the
+    TCP connect + key exchange + auth happens once per host, not per step.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, keepalive=KEEPALIVE_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._reaper = None
+        self.stats = {'connects': 0, 'reuses': 0, 'evictions': 0}
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _connect(self, ip, port, user, password, ssh_key):
+        logger.info(f"Connecting to {ip}:{port}...")
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        sock = socket.create_connection((ip, int(port)), timeout=CONNECT_TIMEOUT)
+        # Small request/response packets per channel: don't let Nagle delay them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.connect(
+            ip,
+            port=int(port),
+            sock=sock,
+            username=user,
+            password=password,
+            pkey=_load_pkey(ssh_key),
+            timeout=CONNECT_TIMEOUT,
+            banner_timeout=CONNECT_TIMEOUT,
+            auth_timeout=CONNECT_TIMEOUT,
+            allow_agent=False,
+            look_for_keys=False
+        )
+        client.get_transport().set_keepalive(self.keepalive)
+        self.stats['connects'] += 1
+        return _PoolEntry(client)
+
+    def _healthy(self, entry):
+        t = entry.transport
+        if t is None or not t.is_active() or not t.is_authenticated():
+            return False
+        if time.time() - entry.last_used > HEALTH_CHECK_AFTER:
+            try:
+                t.send_ignore()
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, ip, port, user, password=None, ssh_key=None, fresh=False):
+        """Return a live Transport for this host, connecting only if needed."""
+        key = (ip, int(port), user)
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry and (fresh or not self._healthy(entry)):
+                self._close(key)
+                entry = None
+            if entry is None:
+                entry = self._connect(ip, port, user, password, ssh_key)
+                with self._lock:
+                    self._entries[key] = entry
+            else:
+                self.stats['reuses'] += 1
+            entry.last_used = time.time()
+        self._ensure_reaper()
+        return entry.transport
+
+    def discard(self, ip, port, user):
+        self._close((ip, int(port), user))
+
+    def _close(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry:
+            self.stats['evictions'] += 1
+            try:
+                entry.client.close()
+            except Exception:
+                pass
+
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            stale = [k for k, e in self._entries.items()
+                     if now - e.last_used > self.idle_timeout or not e.transport.is_active()]
+        for key in stale:
+            self._close(key)
+        return len(stale)
+
+    def close_all(self):
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            self._close(key)
+
+    def _ensure_reaper(self):
+        if self._reaper and self._reaper.is_alive():
+            return
+        def reap():
+            while True:
+                time.sleep(min(60, self.idle_timeout))
                 try:
-                    pkey = paramiko.RSAKey.from_private_key(io.StringIO(ssh_key))
-                except paramiko.SSHException:
-                    try:
-                        pkey = paramiko.Ed25519Key.from_private_key(io.StringIO(ssh_key))
-                    except:
-                        logger.warning("Could not parse SSH Key, falling back to password.")
-
-            self.client.connect(
-                ip, 
-                port=int(port), 
-                username=user, 
-                password=password, 
-                pkey=pkey,
-                timeout=20,
-                allow_agent=False, 
-                look_for_keys=False
-            )
-            
-            stdin, stdout, stderr = self.client.exec_command(command, get_pty=True)
-            out = stdout.read().decode('utf-8', errors='ignore').strip()
-            err = stderr.read().decode('utf-8', errors='ignore').strip()
-            exit_status = stdout.channel.recv_exit_status()
-            self.client.close()
+                    self.evict_idle()
+                except Exception as e:
+                    logger.error(f"SSH pool reaper error: {e}")
+        self._reaper = threading.Thread(target=reap, name="ssh-pool-reaper", daemon=True)
+        self._reaper.start()
+
+
+ssh_pool = SSHConnectionPool()
+
+
+class SSHManager:
+    def __init__(self, pool=None, step_timeout=None):
+        self.pool = pool or ssh_pool
+        if step_timeout is None:
+            step_timeout = load_config().get('ssh_step_timeout', DEFAULT_STEP_TIMEOUT)
+        self.step_timeout = step_timeout
+
+    def open_channel(self, ip, user, password, port=22, ssh_key=None, fresh=False):
+        """New session channel on the pooled transport for this host."""
+        transport = self.pool.acquire(ip, port, user, password, ssh_key, fresh=fresh)
+        try:
+            return transport.open_session(timeout=CONNECT_TIMEOUT)
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            # Transport died between health check and use: reconnect once
+            logger.warning(f"Channel failed on pooled transport ({e}), reconnecting...")
+            transport = self.pool.acquire(ip, port, user, password, ssh_key, fresh=True)
+            return transport.open_session(timeout=CONNECT_TIMEOUT)
+
+    def open_sftp(self, ip, user, password, port=22, ssh_key=None):
+        """SFTP session on the same pooled transport (no extra handshake)."""
+        transport = self.pool.acquire(ip, port, user, password, ssh_key)
+        try:
+            return paramiko.SFTPClient.from_transport(transport)
+        except (paramiko.SSHException, socket.error, EOFError) as e:
+            logger.warning(f"SFTP failed on pooled transport ({e}), reconnecting...")
+            transport = self.pool.acquire(ip, port, user, password, ssh_key, fresh=True)
+            return paramiko.SFTPClient.from_transport(transport)
+
+    def stream_channel(self, chan, on_line=None, timeout=None, cancelled=None):
+        """
+        Read a running channel incrementally and hand every line to `on_line`
+        as soon as it arrives. Only the last TAIL_LINES lines are kept.
+        Returns (exit_status, tail_lines); exit_status is None on timeout/cancel.
+        `cancelled` (an Event) replaces the current task's flag in helper threads.
+        """
+        on_line = on_line or emit_line
+        is_cancelled = cancelled.is_set if cancelled is not None else current_task_cancelled
+        deadline = time.time() + timeout if timeout else None
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        tail = deque(maxlen=TAIL_LINES)
+        partial = ""
+
+        def flush(text, final=False):
+            parts = _LINE_SPLIT.split(text)
+            rest = "" if final else parts.pop()
+            for line in parts:
+                line = line.rstrip()
+                if line:
+                    tail.append(line)
+                    on_line(line)
+            if len(rest) > MAX_LINE:
+                flush(rest + "\n")
+                rest = ""
+            return rest
+
+        chan.settimeout(1.0)
+        while True:
+            try:
+                data = chan.recv(32768)
+            except socket.timeout:
+                data = None
+            if data:
+                partial = flush(partial + decoder.decode(data))
+            elif data == b"" or chan.exit_status_ready() and not chan.recv_ready():
+                break
+            if deadline and time.time() > deadline:
+                chan.close()
+                tail.append(f"Step timed out after {timeout}s")
+                return None, list(tail)
+            if is_cancelled():
+                chan.close()
+                tail.append("Cancelled")
+                return None, list(tail)
+
+        flush(partial + decoder.decode(b"", final=True), final=True)
+        return chan.recv_exit_status(), list(tail)
+
+    def run_remote_command(self, ip, user, password, command, port=22, ssh_key=None, fresh=False,
+                           on_line=None, timeout=None, cancelled=None):
+        """
+        Run `command` and stream its output line by line (to `on_line`, or to
+        the current task's log). A step longer than `timeout` is killed.
+        """
+        timeout = self.step_timeout if timeout is None else timeout
+        try:
+            chan = self.open_channel(ip, user, password, port, ssh_key, fresh=fresh)
+            try:
+                # With a pty stderr is merged into stdout
+                chan.get_pty()
+                chan.exec_command(command)
+                exit_status, lines = self.stream_channel(chan, on_line, timeout, cancelled)
+            finally:
+                chan.close()
+
+            full_output = "\n".join(lines).strip()
+
+            if exit_status is None:
+                logger.error(f"Command Aborted: {lines[-1] if lines else ''}")
+                return False, full_output
 
-            full_output = f"{out}\n{err}".strip()
-            
             if exit_status != 0:
                 logger.error(f"Command Failed: {full_output}")
                 return False, f"Exit Code {exit_status}: {full_output}"
@@ -60,5 +275,5 @@ def run_remote_command(ip, user, password, command, port=22, ssh_key=None):
     return SSHManager().run_remote_command(ip, user, password, command, port, ssh_key)
 
 def verify_ssh_connection(ip, user, password, port=22, ssh_key=None):
-    # Try a simple command to verify connection
-    return run_remote_command(ip, user, password, "whoami", port, ssh_key)[0]
\ No newline at end of file
+    # Always re-authenticate: a pooled transport must not hide wrong credentials
+    return SSHManager().run_remote_command(ip, user, password, "whoami", port, ssh_key, fresh=True)[0]
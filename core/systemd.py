@@ -0,0 +1,310 @@
+import os
+import time
+import subprocess
+import logging
+
+try:
+    import dbus  # python3-dbus, optional: falls back to batched systemctl calls
+except ImportError:
+    dbus = None
+
+logger = logging.getLogger("Systemd")
+
+SYSTEMD_DIR = "/etc/systemd/system"
+JOB_TIMEOUT = 90   # seconds a batch of start/stop jobs may take
+
+
+def _service(unit):
+    return unit if '.' in unit else f"{unit}.service"
+
+
+class SystemctlBackend:
+    """One `systemctl` call per verb for all units of a transaction (systemd runs the jobs in parallel)."""
+
+    def _run(self, *args):
+        try:
+            res = subprocess.run(["systemctl", *args], capture_output=True, text=True)
+        except FileNotFoundError:
+            logger.error("systemctl not found; unit changes were not applied")
+            return subprocess.CompletedProcess(["systemctl", *args], 1, "", "systemctl not found")
+        if res.returncode != 0:
+            logger.error(f"systemctl {' '.join(args)} failed: {res.stderr.strip()}")
+        return res
+
+    def _show(self, units):
+        """
+        unit -> {property: value} from one `systemctl show`, matched by Id.
+        (is-active / is-enabled print nothing for a missing unit, so their
+        lines cannot be mapped back to units by position.)
+        """
+        out = self._run("show", "-p", "Id", "-p", "ActiveState", "-p", "UnitFileState", "--", *units).stdout
+        props, current = {}, {}
+        for line in out.splitlines() + [""]:
+            if not line.strip():
+                if current.get('Id'):
+                    props[current['Id']] = current
+                current = {}
+                continue
+            key, _, value = line.partition('=')
+            current[key.strip()] = value.strip()
+        return props
+
+    def reload(self):
+        self._run("daemon-reload")
+
+    def enable(self, units):
+        self._run("enable", "--quiet", *units)
+
+    def disable(self, units):
+        self._run("disable", "--quiet", *units)
+
+    def start(self, units):
+        self._run("start", *units)
+
+    def stop(self, units):
+        self._run("stop", *units)
+
+    def restart(self, units):
+        self._run("restart", *units)
+
+    def active(self, units):
+        props = self._show(units)
+        return {u: props.get(u, {}).get('ActiveState') == 'active' for u in units}
+
+    def enabled(self, units):
+        props = self._show(units)
+        return {u: props.get(u, {}).get('UnitFileState') == 'enabled' for u in units}
+
+
+class DBusBackend:
+    """systemd's D-Bus API: jobs are queued together and awaited as a group."""
+
+    def __init__(self):
+        bus = dbus.SystemBus()
+        obj = bus.get_object('org.freedesktop.systemd1', '/org/freedesktop/systemd1')
+        self.manager = dbus.Interface(obj, 'org.freedesktop.systemd1.Manager')
+
+    def _wait(self, jobs):
+        deadline = time.time() + JOB_TIMEOUT
+        while jobs and time.time() < deadline:
+            queued = {str(job[4]) for job in self.manager.ListJobs()}
+            jobs = jobs & queued
+            if jobs:
+                time.sleep(0.1)
+        if jobs:
+            logger.error(f"{len(jobs)} systemd job(s) still running after {JOB_TIMEOUT}s")
+
+    def _jobs(self, method, units):
+        jobs = set()
+        for unit in units:
+            try:
+                jobs.add(str(getattr(self.manager, method)(unit, 'replace')))
+            except dbus.DBusException as e:
+                logger.error(f"{method} {unit} failed: {e.get_dbus_message()}")
+        self._wait(jobs)
+
+    def reload(self):
+        self.manager.Reload()
+
+    def enable(self, units):
+        self.manager.EnableUnitFiles(list(units), False, True)
+
+    def disable(self, units):
+        self.manager.DisableUnitFiles(list(units), False)
+
+    def start(self, units):
+        self._jobs('StartUnit', units)
+
+    def stop(self, units):
+        self._jobs('StopUnit', units)
+
+    def restart(self, units):
+        self._jobs('RestartUnit', units)
+
+    def active(self, units):
+        states = {str(u[0]): str(u[3]) for u in self.manager.ListUnitsByNames(list(units))}
+        return {u: states.get(u) == 'active' for u in units}
+
+    def enabled(self, units):
+        result = {}
+        for unit in units:
+            try:
+                result[unit] = str(self.manager.GetUnitFileState(unit)) == 'enabled'
+            except dbus.DBusException:
+                result[unit] = False
+        return result
+
+
+class FakeBackend:
+    """In-memory systemd for tests: records every call and tracks unit state."""
+
+    def __init__(self, active=(), enabled=()):
+        self.calls = []
+        self.active_units = set(active)
+        self.enabled_units = set(enabled)
+
+    def reload(self):
+        self.calls.append(('reload',))
+
+    def enable(self, units):
+        self.calls.append(('enable', tuple(units)))
+        self.enabled_units.update(units)
+
+    def disable(self, units):
+        self.calls.append(('disable', tuple(units)))
+        self.enabled_units.difference_update(units)
+
+    def start(self, units):
+        self.calls.append(('start', tuple(units)))
+        self.active_units.update(units)
+
+    def stop(self, units):
+        self.calls.append(('stop', tuple(units)))
+        self.active_units.difference_update(units)
+
+    def restart(self, units):
+        self.calls.append(('restart', tuple(units)))
+        self.active_units.update(units)
+
+    def active(self, units):
+        return {u: u in self.active_units for u in units}
+
+    def enabled(self, units):
+        return {u: u in self.enabled_units for u in units}
+
+
+_backend = None
+
+
+def default_backend():
+    global _backend
+    if _backend is None:
+        _backend = SystemctlBackend()
+        if dbus is not None:
+            try:
+                _backend = DBusBackend()
+            except Exception as e:
+                logger.info(f"systemd D-Bus API unavailable ({e}); using systemctl")
+    return _backend
+
+
+class UnitTransaction:
+    """
+    Groups unit changes and applies them in one pass:
+      1. stop + disable units that go away or are stopped (one batch each)
+      2. write / delete all unit files
+      3. one daemon-reload, only if a file changed
+      4. enable, restart and start as one batch per verb
+    Units that are already enabled / running are not touched again.
+    Usable as a context manager: commits on a clean exit.
+    """
+
+    def __init__(self, backend=None, unit_dir=SYSTEMD_DIR):
+        self.backend = backend or default_backend()
+        self.unit_dir = unit_dir
+        self._files = {}        # unit -> content
+        self._removed = []
+        self._removed_files = []   # rendered configs that go with removed units
+        self._verbs = {'enable': [], 'disable': [], 'start': [], 'stop': [], 'restart': []}
+        self.reload_needed = False
+
+    def path(self, unit):
+        return os.path.join(self.unit_dir, _service(unit))
+
+    def _add(self, verb, units):
+        for unit in map(_service, units):
+            if unit not in self._verbs[verb]:
+                self._verbs[verb].append(unit)
+        return self
+
+    def write(self, unit, content):
+        self._files[_service(unit)] = content
+        return self
+
+    def remove(self, unit, files=()):
+        """
+        Stop, disable and delete `unit` (skipped if it has no unit file) and
+        delete `files`, its rendered configs, after it has stopped.
+        """
+        unit = _service(unit)
+        if os.path.exists(self.path(unit)) and unit not in self._removed:
+            self._removed.append(unit)
+        return self.remove_files(*files)
+
+    def remove_files(self, *paths):
+        self._removed_files.extend(p for p in paths if p not in self._removed_files)
+        return self
+
+    def enable(self, *units):
+        return self._add('enable', units)
+
+    def disable(self, *units):
+        return self._add('disable', units)
+
+    def start(self, *units):
+        return self._add('start', units)
+
+    def stop(self, *units):
+        return self._add('stop', units)
+
+    def restart(self, *units):
+        return self._add('restart', units)
+
+    def _write_file(self, unit, content):
+        path = self.path(unit)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.alamor-new"
+        with open(tmp, "w") as fh:
+            fh.write(content)
+        os.replace(tmp, path)
+
+    def commit(self):
+        b, v = self.backend, self._verbs
+        stop = [u for u in v['stop'] + self._removed if u not in v['start'] and u not in v['restart']]
+        stop = list(dict.fromkeys(stop))
+        disable = list(dict.fromkeys(v['disable'] + self._removed))
+        summary = {'reload': False, 'stopped': stop, 'disabled': disable, 'removed': list(self._removed),
+                   'enabled': [], 'restarted': list(v['restart']), 'started': []}
+
+        if stop:
+            b.stop(stop)
+        if disable:
+            b.disable(disable)
+
+        for unit, content in self._files.items():
+            self._write_file(unit, content)
+        for path in [self.path(u) for u in self._removed] + self._removed_files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if self._files or self._removed or self.reload_needed:
+            b.reload()
+            summary['reload'] = True
+
+        enable = [u for u in v['enable'] if u not in disable]
+        if enable:
+            state = b.enabled(enable)
+            summary['enabled'] = [u for u in enable if not state.get(u)]
+            if summary['enabled']:
+                b.enable(summary['enabled'])
+        if v['restart']:
+            b.restart(v['restart'])
+        start = [u for u in v['start'] if u not in v['restart'] and u not in stop]
+        if start:
+            state = b.active(start)
+            summary['started'] = [u for u in start if not state.get(u)]
+            if summary['started']:
+                b.start(summary['started'])
+
+        logger.info(f"Unit transaction: {len(self._files)} written, {len(self._removed)} removed, "
+                    f"reload={summary['reload']}, restarted={summary['restarted']}, started={summary['started']}")
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
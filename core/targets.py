@@ -0,0 +1,270 @@
+import math
+import random
+import bisect
+import ipaddress
+
+# ==========================================
+# Scan target generation (IPv4 + IPv6)
+# ==========================================
+# هیچ لیستی از IPها ساخته نمی‌شود؛ هر آدرس از روی اندیسش محاسبه می‌شود.
+
+# https://www.cloudflare.com/ips-v4 , https://www.cloudflare.com/ips-v6
+CF_RANGES_V4 = [
+    "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22",
+    "141.101.64.0/18", "108.162.192.0/18", "190.93.240.0/20", "188.114.96.0/20",
+    "197.234.240.0/22", "198.41.128.0/17", "162.158.0.0/15", "104.16.0.0/13",
+    "104.24.0.0/14", "172.64.0.0/13", "131.0.72.0/22",
+]
+CF_RANGES_V6 = [
+    "2400:cb00::/32", "2606:4700::/32", "2803:f800::/32", "2405:b500::/32",
+    "2405:8100::/32", "2a06:98c0::/29", "2c0f:f248::/32",
+]
+
+BLOCK_PREFIX_V4 = 24     # hit statistics are kept per /24 ...
+BLOCK_PREFIX_V6 = 120    # ... and per /120 (256 addresses) for IPv6
+DEFAULT_EXPLORE = 0.25   # share of targets drawn uniformly even when good blocks are known
+REBUILD_EVERY = 64       # draws between refreshes of the block weights
+
+
+def parse_ranges(ranges):
+    """
+    CIDRs / single IPs as a list or a comma/space/newline separated string ->
+    collapsed ip_network list (overlaps removed, v4 first).
+    """
+    if isinstance(ranges, str):
+        ranges = ranges.replace(',', ' ').split()
+    nets = [ipaddress.ip_network(str(r).strip(), strict=False) for r in ranges if str(r).strip()]
+    v4 = ipaddress.collapse_addresses(n for n in nets if n.version == 4)
+    v6 = ipaddress.collapse_addresses(n for n in nets if n.version == 6)
+    return list(v4) + list(v6)
+
+
+def total_addresses(ranges):
+    return sum(n.num_addresses for n in parse_ranges(ranges))
+
+
+def iter_addresses(ranges):
+    """Every address of every range, in order, one at a time."""
+    for net in parse_ranges(ranges):
+        base = int(net.network_address)
+        for offset in range(net.num_addresses):
+            yield str(ipaddress.ip_address(base + offset))
+
+
+class _Space:
+    """Concatenation of several ranges addressed by one integer index."""
+
+    def __init__(self, ranges):
+        self.nets = parse_ranges(ranges)
+        self.bases = [int(n.network_address) for n in self.nets]
+        self.starts = []
+        self.families = []   # [(version, first index, size)]: v4 and v6 are contiguous
+        total = 0
+        for net in self.nets:
+            self.starts.append(total)
+            if self.families and self.families[-1][0] == net.version:
+                version, first, size = self.families[-1]
+                self.families[-1] = (version, first, size + net.num_addresses)
+            else:
+                self.families.append((net.version, total, net.num_addresses))
+            total += net.num_addresses
+        self.total = total
+
+    def address(self, idx):
+        r = bisect.bisect_right(self.starts, idx) - 1
+        return ipaddress.ip_address(self.bases[r] + idx - self.starts[r])
+
+    def index(self, ip):
+        ip = ipaddress.ip_address(ip)
+        for r, net in enumerate(self.nets):
+            if ip.version == net.version and ip in net:
+                return self.starts[r] + int(ip) - self.bases[r]
+        return None
+
+    def block_of(self, idx):
+        """(start, size) of the statistics block containing index `idx`."""
+        r = bisect.bisect_right(self.starts, idx) - 1
+        net = self.nets[r]
+        prefix = BLOCK_PREFIX_V4 if net.version == 4 else BLOCK_PREFIX_V6
+        size = 1 << (net.max_prefixlen - max(prefix, net.prefixlen))
+        offset = idx - self.starts[r]
+        return self.starts[r] + offset - offset % size, size
+
+
+class _Affine:
+    """Bijection on [0, n): i -> (a*i + b) mod n with gcd(a, n) = 1."""
+
+    def __init__(self, n, seed):
+        self.n = n
+        rnd = random.Random(seed)
+        a = rnd.randrange(1, n) if n > 1 else 1
+        while math.gcd(a, n) != 1:
+            a += 1
+        self.a = a
+        self.b = rnd.randrange(n) if n else 0
+        self._inv = pow(a, -1, n) if n > 1 else 0
+
+    def __call__(self, i):
+        return (self.a * i + self.b) % self.n
+
+    def position(self, value):
+        return ((value - self.b) * self._inv) % self.n if self.n > 1 else 0
+
+
+def permuted_targets(ranges, seed=0, start=0, count=None):
+    """
+    Every address of `ranges` exactly once in a seeded pseudo-random order.
+    Restart from any position with the same seed. Yields (position, ip).
+    """
+    space = _Space(ranges)
+    if not space.total:
+        return
+    perm = _Affine(space.total, seed)
+    end = space.total if count is None else min(space.total, start + count)
+    for pos in range(start, end):
+        yield pos, str(space.address(perm(pos)))
+
+
+class AdaptiveTargets:
+    """
+    Sampling without replacement that leans towards blocks (/24, /120) where
+    earlier probes succeeded.
+
+    - explore: the next address of a seeded permutation of one address
+      family; IPv4 and IPv6 take turns so a /32 of v6 cannot starve v4
+    - exploit: the next unused address of a good block, picked with weight
+      (hits + 1) / (probes + 2)
+    Call feedback(ip, ok) with probe results. state() is JSON-serialisable
+    and can be passed back in to resume. It stays small: what exploit
+    handed out is implied by each block's offset.
+    """
+
+    def __init__(self, ranges, seed=0, explore=DEFAULT_EXPLORE, state=None, start=0):
+        self.space = _Space(ranges)
+        self.seed = seed
+        self.explore = explore
+        # One permutation per family; the first keeps the plain seed so single-family resumes still line up
+        self._perms = [_Affine(size, seed if i == 0 else f"{seed}:{version}")
+                       for i, (version, _, size) in enumerate(self.space.families)]
+        self._rnd = random.Random(f"{seed}:{start}")
+        state = state or {}
+        cursors = state.get('cursors') or [state.get('cursor', start)]   # explore position per family
+        self.cursors = [cursors[i] if i < len(cursors) else 0 for i in range(len(self._perms))]
+        # block start -> [probes, hits, next offset inside block]
+        self.blocks = {int(k): v for k, v in state.get('blocks', {}).items()}
+        self.produced = state.get('produced', sum(self.cursors))
+        self._inner = {}   # block start -> permutation inside that block
+        self._good = None
+        self._cumulative = []
+        self._dirty = False
+        self._since_rebuild = 0
+
+    def state(self):
+        # Blocks without a hit never get exploited, no need to persist them
+        return {
+            'cursors': list(self.cursors),
+            'blocks': {str(k): v for k, v in self.blocks.items() if v[1] > 0},
+            'produced': self.produced,
+        }
+
+    def __iter__(self):
+        return self
+
+    def _family(self, idx):
+        for f, (_, first, size) in enumerate(self.space.families):
+            if idx < first + size:
+                return f, first
+        return None, None
+
+    def _exploited(self, idx):
+        """Handed out by exploit: inside its block's permutation, before the block's offset."""
+        start, size = self.space.block_of(idx)
+        st = self.blocks.get(start)
+        return bool(st) and st[2] > 0 and self._inner_perm(start, size).position(idx - start) < st[2]
+
+    def _explored(self, idx):
+        f, first = self._family(idx)
+        return self._perms[f].position(idx - first) < self.cursors[f]
+
+    def _explore(self):
+        # Equal share per family: draw from the one that has explored least so far
+        while True:
+            open_families = [f for f, perm in enumerate(self._perms) if self.cursors[f] < perm.n]
+            if not open_families:
+                return None
+            f = min(open_families, key=lambda i: self.cursors[i])
+            idx = self.space.families[f][1] + self._perms[f](self.cursors[f])
+            self.cursors[f] += 1
+            if not self._exploited(idx):
+                return idx
+
+    def _good_blocks(self):
+        # Rebuilding the weighted list is O(blocks); do it at most every REBUILD_EVERY draws
+        if self._good is None or (self._dirty and self._since_rebuild >= REBUILD_EVERY):
+            good = [(start, st) for start, st in self.blocks.items() if st[1] > 0 and not st[3:]]
+            cumulative, acc = [], 0.0
+            for _, st in good:
+                acc += (st[1] + 1) / (st[0] + 2)
+                cumulative.append(acc)
+            self._good, self._cumulative = good, cumulative
+            self._dirty, self._since_rebuild = False, 0
+        self._since_rebuild += 1
+        return self._good, self._cumulative
+
+    def _inner_perm(self, start, size):
+        inner = self._inner.get(start)
+        if inner is None:
+            inner = self._inner[start] = _Affine(size, f"{self.seed}:{start}")
+        return inner
+
+    def _next_in_block(self, start, st):
+        _, size = self.space.block_of(start)
+        inner = self._inner_perm(start, size)
+        while st[2] < size:
+            idx = start + inner(st[2])
+            st[2] += 1
+            if not self._explored(idx):
+                return idx
+        return None
+
+    def _exploit(self):
+        for _ in range(8):
+            good, cumulative = self._good_blocks()
+            if not good:
+                return None
+            pick = bisect.bisect_right(cumulative, self._rnd.random() * cumulative[-1])
+            start, st = good[min(pick, len(good) - 1)]
+            if st[3:]:
+                continue
+            idx = self._next_in_block(start, st)
+            if idx is not None:
+                return idx
+            st.append('done')   # block exhausted; dropped at the next rebuild
+            self._dirty, self._since_rebuild = True, REBUILD_EVERY
+        return None
+
+    def __next__(self):
+        if not self.space.total:
+            raise StopIteration
+        idx = None
+        if self._rnd.random() >= self.explore:
+            idx = self._exploit()
+        if idx is None:
+            idx = self._explore()
+        if idx is None:
+            idx = self._exploit()
+        if idx is None:
+            raise StopIteration
+        self.produced += 1
+        return str(self.space.address(idx))
+
+    def feedback(self, ip, ok):
+        idx = self.space.index(ip)
+        if idx is None:
+            return
+        start, _ = self.space.block_of(idx)
+        st = self.blocks.setdefault(start, [0, 0, 0])
+        st[0] += 1
+        if ok:
+            st[1] += 1
+            self._dirty = True
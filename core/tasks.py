@@ -1,13 +1,153 @@
-import queue
+import threading
+import time
+from collections import deque
 
-# صف مشترک برای مدیریت کارهای پس‌زمینه
-task_queue = queue.Queue()
-task_status = {}
+TASK_TTL = 3600            # finished tasks are kept this long (seconds)
+STALE_TASK_TTL = 6 * 3600  # tasks that stopped reporting are dropped after this
+LOG_BUFFER_SIZE = 500      # log lines kept per task
+FINISHED = ('completed', 'error', 'cancelled')
+
+
+class TaskRecord:
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.progress = 0
+        self.status = 'queued'
+        self.log = 'Waiting in queue...'
+        self.lines = deque(maxlen=LOG_BUFFER_SIZE)
+        self.next_offset = 0     # offset of the next line to be appended
+        self.result = None       # optional structured result (e.g. fleet table)
+        self.updated_at = time.time()
+
+    def snapshot(self):
+        snap = {'progress': self.progress, 'status': self.status, 'log': self.log, 'offset': self.next_offset}
+        if self.result is not None:
+            snap['result'] = self.result
+        return snap
+
+
+class TaskStore:
+    """
+    وضعیت تسک‌ها + بافر حلقوی لاگ هر تسک.
+    Each appended line gets a monotonically increasing offset so a browser
+    that reconnects can resume from the last offset it has seen.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._cond = threading.Condition()
+        self._last_evict = 0
+
+    def init(self, task_id):
+        with self._cond:
+            self._evict_locked()
+            rec = self._tasks[task_id] = TaskRecord(task_id)
+            self._append_locked(rec, rec.log)
+            self._cond.notify_all()
+
+    def update(self, task_id, progress=None, log=None, status=None, result=None):
+        with self._cond:
+            rec = self._tasks.get(task_id)
+            if rec is None:
+                rec = self._tasks[task_id] = TaskRecord(task_id)
+            if progress is not None:
+                rec.progress = progress
+            if status is not None:
+                rec.status = status
+            if result is not None:
+                rec.result = result
+            if log is not None:
+                rec.log = log
+                self._append_locked(rec, log)
+            rec.updated_at = time.time()
+            self._cond.notify_all()
+
+    def append_line(self, task_id, line):
+        """Extra output (e.g. remote command output) without touching `log`."""
+        with self._cond:
+            rec = self._tasks.get(task_id)
+            if rec is None:
+                return
+            self._append_locked(rec, line)
+            rec.updated_at = time.time()
+            self._cond.notify_all()
+
+    def _append_locked(self, rec, line):
+        rec.lines.append((rec.next_offset, line))
+        rec.next_offset += 1
+
+    # --- Readers ---
+    def get(self, task_id, default=None):
+        with self._cond:
+            rec = self._tasks.get(task_id)
+            return rec.snapshot() if rec else default
+
+    def __contains__(self, task_id):
+        with self._cond:
+            return task_id in self._tasks
+
+    def read(self, task_id, offset=0, timeout=None):
+        """
+        Lines with offset >= `offset` plus the task snapshot.
+        Blocks up to `timeout` seconds when there is nothing new.
+        Returns (lines, snapshot) or (None, None) if the task is unknown.
+        """
+        with self._cond:
+            def ready():
+                rec = self._tasks.get(task_id)
+                return rec is None or rec.next_offset > offset or rec.status in FINISHED
+            if timeout:
+                self._cond.wait_for(ready, timeout=timeout)
+            rec = self._tasks.get(task_id)
+            if rec is None:
+                return None, None
+            lines = [(i, text) for i, text in rec.lines if i >= offset]
+            return lines, rec.snapshot()
+
+    # --- TTL Eviction ---
+    def _evict_locked(self):
+        now = time.time()
+        if now - self._last_evict < 60:
+            return
+        self._last_evict = now
+        for task_id, rec in list(self._tasks.items()):
+            age = now - rec.updated_at
+            if (rec.status in FINISHED and age > TASK_TTL) or age > STALE_TASK_TTL:
+                del self._tasks[task_id]
+
+    def evict(self):
+        with self._cond:
+            self._last_evict = 0
+            self._evict_locked()
+            return len(self._tasks)
+
+
+task_status = TaskStore()
+
+# --- Current task of this thread (set by the executor) ---
+_current = threading.local()
+
+def set_current_task(task_id, cancelled=None):
+    _current.task_id = task_id
+    _current.cancelled = cancelled
+
+def current_task_id():
+    return getattr(_current, 'task_id', None)
+
+def current_task_cancelled():
+    ev = getattr(_current, 'cancelled', None)
+    return bool(ev and ev.is_set())
+
+def current_cancel_event():
+    """The running task's cancel Event, to hand to helper threads (thread-local otherwise)."""
+    return getattr(_current, 'cancelled', None)
+
+def emit_line(line):
+    """Append a line to the running task's log (no-op outside a task)."""
+    task_id = current_task_id()
+    if task_id:
+        task_status.append_line(task_id, line)
 
 def init_task(task_id):
     """جلوگیری از نمایش Undefined در لحظه اول"""
-    task_status[task_id] = {
-        'progress': 0, 
-        'status': 'queued', 
-        'log': 'Waiting in queue...'
-    }
\ No newline at end of file
+    task_status.init(task_id)
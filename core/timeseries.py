@@ -0,0 +1,91 @@
+import time
+import logging
+from core.database import get_rollup_marks, rollup_traffic, get_traffic_series
+
+logger = logging.getLogger("TrafficSeries")
+
+# (resolution seconds, how long that resolution is kept; None = forever)
+# 10s for an hour, 1m for a day, 1h for 90 days, daily forever.
+LEVELS = [
+    (10, 3600),
+    (60, 86400),
+    (3600, 90 * 86400),
+    (86400, None),
+]
+RAW_RES = LEVELS[0][0]
+DEFAULT_GRACE = 120      # seconds a bucket stays open for late samples before it is rolled up
+MAX_POINTS = 1500        # a chart never gets more points than this
+RANGES = {'1h': 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400, '90d': 90 * 86400, '1y': 365 * 86400}
+
+
+def bucket_of(ts, res=RAW_RES):
+    return int(ts) // res * res
+
+
+def rollup(now=None, grace=DEFAULT_GRACE):
+    """
+    Incremental downsampling: each level is built from the one below it, only
+    for complete buckets past its mark, and the source level is pruned to
+    its retention (never below what was already rolled up).
+    """
+    now = int(now or time.time())
+    marks = get_rollup_marks()
+    rolled = 0
+    for (src, keep), (dst, _) in zip(LEVELS, LEVELS[1:]):
+        start = marks.get(dst, 0)
+        # A level can only be rolled as far as its source is complete
+        ready = now - grace if src == RAW_RES else marks.get(src, 0)
+        end = ready // dst * dst
+        if end <= start:
+            continue
+        rolled += rollup_traffic(src, dst, start, end, prune_before=min((now - keep) // src * src, end))
+        marks[dst] = end
+    return rolled
+
+
+def pick_resolution(start, end, now=None, max_points=MAX_POINTS):
+    """Finest level that still covers `start` and stays under `max_points`."""
+    now = now or time.time()
+    for index, (res, keep) in enumerate(LEVELS):
+        if (keep is None or start >= now - keep - res) and (end - start) / res <= max_points:
+            return index
+    return len(LEVELS) - 1
+
+
+def _collect(index, start, end, group, marks, tunnel_id):
+    """Rows of level `index`, plus the not-yet-rolled tail from finer levels."""
+    res = LEVELS[index][0]
+    if index == 0:
+        return list(get_traffic_series(res, start, end, group, tunnel_id))
+    done = marks.get(res, 0)
+    rows = list(get_traffic_series(res, start, min(end, done), group, tunnel_id)) if done > start else []
+    if end > done:
+        rows += _collect(index - 1, max(start, done), end, group, marks, tunnel_id)
+    return rows
+
+
+def series(tunnel_id=None, start=None, end=None, max_points=MAX_POINTS):
+    """
+    Traffic over [start, end) at the right resolution for the span, gaps
+    filled with zeros. tunnel_id=None sums all tunnels.
+    Returns {'res', 'start', 'end', 'points': [[ts, rx, tx], ...]}.
+    """
+    now = time.time()
+    end = int(end or now)
+    start = int(start if start is not None else end - 86400)
+    index = pick_resolution(start, end, now, max_points)
+    res = LEVELS[index][0]
+    start = start // res * res
+    merged = {}
+    for row in _collect(index, start, end, res, get_rollup_marks(), tunnel_id):
+        point = merged.setdefault(row['ts'], [0, 0])
+        point[0] += row['rx'] or 0
+        point[1] += row['tx'] or 0
+    points = [[ts, *merged.get(ts, (0, 0))] for ts in range(start, end, res)]
+    return {'res': res, 'start': start, 'end': end, 'points': points}
+
+
+def series_for_range(range_name, tunnel_id=None):
+    span = RANGES.get(range_name, RANGES['24h'])
+    now = int(time.time())
+    return series(tunnel_id, now - span, now)
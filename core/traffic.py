@@ -5,6 +5,7 @@ import re
 import socket
 import requests
 import shutil
+from core import health
 def get_traffic_stats(port=None, proto='tcp'):
     """
     دریافت آمار مصرف شبکه (RX/TX)
@@ -17,12 +18,8 @@ def get_traffic_stats(port=None, proto='tcp'):
 
 def check_port_health(port):
     """بررسی اینکه آیا پورتی در حال گوش دادن است یا خیر"""
-    try:
-        # استفاده از ss برای سرعت بیشتر
-        result = subprocess.check_output(f"ss -tulpn | grep :{port}", shell=True).decode()
-        return bool(result.strip())
-    except:
-        return False
+    # از ایندکس /proc/net استفاده می‌شود (بدون اجرای ss برای هر پورت، بدون تطابق اشتباه :80 با :8080)
+    return health.check_port_health(port)
 
 def check_connectivity(target_ip, port=80, timeout=3):
     """
@@ -0,0 +1,92 @@
+import json
+import subprocess
+
+
+def parse_tunnel_config(raw):
+    """
+    Decode the `config` column of a tunnel row into a dict.
+    Older installs stored the config JSON-encoded twice, so keep decoding
+    while we still get a string back.
+    """
+    config = raw
+    for _ in range(3):
+        if not isinstance(config, str):
+            break
+        try:
+            config = json.loads(config)
+        except (ValueError, TypeError):
+            return {}
+    return config if isinstance(config, dict) else {}
+
+
+def _parse_port_token(token):
+    """'443', '443=127.0.0.1:443', '0.0.0.0:443', '2000-2010' -> list of ports"""
+    token = str(token).strip().strip('"')
+    if not token:
+        return []
+    # In backhaul rules the listen side is left of '='
+    listen = token.split('=')[0].strip()
+    if ':' in listen:
+        listen = listen.rsplit(':', 1)[1]
+    if '-' in listen:
+        start, _, end = listen.partition('-')
+        if start.isdigit() and end.isdigit():
+            start, end = int(start), int(end)
+            if 0 < start <= end <= 65535:
+                return list(range(start, end + 1))
+        return []
+    if listen.isdigit() and 0 < int(listen) <= 65535:
+        return [int(listen)]
+    return []
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return str(value).replace('\n', ',').split(',')
+
+
+def get_forwarded_ports(config, fallback_port=None):
+    """
+    Ports that carry user traffic on this (Iran) side of a tunnel.
+    `port_rules` (backhaul) and `ports` (rathole/hysteria) win; otherwise we
+    fall back to the tunnel's own listening port.
+    """
+    ports = set()
+    for key in ('port_rules', 'ports'):
+        for token in _as_list(config.get(key)):
+            ports.update(_parse_port_token(token))
+
+    if not ports:
+        for candidate in (config.get('client_port'), config.get('tunnel_port'), fallback_port):
+            found = _parse_port_token(candidate) if candidate is not None else []
+            if found:
+                ports.update(found)
+                break
+
+    return sorted(ports)
+
+
+def speedtest_ports(config):
+    """
+    [port] of the tunnel's dedicated speedtest forward (nothing listens behind
+    it on the remote except the throw-away sink), [] for older tunnels.
+    Kept out of get_forwarded_ports: it carries no user traffic.
+    """
+    value = config.get('speedtest_port')
+    return _parse_port_token(value)[:1] if value else []
+
+
+def get_tunnel_ports(tunnel):
+    """Same as get_forwarded_ports but straight from a `tunnels` row."""
+    config = parse_tunnel_config(tunnel['config'])
+    return get_forwarded_ports(config, fallback_port=tunnel['port'])
+
+
+def get_public_ip():
+    try:
+        return subprocess.check_output("curl -s https://api.ipify.org", shell=True, timeout=15).decode().strip()
+    except Exception:
+        return "127.0.0.1"
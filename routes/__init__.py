@@ -0,0 +1,8 @@
+from flask import Response, stream_with_context
+
+
+def sse_response(generator):
+    return Response(stream_with_context(generator), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # nginx نباید استریم را بافر کند
+    })
@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from core.database import get_connected_server, add_server, remove_server
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from core.database import get_connected_server, add_server, remove_server, get_servers
 from core.ssh_manager import verify_ssh_connection
+from core.executor import submit_task
+from core.fleet import process_fleet_rollout, DEFAULT_CONCURRENCY
 from routes.auth import login_required
 
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -51,4 +53,54 @@ def disconnect_server():
     except Exception as e:
         flash(f'Error disconnecting: {e}', 'danger')
         
-    return redirect(url_for('dashboard.index'))
\ No newline at end of file
+    return redirect(url_for('dashboard.index'))
+
+# --- Multi Server (Fleet) ---
+
+@dashboard_bp.route('/servers')
+@login_required
+def list_servers():
+    servers = [{'ip': s['ip'], 'user': s['user'], 'port': s['port'], 'label': s['label'],
+                'is_default': bool(s['is_default'])} for s in get_servers()]
+    return jsonify({'status': 'ok', 'servers': servers})
+
+@dashboard_bp.route('/servers/add', methods=['POST'])
+@login_required
+def add_fleet_server():
+    ip = request.form.get('ip')
+    user = request.form.get('username', 'root')
+    password = request.form.get('password')
+    ssh_key = request.form.get('ssh_key')
+    label = request.form.get('label')
+    port = request.form.get('port', 22, type=int)
+
+    if not ip or (not password and not ssh_key):
+        return jsonify({'status': 'error', 'message': 'IP and Authentication (Password OR SSH Key) are required.'})
+    if not verify_ssh_connection(ip, user, password, port, ssh_key):
+        return jsonify({'status': 'error', 'message': f'Connection to {ip} failed.'})
+
+    add_server(ip, user, password, ssh_key, port, label=label, make_default=False)
+    return jsonify({'status': 'ok'})
+
+@dashboard_bp.route('/servers/remove/<ip>', methods=['POST'])
+@login_required
+def remove_fleet_server(ip):
+    remove_server(ip)
+    return jsonify({'status': 'ok'})
+
+@dashboard_bp.route('/fleet/run', methods=['POST'])
+@login_required
+def fleet_run():
+    """اجرای یک اسکریپت روی چند سرور به صورت همزمان (خروجی از طریق task stream)"""
+    script = request.form.get('script', '').strip()
+    ips = [ip.strip() for ip in request.form.get('ips', '').split(',') if ip.strip()]
+    concurrency = request.form.get('concurrency', DEFAULT_CONCURRENCY, type=int)
+    if not script:
+        return jsonify({'status': 'error', 'message': 'Script is required.'})
+
+    servers = [dict(s) for s in get_servers(ips or None)]
+    if not servers:
+        return jsonify({'status': 'error', 'message': 'No matching servers.'})
+
+    task_id = submit_task(process_fleet_rollout, (servers, script, concurrency), key='fleet')
+    return jsonify({'status': 'started', 'task_id': task_id, 'servers': len(servers)})
@@ -1,8 +1,17 @@
 from flask import Blueprint, render_template, request, jsonify
 from core.ssl_manager import check_domain_dns, generate_letsencrypt_cert, setup_secure_panel_nginx
-from core.scanner import scan_for_clean_ip
+from core.scan_jobs import start_scan_job, get_job, list_jobs, cancel_scan_job, resume_scan_job, ACTIVE, DEFAULT_COUNT
+from core.scanner import DEFAULT_CONCURRENCY
+from core.targets import parse_ranges, CF_RANGES_V4, CF_RANGES_V6
+from core import clean_ips
+from core.sni_bench import process_sni_bench, CANDIDATES, DEFAULT_SAMPLES
+from core.executor import submit_task, PRIORITY_LOW
+from core.database import get_scan_hits
+from core.tasks import task_status
 from routes.auth import login_required
+from routes import sse_response
 import secrets
+import json
 import threading
 import time
 import os
@@ -26,9 +35,111 @@ def check_dns():
 @domains_bp.route('/domains/scan-ips', methods=['POST'])
 @login_required
 def scan_ips():
-    domain = request.form.get('domain')
-    ips, logs = scan_for_clean_ip(domain)
-    return jsonify({'status': 'ok', 'ips': ips, 'logs': logs})
+    domain = (request.form.get('domain') or '').strip()
+    if not domain:
+        return jsonify({'status': 'error', 'message': 'Domain is required'})
+    force = request.form.get('force') in ('1', 'true', 'on')
+    cached = clean_ips.warm(domain)
+    # Enough recently verified IPs: answer instantly, no sweep
+    if not force and clean_ips.is_warm(domain):
+        return jsonify({'status': 'cached', 'ips': cached})
+    try:
+        count = int(request.form.get('count', DEFAULT_COUNT))
+        concurrency = int(request.form.get('concurrency', DEFAULT_CONCURRENCY))
+        limit = int(request.form.get('limit', 0))
+        port = int(request.form.get('port', 443))
+        # Custom CIDR list (v4/v6) or the Cloudflare ranges (+ IPv6 if asked)
+        ranges = [str(n) for n in parse_ranges(request.form.get('ranges') or '')]
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid scan parameters'})
+    if not ranges:
+        ranges = CF_RANGES_V4 + (CF_RANGES_V6 if request.form.get('ipv6') in ('1', 'true', 'on') else [])
+    adaptive = request.form.get('adaptive', '1') not in ('0', 'false', 'off')
+    job_id = start_scan_job(domain, count=count, ranges=ranges, concurrency=concurrency, limit=limit,
+                            port=port, adaptive=adaptive)
+    return jsonify({'status': 'started', 'job_id': job_id, 'ips': cached})
+
+@domains_bp.route('/domains/clean-ips')
+@login_required
+def cached_clean_ips():
+    domain = (request.args.get('domain') or '').strip()
+    return jsonify({'domain': domain, 'ips': clean_ips.warm(domain)})
+
+@domains_bp.route('/domains/scans')
+@login_required
+def scan_jobs():
+    return jsonify({'jobs': list_jobs()})
+
+@domains_bp.route('/domains/scan/<job_id>')
+@login_required
+def scan_job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Scan not found'}), 404
+    return jsonify(job)
+
+@domains_bp.route('/domains/scan/<job_id>/cancel', methods=['POST'])
+@login_required
+def scan_job_cancel(job_id):
+    return jsonify({'status': 'ok' if cancel_scan_job(job_id) else 'error'})
+
+@domains_bp.route('/domains/scan/<job_id>/resume', methods=['POST'])
+@login_required
+def scan_job_resume(job_id):
+    return jsonify({'status': 'ok' if resume_scan_job(job_id) else 'error'})
+
+@domains_bp.route('/domains/scan/<job_id>/stream')
+@login_required
+def scan_job_stream(job_id):
+    """
+    SSE: `hit` events (id = hit row id, so Last-Event-ID resumes without
+    duplicates), `progress` after every checkpoint and a final `end` with the ranking.
+    """
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('after') or 0
+    try:
+        last_id = int(last_id)
+    except ValueError:
+        last_id = 0
+
+    def generate():
+        hit_id = last_id
+        log_offset = 0
+        yield "retry: 3000\n\n"
+        while True:
+            for hit in get_scan_hits(job_id, hit_id):
+                hit_id = hit['id']
+                yield f"id: {hit_id}\nevent: hit\ndata: {json.dumps(dict(hit))}\n\n"
+            job = get_job(job_id)
+            if job is None:
+                yield f"event: end\ndata: {json.dumps({'status': 'not_found'})}\n\n"
+                return
+            progress = {k: job[k] for k in ('status', 'cursor', 'total', 'probed', 'hits')}
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            if job['status'] not in ACTIVE:
+                yield f"event: end\ndata: {json.dumps({**progress, 'top': job['top'], 'error': job['error']})}\n\n"
+                return
+            # Wake up on the job's next log line (a hit or a checkpoint), at most once a second
+            time.sleep(1)
+            lines, snap = task_status.read(job_id, log_offset, timeout=15)
+            if snap is None:
+                time.sleep(5)  # job not loaded in this process yet (panel restarting)
+            else:
+                log_offset = snap['offset']
+                if not lines:
+                    yield ": keepalive\n\n"
+    return sse_response(generate())
+
+@domains_bp.route('/domains/sni-bench', methods=['POST'])
+@login_required
+def sni_bench():
+    """Benchmark SNI candidates in the background; follow it via the task stream."""
+    domains = (request.form.get('domains') or '').replace(',', ' ').split() or CANDIDATES
+    try:
+        samples = max(1, min(20, int(request.form.get('samples', DEFAULT_SAMPLES))))
+    except ValueError:
+        samples = DEFAULT_SAMPLES
+    task_id = submit_task(process_sni_bench, (domains, samples), key='sni-bench', priority=PRIORITY_LOW)
+    return jsonify({'status': 'started', 'task_id': task_id})
 
 @domains_bp.route('/domains/secure-panel', methods=['POST'])
 @login_required
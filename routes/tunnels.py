@@ -1,20 +1,27 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
-from core.database import Database, get_connected_server, add_tunnel, get_all_tunnels, get_tunnel_by_id, delete_tunnel_by_id, update_tunnel_config
+from core.database import Database, get_connected_server, add_tunnel, get_all_tunnels, get_tunnel_by_id, delete_tunnel_by_id, get_probe_stats
 from core.ssh_manager import SSHManager
 # تغییر مهم: فقط توابع موجود در منیجر جدید ایمپورت شدند
-from core.backhaul_manager import install_backhaul_bridge, generate_token, stop_and_delete_backhaul
+from core.backhaul_manager import install_backhaul_bridge, generate_token
 from core.rathole_manager import install_local_rathole, install_remote_rathole
 from core.hysteria_manager import install_hysteria_server_remote, install_hysteria_client_local, generate_pass
 from core.gost_manager import install_gost_server_remote, install_gost_client_local
-from core.traffic import get_traffic_stats, run_advanced_speedtest
-from core.tasks import task_queue, init_task, task_status
+from core.speedtest import start_tunnel_speedtest, start_host_speedtest, speedtest_series, SpeedtestError, SPEEDTEST_TRANSPORTS
+from core.accounting import accountant, get_tunnel_counters, get_all_counters
+from core.health import ports_health
+from core.prober import get_probe_summary
+from core.timeseries import series_for_range, RANGES
+from core.reload import process_tunnel_apply, queue_teardown
+from core.bulk import parse_manifest, validate_specs, process_bulk_create, process_bulk_delete, ManifestError
+from core.ports import build_port_map, local_ports, reserve, releasing, PORT_COUNT
+from core.systemd import UnitTransaction
+from core.utils import parse_tunnel_config, get_public_ip, _parse_port_token
+from core.tasks import task_status, FINISHED
+from core.executor import executor, submit_task
 from routes.auth import login_required
-import threading
-import time
-import uuid
-import subprocess
-import os
+from routes import sse_response
 import json
+import time
 
 tunnels_bp = Blueprint('tunnels', __name__)
 
@@ -25,23 +32,8 @@ def generic_error(log_message):
         'message': 'Operation failed. Please check server logs (journalctl -u alamor) for details.'
     })
 
-def run_task_in_background(task_id, func, args):
-    try:
-        task_status[task_id] = {'progress': 5, 'status': 'running', 'log': 'Starting process...'}
-        # اجرای تابع Generator
-        for percent, log_msg in func(*args):
-            task_status[task_id] = {'progress': percent, 'status': 'running', 'log': log_msg}
-            time.sleep(0.5)
-        task_status[task_id] = {'progress': 100, 'status': 'completed', 'log': 'Completed Successfully!'}
-    except Exception as e:
-        print(f"Task Failed: {e}")
-        task_status[task_id] = {'progress': 100, 'status': 'error', 'log': f"Error: {str(e)}"}
-
 def get_server_public_ip():
-    try:
-        return subprocess.check_output("curl -s https://api.ipify.org", shell=True).decode().strip()
-    except:
-        return "127.0.0.1"
+    return get_public_ip()
 
 # --- Install Logic Generators (Tasks) ---
 
@@ -126,15 +118,12 @@ def start_install(protocol):
         config['ssh_key'] = ssh_key
         config['ssh_port'] = ssh_port
         
-        task_id = str(uuid.uuid4())
-        init_task(task_id)
-        
         target_func = None
         args = ()
 
         if protocol == 'backhaul':
             # دریافت IP ایران برای کانفیگ کلاینت خارج
-            iran_ip = get_server_public_ip()
+            iran_ip = config['iran_ip'] = get_server_public_ip()
             config['token'] = generate_token()
             
             # پارس کردن قوانین پورت (Port Rules)
@@ -170,7 +159,7 @@ def start_install(protocol):
             args = (server_ip, config)
             
         elif protocol == 'rathole':
-            iran_ip = get_server_public_ip()
+            iran_ip = config['iran_ip'] = get_server_public_ip()
             raw = config.get('forward_ports', '')
             config['ports'] = [p.strip() for p in raw.split(',') if p.strip().isdigit()]
             config['token'] = config.get('token') or generate_token()
@@ -184,7 +173,22 @@ def start_install(protocol):
              args = (server_ip, config)
 
         if target_func:
-            threading.Thread(target=run_task_in_background, args=(task_id, target_func, args)).start()
+            # تداخل پورت قبل از هر کار SSH رد می‌شود، نه بعد از نصب با خطای systemd
+            ports = local_ports(protocol, config)
+            ports_map = build_port_map()
+            clash = ports_map.conflicts(ports)
+            if clash:
+                return jsonify({'status': 'error', 'message': 'Port conflict: ' + '; '.join(
+                    f"{port} is used by {owner}" for port, owner in clash)})
+            if protocol in SPEEDTEST_TRANSPORTS:
+                # یک فوروارد جدا برای تست سرعت، تا sink با سرویس اصلی سر پورت دعوا نکند
+                ports_map.claim(ports, 'install')
+                config['speedtest_port'] = ports_map.allocate(1)[0]
+                ports = local_ports(protocol, config)
+            reserve(ports, f"{protocol} install")
+
+            # نصب‌های یک سرور پشت سر هم اجرا می‌شوند (تداخل systemd)
+            task_id = submit_task(releasing(target_func, ports), args, key=server_ip)
             return jsonify({'status': 'started', 'task_id': task_id})
         
         return jsonify({'status': 'error', 'message': 'Unknown Protocol'})
@@ -200,6 +204,50 @@ def get_task_status_route(task_id):
         return jsonify({'progress': 0, 'status': 'not_found', 'log': 'Task not found'})
     return jsonify(status)
 
+@tunnels_bp.route('/api/task_cancel/<task_id>', methods=['POST'])
+@login_required
+def cancel_task_route(task_id):
+    if executor.cancel(task_id):
+        return jsonify({'status': 'ok'})
+    return jsonify({'status': 'error', 'message': 'Task not found or already finished'})
+
+@tunnels_bp.route('/api/executor_metrics')
+@login_required
+def executor_metrics_route():
+    return jsonify(executor.metrics())
+
+@tunnels_bp.route('/api/task_stream/<task_id>')
+@login_required
+def task_stream(task_id):
+    """
+    SSE پیشرفت نصب. هر خط لاگ یک event با id=offset است؛
+    مرورگر هنگام reconnect هدر Last-Event-ID را می‌فرستد و از همان‌جا ادامه می‌دهیم.
+    """
+    try:
+        offset = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        offset = 0
+    offset = max(offset, request.args.get('offset', 0, type=int))
+
+    def generate():
+        nonlocal offset
+        yield "retry: 2000\n\n"
+        while True:
+            lines, snap = task_status.read(task_id, offset, timeout=15)
+            if snap is None:
+                yield f"event: end\ndata: {json.dumps({'status': 'not_found', 'progress': 0, 'log': 'Task not found'})}\n\n"
+                return
+            for line_offset, text in lines:
+                payload = dict(snap, line=text, offset=line_offset)
+                yield f"id: {line_offset}\ndata: {json.dumps(payload)}\n\n"
+                offset = line_offset + 1
+            if snap['status'] in FINISHED:
+                yield f"event: end\ndata: {json.dumps(snap)}\n\n"
+                return
+            if not lines:
+                yield ": keepalive\n\n"
+    return sse_response(generate())
+
 @tunnels_bp.route('/delete/<int:tunnel_id>', methods=['POST'])
 @login_required
 def delete_tunnel_route(tunnel_id):
@@ -208,84 +256,193 @@ def delete_tunnel_route(tunnel_id):
         tunnel = get_tunnel_by_id(tunnel_id)
         if not tunnel: return jsonify({'status': 'error', 'message': 'Not found'})
         
-        transport = tunnel['transport']
-        
-        # هندل کردن پورت که ممکن است رشته باشد
-        try:
-            port = int(tunnel['local_port']) # معمولاً در دیتابیس local_port ذخیره می‌شود
-        except:
-            port = 0
-            
-        if transport == 'backhaul':
-            # استفاده از تابع اختصاصی منیجر که سرویس سرور ایران را پاک می‌کند
-            stop_and_delete_backhaul(port)
-            
-        elif transport == 'rathole':
-             service_name = f"rathole-iran{port}"
-             os.system(f"systemctl stop {service_name}")
-             os.system(f"systemctl disable {service_name}")
-             os.system(f"rm /etc/systemd/system/{service_name}.service")
-             
-        elif transport == 'hysteria':
-            service_name = "hysteria-client" # اگر چند تا هستند باید با پورت داینامیک شود
-            os.system(f"systemctl stop {service_name}")
-            os.system(f"systemctl disable {service_name}")
-            
-        elif transport == 'gost':
-             service_name = f"gost-client-{port}"
-             os.system(f"systemctl stop {service_name}")
-             os.system(f"systemctl disable {service_name}")
-             os.system(f"rm /etc/systemd/system/{service_name}.service")
-        
+        # همه‌ی تغییرات systemd در یک تراکنش: یک stop/disable، یک daemon-reload
+        with UnitTransaction() as tx:
+            queue_teardown(tunnel, tx)
         delete_tunnel_by_id(tunnel_id)
-        os.system("systemctl daemon-reload")
         return jsonify({'status': 'ok'})
     except Exception as e:
         return generic_error(str(e))
 
+@tunnels_bp.route('/tunnels/bulk', methods=['POST'])
+@login_required
+def bulk_create_route():
+    """ساخت چند تانل از یک manifest (JSON یا YAML)؛ همه قبل از هر تغییری اعتبارسنجی می‌شوند"""
+    server = get_connected_server()
+    if not server:
+        return jsonify({'status': 'error', 'message': 'No remote server connected!'})
+    try:
+        if request.is_json:
+            manifest = request.get_json()
+        else:
+            manifest = request.form.get('manifest') or request.get_data(as_text=True)
+        specs = parse_manifest(manifest)
+        configs = validate_specs(specs, tuple(server), get_server_public_ip())
+    except ManifestError as e:
+        return jsonify({'status': 'error', 'message': 'Invalid manifest', 'errors': e.errors})
+
+    reserve([p for protocol, config in configs for p in local_ports(protocol, config)], "bulk manifest")
+    # یک تسک برای کل manifest: یک نشست SSH، یک daemon-reload، یک تراکنش دیتابیس
+    task_id = submit_task(process_bulk_create, (configs,), key=server[0])
+    return jsonify({'status': 'started', 'task_id': task_id, 'count': len(configs)})
+
+@tunnels_bp.route('/tunnels/bulk-delete', methods=['POST'])
+@login_required
+def bulk_delete_route():
+    data = request.get_json(silent=True) or {}
+    raw = data.get('ids') if data else request.form.getlist('ids')
+    try:
+        ids = sorted({int(i) for i in raw or []})
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'ids must be tunnel ids'})
+    if not ids:
+        return jsonify({'status': 'error', 'message': 'No tunnels selected'})
+    # یک تسک برای هر سرور، با همان کلید نصب‌ها تا با نصب/ویرایش همان سرور همزمان نشود
+    by_host = {}
+    for tunnel in filter(None, map(get_tunnel_by_id, ids)):
+        host = parse_tunnel_config(tunnel['config']).get('ssh_ip')
+        by_host.setdefault(host, []).append(tunnel['id'])
+    if not by_host:
+        return jsonify({'status': 'error', 'message': 'No matching tunnels'})
+    task_ids = [submit_task(process_bulk_delete, (tids,), key=host) for host, tids in by_host.items()]
+    return jsonify({'status': 'started', 'task_id': task_ids[0], 'task_ids': task_ids,
+                    'count': sum(len(tids) for tids in by_host.values())})
+
+@tunnels_bp.route('/api/ports/check')
+@login_required
+def port_check_route():
+    """?ports=8080,9000-9010 -> پورت‌های گرفته‌شده و صاحبشان"""
+    ports = [p for token in request.args.get('ports', '').split(',') for p in _parse_port_token(token)]
+    clash = build_port_map().conflicts(ports)
+    return jsonify({'free': not clash, 'conflicts': [{'port': p, 'owner': o} for p, o in clash]})
+
+@tunnels_bp.route('/api/ports/free')
+@login_required
+def port_free_route():
+    """?count=N -> N پورت آزاد، یا ?range=N -> N پورت پشت سر هم"""
+    pm = build_port_map()
+    start = max(1, min(PORT_COUNT - 1, request.args.get('start', 10000, type=int)))
+    try:
+        if request.args.get('range'):
+            ports = pm.free_range(max(1, min(1000, request.args.get('range', type=int) or 1)), start=start)
+        else:
+            ports = pm.allocate(max(1, min(1000, request.args.get('count', 1, type=int))), start=start)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+    return jsonify({'status': 'ok', 'ports': ports})
+
 @tunnels_bp.route('/tunnels')
 @login_required
 def list_tunnels():
     tunnels = get_all_tunnels()
     return render_template('tunnels.html', tunnels=tunnels)
 
+def _stats_entry(snap):
+    rx, tx = snap['rx_bytes'], snap['tx_bytes']
+    return {
+        'rx': round(rx/1024/1024, 2), 'tx': round(tx/1024/1024, 2),
+        'rx_bytes': rx, 'tx_bytes': tx, 'ports': snap['ports']
+    }
+
+def _health_entry(tunnel_id, snap):
+    # وضعیت پورت‌ها از ایندکس سوکت‌ها (/proc/net) خوانده می‌شود
+    health = ports_health(snap['ports'])
+    entry = {'status': health['status'], 'listening': health['listening'], 'down_ports': health['down_ports']}
+    # تاخیر واقعی از پراب‌های سرتاسری (از داخل تانل)
+    probe = get_probe_summary(tunnel_id)
+    if probe:
+        entry.update({'latency': probe['latency'], 'latency_p50': probe['p50'], 'latency_p95': probe['p95'],
+                      'latency_p99': probe['p99'], 'loss': probe['loss'], 'probe_error': probe['error']})
+        # پورت باز است ولی پاسخی از سمت مقابل نمی‌آید
+        if entry['status'] == 'active' and probe['reachable'] is False:
+            entry['status'] = 'degraded'
+    return entry
+
+def _tunnel_entry(tunnel_id, snap):
+    return {**_stats_entry(snap), **_health_entry(tunnel_id, snap)}
+
 @tunnels_bp.route('/stats/<int:tunnel_id>')
 @login_required
 def tunnel_stats(tunnel_id):
-    tunnel = get_tunnel_by_id(tunnel_id)
-    if not tunnel: return jsonify({'error': 'Not found'})
-    try: port = int(tunnel['local_port'])
-    except: port = 0
-    transport = tunnel['transport']
-    proto = 'udp' if 'hysteria' in transport else 'tcp'
-    rx, tx = get_traffic_stats(port, proto)
-    return jsonify({'rx': round(rx/1024/1024, 2), 'tx': round(tx/1024/1024, 2)})
-
-@tunnels_bp.route('/run-speedtest/<int:tunnel_id>')
+    # فقط از اسنپ‌شات حافظه خوانده می‌شود (بدون iptables/ss در هر درخواست)
+    return jsonify(_tunnel_entry(tunnel_id, get_tunnel_counters(tunnel_id)))
+
+@tunnels_bp.route('/stats/<int:tunnel_id>/latency')
 @login_required
-def run_tunnel_speedtest_route(tunnel_id):
-    tunnel = get_tunnel_by_id(tunnel_id)
-    target_ip = None
-    if tunnel:
-        try:
-            config = json.loads(tunnel['config'])
-            connected_server = get_connected_server()
-            if connected_server:
-                target_ip = connected_server[0]
-        except: pass
-    result = run_advanced_speedtest(target_ip=target_ip)
-    result['tunnel_name'] = tunnel['name'] if tunnel else "Unknown"
-    result['status'] = 'ok'
-    return jsonify(result)
-
-@tunnels_bp.route('/server-speedtest')
+def tunnel_latency_history(tunnel_id):
+    """تاریخچه p50/p95/p99 پراب‌ها (پیش‌فرض: ۲۴ ساعت اخیر)"""
+    try:
+        hours = max(1, min(24 * 30, int(request.args.get('hours', 24))))
+    except ValueError:
+        hours = 24
+    rows = get_probe_stats(tunnel_id, time.time() - hours * 3600)
+    return jsonify({'tunnel_id': tunnel_id, 'points': [dict(r) for r in rows]})
+
+@tunnels_bp.route('/stats')
 @login_required
-def server_speedtest():
+def all_tunnel_stats():
+    """آمار همه تانل‌ها در یک درخواست"""
+    snaps = get_all_counters()
+    return jsonify({
+        'tunnels': {tid: _tunnel_entry(tid, snap) for tid, snap in snaps.items()},
+        'updated_at': accountant.updated_at
+    })
+
+@tunnels_bp.route('/stats/series')
+@login_required
+def traffic_series_route():
+    """ترافیک در بازه (1h/24h/7d/30d/...) با رزولوشن مناسب؛ بدون tunnel_id = مجموع همه تانل‌ها"""
+    range_name = request.args.get('range', '24h')
+    if range_name not in RANGES:
+        return jsonify({'status': 'error', 'message': f"range must be one of {', '.join(RANGES)}"}), 400
+    return jsonify(series_for_range(range_name, request.args.get('tunnel_id', type=int)))
+
+@tunnels_bp.route('/stats/stream')
+@login_required
+def stats_stream():
+    """SSE: فقط تانل‌هایی که مقدارشان تغییر کرده ارسال می‌شوند"""
+    def generate():
+        last = {}
+        version = -1
+        yield "retry: 5000\n\n"
+        while True:
+            accountant.refresh()  # no-op while the collector keeps the snapshot fresh
+            version = accountant.wait_for_update(version, timeout=15)
+            current = {tid: _tunnel_entry(tid, snap) for tid, snap in accountant.get_all().items()}
+            changed = {tid: v for tid, v in current.items() if last.get(tid) != v}
+            removed = [tid for tid in last if tid not in current]
+            last = current
+            if changed or removed:
+                yield f"data: {json.dumps({'tunnels': changed, 'removed': removed})}\n\n"
+            else:
+                yield ": keepalive\n\n"
+    return sse_response(generate())
+
+@tunnels_bp.route('/run-speedtest/<int:tunnel_id>', methods=['GET', 'POST'])
+@login_required
+def run_tunnel_speedtest_route(tunnel_id):
+    """تست سرعت از داخل خود تانل؛ به صف می‌رود و برای هر لینک فقط یکی همزمان اجرا می‌شود"""
     try:
-        result = run_advanced_speedtest()
-        return jsonify(result)
-    except Exception as e:
+        task_id, started = start_tunnel_speedtest(tunnel_id, streams=request.values.get('streams', type=int),
+                                                  duration=request.values.get('duration', type=int),
+                                                  add_forward=request.values.get('add_forward') == '1')
+    except SpeedtestError as e:
         return jsonify({'status': 'error', 'message': str(e)})
+    return jsonify({'status': 'started' if started else 'running', 'task_id': task_id})
+
+@tunnels_bp.route('/server-speedtest', methods=['GET', 'POST'])
+@login_required
+def server_speedtest():
+    task_id, started = start_host_speedtest()
+    return jsonify({'status': 'started' if started else 'running', 'task_id': task_id})
+
+@tunnels_bp.route('/speedtest/history')
+@login_required
+def speedtest_history_route():
+    """سری زمانی نتایج (برای چارت). بدون tunnel_id = تست‌های خود سرور"""
+    tunnel_id = request.args.get('tunnel_id', type=int)
+    hours = max(1, min(24 * 365, request.args.get('hours', 24 * 7, type=int)))
+    return jsonify(speedtest_series(tunnel_id, time.time() - hours * 3600))
 
 @tunnels_bp.route('/tunnel/edit/<int:tunnel_id>')
 @login_required
@@ -294,8 +451,7 @@ def edit_tunnel(tunnel_id):
     if not tunnel:
         flash('Tunnel not found!', 'danger')
         return redirect(url_for('tunnels.list_tunnels'))
-    try: config = json.loads(tunnel['config'])
-    except: config = {}
+    config = parse_tunnel_config(tunnel['config'])
     return render_template('edit_tunnel.html', tunnel=tunnel, config=config)
 
 @tunnels_bp.route('/tunnel/update/<int:tunnel_id>', methods=['POST'])
@@ -303,14 +459,20 @@ def edit_tunnel(tunnel_id):
 def update_tunnel(tunnel_id):
     tunnel = get_tunnel_by_id(tunnel_id)
     if not tunnel:
-        flash('Tunnel not found!', 'danger')
-        return redirect(url_for('tunnels.list_tunnels'))
-    config = request.form.to_dict()
+        return jsonify({'status': 'error', 'message': 'Tunnel not found'})
     try:
-        current_config = json.loads(tunnel['config'])
-        current_config.update(config) 
-        update_tunnel_config(tunnel_id, tunnel['name'], tunnel['transport'], tunnel['local_port'], json.dumps(current_config))
-        flash('Tunnel configuration updated (Service restart required).', 'success')
-    except Exception as e:
-        flash(f'Update failed: {str(e)}', 'danger')
-    return redirect(url_for('tunnels.list_tunnels'))
\ No newline at end of file
+        if request.is_json:
+            updates = request.get_json() or {}
+        elif 'config_json' in request.form:
+            updates = json.loads(request.form['config_json'])
+        else:
+            updates = request.form.to_dict()
+        if not isinstance(updates, dict):
+            raise ValueError("config must be a JSON object")
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid config: {e}'})
+
+    # کانفیگ جدید رندر و با کمترین اختلال اعمال می‌شود (reload زنده / switch / ری‌استارت با drain)
+    config = parse_tunnel_config(tunnel['config'])
+    task_id = submit_task(process_tunnel_apply, (tunnel_id, updates), key=config.get('ssh_ip') or f"tunnel-{tunnel_id}")
+    return jsonify({'status': 'started', 'task_id': task_id})
\ No newline at end of file
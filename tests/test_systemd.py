@@ -0,0 +1,129 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from core.systemd import UnitTransaction, FakeBackend, SystemctlBackend
+
+
+class RecordingBackend(FakeBackend):
+    """FakeBackend that also notes which unit files existed at each call."""
+
+    def __init__(self, unit_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.unit_dir = unit_dir
+        self.files_at = []
+
+    def _snapshot(self, verb):
+        self.files_at.append((verb, sorted(os.listdir(self.unit_dir))))
+
+    def stop(self, units):
+        self._snapshot('stop')
+        super().stop(units)
+
+    def reload(self):
+        self._snapshot('reload')
+        super().reload()
+
+
+class UnitTransactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.unit_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.unit_dir)
+
+    def _unit_file(self, unit, content="old"):
+        with open(os.path.join(self.unit_dir, f"{unit}.service"), "w") as f:
+            f.write(content)
+
+    def _verbs(self, backend):
+        return [call[0] for call in backend.calls]
+
+    def test_commit_order(self):
+        self._unit_file("old")
+        backend = RecordingBackend(self.unit_dir, active=["old.service"], enabled=["old.service"])
+        with UnitTransaction(backend, self.unit_dir) as tx:
+            tx.remove("old")
+            tx.write("new", "[Service]\n").enable("new").start("new")
+            tx.restart("other")
+        self.assertEqual(self._verbs(backend), ['stop', 'disable', 'reload', 'enable', 'restart', 'start'])
+        # files change after the stop and before the single reload
+        self.assertEqual(backend.files_at, [('stop', ['old.service']), ('reload', ['new.service'])])
+
+    def test_single_reload_for_many_units(self):
+        backend = FakeBackend()
+        tx = UnitTransaction(backend, self.unit_dir)
+        for i in range(20):
+            tx.write(f"unit{i}", "[Service]\n").enable(f"unit{i}").start(f"unit{i}")
+        summary = tx.commit()
+        self.assertEqual(self._verbs(backend), ['reload', 'enable', 'start'])
+        self.assertEqual(len(backend.calls[1][1]), 20)
+        self.assertTrue(summary['reload'])
+
+    def test_no_reload_without_file_changes(self):
+        backend = FakeBackend()
+        UnitTransaction(backend, self.unit_dir).restart("a").commit()
+        self.assertEqual(backend.calls, [('restart', ('a.service',))])
+
+    def test_enabled_and_running_units_are_left_alone(self):
+        backend = FakeBackend(active=["a.service"], enabled=["a.service"])
+        summary = UnitTransaction(backend, self.unit_dir).enable("a", "b").start("a", "b").commit()
+        self.assertEqual(backend.calls, [('enable', ('b.service',)), ('start', ('b.service',))])
+        self.assertEqual(summary['enabled'], ['b.service'])
+        self.assertEqual(summary['started'], ['b.service'])
+
+    def test_restart_wins_over_start_and_stop(self):
+        backend = FakeBackend()
+        UnitTransaction(backend, self.unit_dir).stop("a").start("a").restart("a").commit()
+        self.assertEqual(backend.calls, [('restart', ('a.service',))])
+
+    def test_remove_deletes_unit_and_config_files(self):
+        self._unit_file("gone")
+        config = os.path.join(self.unit_dir, "gone.toml")
+        open(config, "w").close()
+        backend = FakeBackend()
+        UnitTransaction(backend, self.unit_dir).remove("gone", files=[config]).commit()
+        self.assertEqual(os.listdir(self.unit_dir), [])
+        self.assertEqual(self._verbs(backend), ['stop', 'disable', 'reload'])
+
+    def test_remove_without_unit_file_is_skipped(self):
+        backend = FakeBackend()
+        summary = UnitTransaction(backend, self.unit_dir).remove("missing").commit()
+        self.assertEqual(backend.calls, [])
+        self.assertEqual(summary['removed'], [])
+
+    def test_no_commit_when_block_raises(self):
+        backend = FakeBackend()
+        with self.assertRaises(RuntimeError):
+            with UnitTransaction(backend, self.unit_dir) as tx:
+                tx.write("a", "[Service]\n").start("a")
+                raise RuntimeError("render failed")
+        self.assertEqual(backend.calls, [])
+        self.assertEqual(os.listdir(self.unit_dir), [])
+
+
+class SystemctlBackendTest(unittest.TestCase):
+
+    def _backend(self, stdout):
+        backend = SystemctlBackend()
+        backend._run = lambda *args: subprocess.CompletedProcess(["systemctl", *args], 0, stdout, "")
+        return backend
+
+    def test_states_are_matched_by_unit_id(self):
+        # a missing unit still gets its own block, so nothing shifts
+        out = ("Id=missing.service\nActiveState=inactive\nUnitFileState=\n\n"
+               "Id=a.service\nActiveState=active\nUnitFileState=enabled\n\n"
+               "Id=b.service\nActiveState=failed\nUnitFileState=disabled\n")
+        backend = self._backend(out)
+        units = ["missing.service", "a.service", "b.service"]
+        self.assertEqual(backend.enabled(units), {"missing.service": False, "a.service": True, "b.service": False})
+        self.assertEqual(backend.active(units), {"missing.service": False, "a.service": True, "b.service": False})
+
+    def test_unit_missing_from_output_is_not_active(self):
+        backend = self._backend("Id=a.service\nActiveState=active\nUnitFileState=enabled\n")
+        self.assertEqual(backend.active(["b.service", "a.service"]), {"b.service": False, "a.service": True})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -17,6 +17,14 @@ if [[ $confirm == "y" || $confirm == "Y" ]]; then
     # Stop tunnels
     systemctl stop hysteria-server hysteria-client 2>/dev/null
     systemctl stop backhaul 2>/dev/null
+
+    # Remove traffic accounting chains
+    for ipt in iptables ip6tables; do
+        $ipt -D INPUT -j ALAMOR_IN 2>/dev/null
+        $ipt -D OUTPUT -j ALAMOR_OUT 2>/dev/null
+        $ipt -F ALAMOR_IN 2>/dev/null && $ipt -X ALAMOR_IN 2>/dev/null
+        $ipt -F ALAMOR_OUT 2>/dev/null && $ipt -X ALAMOR_OUT 2>/dev/null
+    done
     
     echo -e "${RED}[-] Removing Files...${NC}"
     rm /etc/systemd/system/alamor.service